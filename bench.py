@@ -0,0 +1,552 @@
+"""Load test for the owners bot against a local stand-in for the GitHub API.
+
+FakeGitHub serves the REST endpoints the bot uses (PRs, files, labels,
+reviewers, assignees, merges, commit checks, workflow runs, teams) from in-memory state,
+with pagination, ETags, rate-limit headers and injectable latency. The
+harness replays a corpus of events through entrypoint.main() one at a time,
+as the Action would, and reports API calls per event, p50/p99 latency and
+throughput per event kind. With --baseline the report is compared against a
+stored one and the run fails when an event kind makes more API calls; p99
+latency and throughput are only compared with --latency-tolerance, since
+they depend on the machine the run is on.
+
+    python bench.py --events 2000 --baseline bench_baseline.json
+    python bench.py --events-file recorded.jsonl --json report.json
+"""
+import argparse
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, quote, unquote, urlencode, urlsplit
+
+import entrypoint
+
+_REPO = r"^/repos/(?P<repo>[^/]+/[^/]+)"
+
+# (method, path pattern, FakeGitHub method). Patterns are matched in order.
+ROUTES = [
+    ("GET", _REPO + r"/pulls$", "_list_pulls"),
+    ("GET", _REPO + r"/pulls/(?P<number>\d+)$", "_get_pull"),
+    ("GET", _REPO + r"/pulls/(?P<number>\d+)/files$", "_list_files"),
+    ("PUT", _REPO + r"/pulls/(?P<number>\d+)/merge$", "_merge"),
+    ("POST", _REPO + r"/pulls/(?P<number>\d+)/requested_reviewers$", "_request_reviewers"),
+    ("GET", _REPO + r"/issues/(?P<number>\d+)/labels$", "_get_labels"),
+    ("POST", _REPO + r"/issues/(?P<number>\d+)/labels$", "_add_labels"),
+    ("DELETE", _REPO + r"/issues/(?P<number>\d+)/labels/(?P<label>[^/]+)$", "_remove_label"),
+    ("POST", _REPO + r"/issues/(?P<number>\d+)/assignees$", "_assign"),
+    ("GET", _REPO + r"/commits/(?P<sha>[0-9a-f]+)/pulls$", "_commit_pulls"),
+    ("GET", _REPO + r"/commits/(?P<sha>[0-9a-f]+)/check-runs$", "_check_runs"),
+    ("GET", _REPO + r"/commits/(?P<sha>[0-9a-f]+)/status$", "_combined_status"),
+    ("GET", _REPO + r"/actions/runs$", "_list_runs"),
+    ("POST", _REPO + r"/actions/runs/(?P<run>\d+)/rerun-failed-jobs$", "_rerun"),
+    ("GET", r"^/orgs/(?P<org>[^/]+)/teams/(?P<slug>[^/]+)/members$", "_team_members"),
+    ("GET", r"^/orgs/(?P<org>[^/]+)/repos$", "_list_repos"),
+]
+ROUTES = [(method, re.compile(pattern), handler) for method, pattern, handler in ROUTES]
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send headers and body in one segment; otherwise Nagle's algorithm and
+    # delayed ACKs add ~40 ms to every keep-alive response.
+    disable_nagle_algorithm = True
+    wbufsize = 64 * 1024
+
+    def _reply(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        status, headers, payload = self.server.github.handle(self.command, self.path, self.headers, body)
+        data = b"" if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _reply
+
+    def log_message(self, *args):
+        pass
+
+class FakeGitHub:
+    """In-memory GitHub REST API served over HTTP on a local port.
+
+    Every response is delayed by `latency` seconds plus up to `jitter` more.
+    The primary rate limit is `rate_limit` requests per `rate_window` seconds
+    and is reported in X-RateLimit-* headers; once spent, requests get a 403
+    until the window resets. GETs carry an ETag and answer a matching
+    If-None-Match with a 304, which does not count against the limit. Calls
+    are counted per method and templated route in `calls`. Every check run
+    on a PR's head is treated as required: until all have passed the PR is
+    reported "blocked" and merges are refused.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit=1_000_000, rate_window=3600):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.rate_remaining = rate_limit
+        self.rate_reset = int(time.time()) + rate_window
+        self.lock = threading.Lock()
+        self.repos = {}
+        self.teams = {}
+        self.calls = Counter()
+        self.requests = 0
+        self.not_modified = 0
+        self.server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.github = self
+        threading.Thread(target=self.server.serve_forever, name="fake-github", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_pull(self, repo, number, author="author", labels=(), files=("README.md",), base="main",
+                 draft=False, mergeable=True, checks=()):
+        """Create (or replace) an open pull request; `checks` are check run names still in progress."""
+        with self.lock:
+            pulls = self.repos.setdefault(repo, {})
+            pulls[number] = {
+                "number": number,
+                "state": "open",
+                "draft": draft,
+                "merged": False,
+                "mergeable": mergeable,
+                "user": {"login": author},
+                "labels": list(dict.fromkeys(labels)),
+                "files": list(files),
+                "head": {"sha": hashlib.sha1(f"{repo}#{number}".encode()).hexdigest()},
+                "base": {"ref": base},
+                "requested_reviewers": [],
+                "assignees": [],
+                "checks": [{"name": name, "status": "in_progress", "conclusion": None} for name in checks],
+            }
+
+    def pull(self, repo, number):
+        return self.repos.get(repo, {}).get(number)
+
+    def complete_check(self, repo, number, name, conclusion="success"):
+        """Finish a check run on a PR's head commit."""
+        with self.lock:
+            for check in self.pull(repo, number)["checks"]:
+                if check["name"] == name:
+                    check.update(status="completed", conclusion=conclusion)
+
+    def _merge_state(self, pr):
+        if pr["merged"]:
+            return "unknown"
+        if not pr["mergeable"]:
+            return "dirty"
+        if any(check["conclusion"] != "success" for check in pr["checks"]):
+            return "blocked"
+        return "clean"
+
+    def handle(self, method, path, headers, body):
+        """Answer one request; returns (status, headers, JSON payload or None)."""
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+        parts = urlsplit(path)
+        query = dict(parse_qsl(parts.query))
+        for route_method, pattern, name in ROUTES:
+            match = pattern.match(parts.path) if route_method == method else None
+            if match:
+                break
+        else:
+            name, match = None, None
+
+        with self.lock:
+            self.requests += 1
+            self.calls[f"{method} {entrypoint._route(parts.path)}"] += 1
+            now = time.time()
+            if self.rate_reset <= now:
+                self.rate_remaining = self.rate_limit
+                self.rate_reset = int(now) + self.rate_window
+            if self.rate_remaining <= 0:
+                return 403, self._limit_headers(), {"message": "API rate limit exceeded"}
+            if name is None:
+                self.rate_remaining -= 1
+                return 404, self._limit_headers(), {"message": "Not Found"}
+            try:
+                payload = json.loads(body) if body else {}
+            except ValueError:
+                self.rate_remaining -= 1
+                return 400, self._limit_headers(), {"message": "Problems parsing JSON"}
+            status, extra, result = getattr(self, name)(query=query, payload=payload, **match.groupdict())
+
+            if method == "GET" and status == 200:
+                etag = '"%s"' % hashlib.sha1(json.dumps(result, sort_keys=True).encode()).hexdigest()
+                extra["ETag"] = etag
+                if headers.get("If-None-Match") == etag:
+                    self.not_modified += 1
+                    return 304, {**self._limit_headers(), "ETag": etag}, None
+            self.rate_remaining -= 1
+            return status, {**self._limit_headers(), **extra}, result
+
+    def _limit_headers(self):
+        return {
+            "X-RateLimit-Limit": str(self.rate_limit),
+            "X-RateLimit-Remaining": str(max(self.rate_remaining, 0)),
+            "X-RateLimit-Reset": str(self.rate_reset),
+        }
+
+    def _paginate(self, path, query, items):
+        per_page = min(int(query.get("per_page", 30)), 100)
+        page = int(query.get("page", 1))
+        last = max((len(items) + per_page - 1) // per_page, 1)
+        links = []
+        if page < last:
+            for rel, target in (("next", page + 1), ("last", last)):
+                link_query = urlencode({**query, "page": target})
+                links.append(f'<{self.url}{quote(path)}?{link_query}>; rel="{rel}"')
+        headers = {"Link": ", ".join(links)} if links else {}
+        return 200, headers, items[(page - 1) * per_page:page * per_page]
+
+    def _missing(self):
+        return 404, {}, {"message": "Not Found"}
+
+    def _pull_json(self, pr):
+        data = {key: value for key, value in pr.items() if key not in ("files", "checks")}
+        data["labels"] = self._labels(pr)
+        data["mergeable_state"] = self._merge_state(pr)
+        return data
+
+    def _head_pulls(self, repo, sha):
+        return [pr for pr in self.repos.get(repo, {}).values() if pr["head"]["sha"] == sha]
+
+    def _list_pulls(self, repo, query, payload):
+        pulls = [self._pull_json(pr) for _, pr in sorted(self.repos.get(repo, {}).items())
+                 if pr["state"] == query.get("state", "open")]
+        return self._paginate(f"/repos/{repo}/pulls", query, pulls)
+
+    def _get_pull(self, repo, number, query, payload):
+        pr = self.pull(repo, int(number))
+        return (200, {}, self._pull_json(pr)) if pr else self._missing()
+
+    def _list_files(self, repo, number, query, payload):
+        pr = self.pull(repo, int(number))
+        if pr is None:
+            return self._missing()
+        files = [{"filename": name, "status": "modified"} for name in pr["files"]]
+        return self._paginate(f"/repos/{repo}/pulls/{number}/files", query, files)
+
+    def _merge(self, repo, number, query, payload):
+        pr = self.pull(repo, int(number))
+        if pr is None:
+            return self._missing()
+        if self._merge_state(pr) != "clean":
+            return 405, {}, {"message": "Pull Request is not mergeable"}
+        if payload.get("sha", pr["head"]["sha"]) != pr["head"]["sha"]:
+            return 409, {}, {"message": "Head branch was modified. Review and try the merge again."}
+        pr.update(merged=True, state="closed")
+        return 200, {}, {"sha": pr["head"]["sha"], "merged": True, "message": "Pull Request successfully merged"}
+
+    def _request_reviewers(self, repo, number, query, payload):
+        pr = self.pull(repo, int(number))
+        if pr is None:
+            return self._missing()
+        pr["requested_reviewers"] = list(dict.fromkeys(pr["requested_reviewers"] + payload.get("reviewers", [])))
+        return 201, {}, self._pull_json(pr)
+
+    def _labels(self, pr):
+        return [{"name": label} for label in pr["labels"]]
+
+    def _get_labels(self, repo, number, query, payload):
+        pr = self.pull(repo, int(number))
+        return (200, {}, self._labels(pr)) if pr else self._missing()
+
+    def _add_labels(self, repo, number, query, payload):
+        pr = self.pull(repo, int(number))
+        if pr is None:
+            return self._missing()
+        pr["labels"] = list(dict.fromkeys(pr["labels"] + payload.get("labels", [])))
+        return 200, {}, self._labels(pr)
+
+    def _remove_label(self, repo, number, label, query, payload):
+        pr = self.pull(repo, int(number))
+        label = unquote(label)
+        if pr is None or label not in pr["labels"]:
+            return 404, {}, {"message": "Label does not exist"}
+        pr["labels"].remove(label)
+        return 200, {}, self._labels(pr)
+
+    def _assign(self, repo, number, query, payload):
+        pr = self.pull(repo, int(number))
+        if pr is None:
+            return self._missing()
+        pr["assignees"] = list(dict.fromkeys(pr["assignees"] + payload.get("assignees", [])))
+        return 201, {}, self._pull_json(pr)
+
+    def _commit_pulls(self, repo, sha, query, payload):
+        return 200, {}, [self._pull_json(pr) for pr in self._head_pulls(repo, sha)]
+
+    def _check_runs(self, repo, sha, query, payload):
+        runs = [dict(check) for pr in self._head_pulls(repo, sha) for check in pr["checks"]]
+        return 200, {}, {"total_count": len(runs), "check_runs": runs}
+
+    def _combined_status(self, repo, sha, query, payload):
+        return 200, {}, {"state": "pending", "statuses": [], "sha": sha}
+
+    def _list_runs(self, repo, query, payload):
+        return 200, {}, {"total_count": 0, "workflow_runs": []}
+
+    def _rerun(self, repo, run, query, payload):
+        return 201, {}, {}
+
+    def _team_members(self, org, slug, query, payload):
+        members = self.teams.get(f"{org}/{slug}")
+        if members is None:
+            return self._missing()
+        return self._paginate(f"/orgs/{org}/teams/{slug}/members", query, [{"login": m} for m in members])
+
+    def _list_repos(self, org, query, payload):
+        repos = [{"full_name": name, "archived": False} for name in sorted(self.repos) if name.startswith(f"{org}/")]
+        return self._paginate(f"/orgs/{org}/repos", query, repos)
+
+BENCH_OWNERS = {
+    "approvers": ["approver1", "approver2"],
+    "reviewers": ["approver1", "approver2", "reviewer1", "reviewer2", "reviewer3"],
+}
+
+# (weight, commenter, body) for generated comments.
+COMMENTS = [
+    (20, "reviewer1", "/lgtm"),
+    (15, "approver1", "/approve"),
+    (5, "reviewer2", "/lgtm cancel"),
+    (4, "approver2", "/hold"),
+    (4, "approver2", "/hold cancel"),
+    (4, "reviewer3", "/cc @approver2"),
+    (3, "reviewer2", "/label kind/bug"),
+    (3, "outsider", "/approve"),
+    (2, "approver1", "/lgtm\n/approve"),
+    (30, "outsider", "Thanks, looks reasonable to me."),
+    (10, "reviewer1", "> /lgtm\nNot yet, see the comment on line 12."),
+]
+
+def generate_events(count, repo="bench/repo", prs=50, seed=0):
+    """Return `count` synthetic webhook payloads spread over `prs` PRs.
+
+    The mix is mostly comments (commands and chatter), plus PR openings and
+    label events by people and by the bot. The same seed gives the same
+    corpus, so API call counts are reproducible.
+    """
+    rng = random.Random(seed)
+    comment_weights = [weight for weight, _, _ in COMMENTS]
+    bot = os.environ.get("BOT_LOGIN", "github-actions[bot]")
+    events = []
+    for _ in range(count):
+        number = rng.randint(1, prs)
+        kind = rng.choices(["comment", "opened", "label"], weights=[75, 10, 15])[0]
+        if kind == "comment":
+            _, user, body = rng.choices(COMMENTS, weights=comment_weights)[0]
+            events.append({"action": "created", "comment": {"body": body, "user": {"login": user}},
+                           "issue": {"number": number, "pull_request": {}},
+                           "repository": {"full_name": repo}})
+        elif kind == "opened":
+            events.append({"action": "opened",
+                           "pull_request": {"number": number, "user": {"login": "author"}},
+                           "repository": {"full_name": repo}})
+        else:
+            events.append({"action": rng.choice(["labeled", "unlabeled"]),
+                           "pull_request": {"number": number},
+                           "label": {"name": rng.choice(["lgtm", "approved", "kind/bug"])},
+                           "sender": {"login": rng.choice(["outsider", bot])},
+                           "repository": {"full_name": repo}})
+    return events
+
+def load_events(path):
+    """Read recorded webhook payloads, one JSON object per line."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+@contextmanager
+def _environment(values):
+    saved = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+def _reset_bot():
+    entrypoint._client = None
+    entrypoint._merge_controller = None
+    entrypoint._label_snapshots = None
+    entrypoint._team_cache = None
+    entrypoint._review_loads = None
+    entrypoint._tracer = None
+
+def replay(events, github, owners=BENCH_OWNERS, env=None):
+    """Run every event through entrypoint.main() against `github`.
+
+    Returns [(kind, seconds, api calls)] per event. The bot's client and
+    caches stay warm between events, as in webhook server mode; the
+    response and OWNERS caches live in a scratch directory.
+    """
+    with tempfile.TemporaryDirectory() as workspace:
+        with open(os.path.join(workspace, "OWNERS"), "w") as f:
+            json.dump(owners, f)
+        event_path = os.path.join(workspace, "event.json")
+        values = {
+            "GITHUB_TOKEN": "bench-token",
+            "GITHUB_API_URL": github.url,
+            "GITHUB_EVENT_PATH": event_path,
+            "GITHUB_EVENT_NAME": "bench",
+            "GITHUB_WORKSPACE": workspace,
+            "OWNERS_FILE": "OWNERS",
+            "OWNERS_CACHE_DIR": os.path.join(workspace, "cache"),
+            **(env or {}),
+        }
+        for event in events:
+            key = entrypoint.event_pr_key(event)
+            if key is not None and github.pull(*key) is None:
+                github.add_pull(*key)
+
+        samples = []
+        with _environment(values):
+            _reset_bot()
+            try:
+                for event in events:
+                    with open(event_path, "w") as f:
+                        json.dump(event, f)
+                    before = github.requests
+                    started = time.perf_counter()
+                    with redirect_stdout(io.StringIO()):
+                        try:
+                            entrypoint.main()
+                        except SystemExit:
+                            pass
+                    samples.append((entrypoint.event_kind(event) or "ignored",
+                                    time.perf_counter() - started, github.requests - before))
+            finally:
+                _reset_bot()
+        return samples
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def summarize(samples, elapsed):
+    """Build the report: per event kind and overall calls/event and latency."""
+    groups = {"all": samples}
+    for sample in samples:
+        groups.setdefault(sample[0], []).append(sample)
+    kinds = {}
+    for kind, group in sorted(groups.items()):
+        latencies = [seconds * 1000 for _, seconds, _ in group]
+        kinds[kind] = {
+            "events": len(group),
+            "calls_per_event": round(sum(calls for _, _, calls in group) / len(group), 3),
+            "p50_ms": round(_percentile(latencies, 0.50), 3),
+            "p99_ms": round(_percentile(latencies, 0.99), 3),
+        }
+    return {"events": len(samples), "throughput": round(len(samples) / elapsed, 1) if elapsed else None,
+            "kinds": kinds}
+
+def compare(report, baseline, latency_tolerance=None, calls_tolerance=0.0):
+    """Return the regressions of report against baseline, as messages.
+
+    API calls per event may not grow by more than `calls_tolerance` (a
+    fraction). p99 latency and throughput may be off by `latency_tolerance`,
+    and are not compared when it is None.
+    """
+    regressions = []
+    for kind, base in baseline.get("kinds", {}).items():
+        current = report["kinds"].get(kind)
+        if current is None:
+            continue
+        if current["calls_per_event"] > base["calls_per_event"] * (1 + calls_tolerance) + 1e-9:
+            regressions.append(f"{kind}: {current['calls_per_event']} API calls/event, baseline {base['calls_per_event']}")
+        if latency_tolerance is not None and base["p99_ms"] and current["p99_ms"] > base["p99_ms"] * (1 + latency_tolerance):
+            regressions.append(f"{kind}: p99 {current['p99_ms']} ms, baseline {base['p99_ms']} ms")
+    if latency_tolerance is not None and baseline.get("throughput") and report["throughput"] and \
+            report["throughput"] * (1 + latency_tolerance) < baseline["throughput"]:
+        regressions.append(f"throughput {report['throughput']} events/s, baseline {baseline['throughput']}")
+    return regressions
+
+def format_report(report, github=None):
+    lines = [f"{report['events']} events, {report['throughput']} events/s", "",
+             f"{'kind':<10} {'events':>7} {'calls/event':>12} {'p50 ms':>9} {'p99 ms':>9}"]
+    for kind, row in report["kinds"].items():
+        lines.append(f"{kind:<10} {row['events']:>7} {row['calls_per_event']:>12} {row['p50_ms']:>9} {row['p99_ms']:>9}")
+    if github is not None:
+        lines += ["", f"{'route':<52} {'calls':>7}"]
+        for route, count in github.calls.most_common():
+            lines.append(f"{route:<52} {count:>7}")
+        lines.append(f"{'(304 Not Modified)':<52} {github.not_modified:>7}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=2000, help="number of generated events (default: 2000)")
+    parser.add_argument("--events-file", help="replay recorded payloads from this JSON-lines file instead")
+    parser.add_argument("--prs", type=int, default=50, help="PRs the generated events are spread over")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=2.0, help="injected API latency in ms (default: 2)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random API latency in ms")
+    parser.add_argument("--rate-limit", type=int, default=1_000_000, help="requests per hour the stand-in allows")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="fail on regressions against this stored report")
+    parser.add_argument("--update-baseline", action="store_true", help="write the report to --baseline instead")
+    parser.add_argument("--latency-tolerance", type=float,
+                        help="also fail when p99 latency or throughput regress by more than this fraction")
+    args = parser.parse_args(argv)
+
+    events = load_events(args.events_file) if args.events_file else \
+        generate_events(args.events, prs=args.prs, seed=args.seed)
+    github = FakeGitHub(latency=args.latency / 1000, jitter=args.jitter / 1000, rate_limit=args.rate_limit).start()
+    try:
+        started = time.perf_counter()
+        samples = replay(events, github)
+        report = summarize(samples, time.perf_counter() - started)
+    finally:
+        github.stop()
+
+    print(format_report(report, github))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"\nBaseline written to {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), latency_tolerance=args.latency_tolerance)
+        if regressions:
+            print("\n❌ Regressions against the baseline:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print("\n✅ No regressions against the baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,1659 @@
 import os
-import yaml
-import requests
+import contextvars
+import importlib.util
 import json
+import hashlib
+import hmac
 import sys
 import random
+import re
+import threading
+import time
+import heapq
+import weakref
+import itertools
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import partial, wraps
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit, urlunsplit
+
+def _lazy_import(name):
+    """Import a module on first attribute access instead of at startup.
+
+    Most Action runs exit early (unsupported events, unprotected labels), so
+    requests, yaml and asyncio are only loaded once something needs them.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+requests = _lazy_import("requests")
+yaml = _lazy_import("yaml")
+asyncio = _lazy_import("asyncio")
+
+class Tracer:
+    """Collects timed spans for the handlers and API calls of a run.
+
+    Spans nest per thread and asyncio task (and follow work handed to
+    asyncio.to_thread) and carry free-form attributes. Nothing is recorded
+    unless an output is configured; flush() then appends the spans to
+    `trace_file` as JSON lines, a timing table to `summary_file` (the GitHub
+    step summary) and sends them as OTLP/HTTP JSON to `otlp_endpoint`.
+    """
+
+    def __init__(self, trace_file=None, summary_file=None, otlp_endpoint=None, service="owners-bot"):
+        self.trace_file = trace_file
+        self.summary_file = summary_file
+        self.otlp_endpoint = otlp_endpoint
+        self.service = service
+        self.enabled = bool(trace_file or summary_file or otlp_endpoint)
+        self.lock = threading.Lock()
+        self.current = contextvars.ContextVar(f"span-{id(self)}", default=None)
+        self.spans = []
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Time the enclosed block; yields its attribute dict for the block to fill in."""
+        if not self.enabled:
+            yield attributes
+            return
+        parent = self.current.get()
+        span = {
+            "name": name,
+            "trace_id": parent["trace_id"] if parent else os.urandom(16).hex(),
+            "span_id": os.urandom(8).hex(),
+            "parent_id": parent["span_id"] if parent else None,
+            "start": time.time(),
+            "status": "ok",
+            "attributes": attributes,
+        }
+        token = self.current.set(span)
+        started = time.perf_counter()
+        try:
+            yield attributes
+        except Exception as e:
+            span["status"] = "error"
+            attributes["error"] = repr(e)
+            raise
+        finally:
+            span["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            self.current.reset(token)
+            with self.lock:
+                self.spans.append(span)
+
+    def summary(self, spans):
+        """Render spans as Markdown tables of time per span and per API route."""
+        by_name, by_route = {}, {}
+        for span in spans:
+            rows = [(by_name, span["name"])]
+            if span["name"] == "api":
+                rows.append((by_route, f"{span['attributes'].get('method', '').upper()} {span['attributes'].get('route', '')}"))
+            for table, key in rows:
+                row = table.setdefault(key, [0, 0.0, 0.0, 0])
+                row[0] += 1
+                row[1] += span["duration_ms"]
+                row[2] = max(row[2], span["duration_ms"])
+                row[3] += span["attributes"].get("retries", 0)
+        lines = ["### Owners bot timing", "", "| Span | Count | Total ms | Max ms |", "| --- | --- | --- | --- |"]
+        for name, (count, total, longest, _) in sorted(by_name.items(), key=lambda item: -item[1][1]):
+            lines.append(f"| {name} | {count} | {total:.1f} | {longest:.1f} |")
+        if by_route:
+            lines += ["", "| API route | Calls | Total ms | Max ms | Retries |", "| --- | --- | --- | --- | --- |"]
+            for route, (count, total, longest, retries) in sorted(by_route.items(), key=lambda item: -item[1][1]):
+                lines.append(f"| `{route}` | {count} | {total:.1f} | {longest:.1f} | {retries} |")
+        return "\n".join(lines) + "\n"
+
+    def otlp(self, spans):
+        """Return spans as an OTLP/HTTP JSON export request."""
+        def value(v):
+            if isinstance(v, bool):
+                return {"boolValue": v}
+            if isinstance(v, int):
+                return {"intValue": str(v)}
+            if isinstance(v, float):
+                return {"doubleValue": v}
+            return {"stringValue": str(v)}
+
+        otlp_spans = []
+        for span in spans:
+            start = int(span["start"] * 1e9)
+            otlp_spans.append({
+                "traceId": span["trace_id"],
+                "spanId": span["span_id"],
+                "parentSpanId": span["parent_id"] or "",
+                "name": span["name"],
+                "kind": 1,
+                "startTimeUnixNano": str(start),
+                "endTimeUnixNano": str(start + int(span["duration_ms"] * 1e6)),
+                "attributes": [{"key": k, "value": value(v)} for k, v in span["attributes"].items()],
+                "status": {"code": 2 if span["status"] == "error" else 1},
+            })
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service}}]},
+            "scopeSpans": [{"scope": {"name": self.service}, "spans": otlp_spans}],
+        }]}
+
+    def flush(self):
+        """Write out and forget the spans recorded so far."""
+        with self.lock:
+            spans, self.spans = self.spans, []
+        if not spans:
+            return
+        try:
+            if self.trace_file:
+                with open(self.trace_file, "a") as f:
+                    f.writelines(json.dumps(span) + "\n" for span in spans)
+            if self.summary_file:
+                with open(self.summary_file, "a") as f:
+                    f.write(self.summary(spans))
+        except OSError as e:
+            print(f"Could not write trace: {e}")
+        if self.otlp_endpoint:
+            try:
+                requests.post(f"{self.otlp_endpoint.rstrip('/')}/v1/traces", json=self.otlp(spans), timeout=5)
+            except requests.RequestException as e:
+                print(f"Could not export trace: {e}")
+
+_tracer = None
+
+def get_tracer():
+    """Return the process-wide Tracer configured by TRACE_FILE, TRACE_SUMMARY
+    and OTEL_EXPORTER_OTLP_ENDPOINT."""
+    global _tracer
+    if _tracer is None:
+        summary = os.environ.get("TRACE_SUMMARY", "false").lower() in ["true", "1", "yes"]
+        _tracer = Tracer(
+            trace_file=os.environ.get("TRACE_FILE"),
+            summary_file=os.environ.get("GITHUB_STEP_SUMMARY") if summary else None,
+            otlp_endpoint=os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT"),
+        )
+    return _tracer
+
+def traced(name):
+    """Decorator that records each call of a function as a span."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_tracer().span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def traced_async(name):
+    """traced() for coroutine functions."""
+    def decorate(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with get_tracer().span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+_ROUTE_REPO = re.compile(r"^/repos/[^/]+/[^/]+")
+_ROUTE_NUMBER = re.compile(r"/\d+(?=/|$)")
+
+def _route(url):
+    """Return an API URL's path with the repository and numbers templated."""
+    path = _ROUTE_REPO.sub("/repos/{repo}", urlsplit(url).path)
+    return _ROUTE_NUMBER.sub("/{n}", path)
+
+DEFAULT_API_URL = "https://api.github.com"
+
+RETRY_STATUSES = {403, 429, 500, 502, 503, 504}
+
+# GitHub asks clients to wait at least a minute after a secondary rate limit
+# that comes without a Retry-After header.
+SECONDARY_LIMIT_WAIT = 60.0
+
+def _secondary_limit(response):
+    try:
+        return "secondary rate limit" in (response.text or "").lower()
+    except (TypeError, ValueError):
+        return False
+
+def _header_float(response, name):
+    try:
+        return float(response.headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+CACHED_HEADERS = ("ETag", "Last-Modified", "Link", "Content-Type")
+
+class ResponseCache:
+    """Size-bounded LRU cache of GET responses, revalidated with ETags.
+
+    Each entry keeps the body and validators of a 200 response. With `path`
+    entries are stored one file per URL so they survive between runs;
+    without it they are kept in memory. Once the bodies exceed `max_bytes`
+    the least recently used entries are evicted.
+    """
+
+    def __init__(self, path=None, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.sizes = OrderedDict()
+        self.memory = {}
+        self.total = 0
+        if path:
+            try:
+                names = [name for name in os.listdir(path) if name.endswith(".json")]
+            except OSError:
+                names = []
+            stats = []
+            for name in names:
+                # Another run sharing the directory may evict files meanwhile.
+                try:
+                    stat = os.stat(os.path.join(path, name))
+                except OSError:
+                    continue
+                stats.append((stat.st_mtime, name[:-5], stat.st_size))
+            for _, key, size in sorted(stats):
+                self.sizes[key] = size
+            self.total = sum(self.sizes.values())
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.json")
+
+    def lookup(self, key):
+        """Return the cached entry for key, or None."""
+        with self.lock:
+            if key not in self.sizes:
+                return None
+            self.sizes.move_to_end(key)
+            if not self.path:
+                return self.memory[key]
+        try:
+            with open(self._file(key), "r") as f:
+                entry = json.load(f)
+            os.utime(self._file(key))
+            return entry
+        except (OSError, ValueError):
+            return None
+
+    def store(self, key, response):
+        """Cache a 200 response if it carries a validator."""
+        headers = {name: response.headers.get(name) for name in CACHED_HEADERS}
+        if not isinstance(headers["ETag"], str) and not isinstance(headers["Last-Modified"], str):
+            return
+        entry = {
+            "url": response.url,
+            "headers": {name: value for name, value in headers.items() if isinstance(value, str)},
+            "body": response.text,
+        }
+        size = len(entry["body"])
+        with self.lock:
+            self.total += size - self.sizes.pop(key, 0)
+            self.sizes[key] = size
+            evicted = []
+            while self.total > self.max_bytes and len(self.sizes) > 1:
+                old_key, old_size = self.sizes.popitem(last=False)
+                self.total -= old_size
+                self.memory.pop(old_key, None)
+                evicted.append(old_key)
+            if not self.path:
+                self.memory[key] = entry
+                return
+        try:
+            for old_key in evicted:
+                os.remove(self._file(old_key))
+        except OSError:
+            pass
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            tmp_file = f"{self._file(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_file, self._file(key))
+        except OSError as e:
+            print(f"Could not write response cache: {e}")
+
+def _cached_response(entry):
+    """Rebuild a 200 response from a cache entry."""
+    response = requests.Response()
+    response.status_code = 200
+    response.headers.update(entry["headers"])
+    response._content = entry["body"].encode("utf-8")
+    response.encoding = "utf-8"
+    response.url = entry["url"]
+    return response
+
+def _offline_response(url):
+    """Answer a request an offline client does not send."""
+    response = requests.Response()
+    response.status_code = 503
+    response.reason = "Offline"
+    response._content = b'{"message": "offline"}'
+    response.encoding = "utf-8"
+    response.url = url
+    return response
+
+class GitHubClient:
+    """Pooled, keep-alive GitHub REST client shared by all handlers in a run.
+
+    Every request goes through a small scheduler that tracks the primary rate
+    limit from the X-RateLimit-* headers, pauses ahead of time when the budget
+    is nearly spent, honours Retry-After for secondary limits and retries
+    throttled or 5xx responses with jittered exponential backoff. A limit
+    that would keep the client waiting longer than `max_backoff` is not
+    retried; the throttled response is returned instead.
+
+    With a ResponseCache, GETs are sent as conditional requests and a 304 is
+    answered from the cache; 304s do not count against the rate limit.
+
+    An `offline` client sends nothing: every request is answered with a 503
+    straight away, so handlers take the path they use when a read fails.
+    """
+
+    def __init__(self, token, base_url=DEFAULT_API_URL, pool_size=10, timeout=10.0,
+                 max_retries=3, backoff=1.0, max_backoff=60.0, pace_below=50, graphql_url=None,
+                 cache=None, offline=False):
+        self.token = token
+        self.offline = offline
+        self.base_url = base_url.rstrip("/")
+        self.graphql_url = graphql_url or f"{self.base_url}/graphql"
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pace_below = pace_below
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/vnd.github.v3+json"
+        })
+        self.clock = time.time
+        self.sleep = time.sleep
+        self.rate_limit = None
+        self.rate_remaining = None
+        self.rate_reset = None
+        self.budget = None
+        self.blocked_until = 0.0
+        self.stats = {"requests": 0, "retries": 0, "throttled_seconds": 0.0, "cache_hits": 0}
+
+    def repo_url(self, repo_full_name):
+        return f"{self.base_url}/repos/{repo_full_name}"
+
+    def _wait(self, seconds):
+        if seconds <= 0:
+            return
+        self.stats["throttled_seconds"] += seconds
+        self.sleep(seconds)
+
+    def _pace(self):
+        """Delay the next request if a limit is in force or nearly exhausted."""
+        now = self.clock()
+        if self.blocked_until > now:
+            self._wait(self.blocked_until - now)
+            return
+        if self.rate_remaining is None or self.rate_reset is None or self.rate_reset <= now:
+            return
+        if self.rate_remaining <= 0:
+            self._wait(self.rate_reset - now)
+        elif self.rate_remaining < self.pace_below:
+            # Spread what is left of the budget evenly over the window.
+            self._wait((self.rate_reset - now) / self.rate_remaining)
+
+    def _record_limits(self, response):
+        limit = _header_float(response, "X-RateLimit-Limit")
+        remaining = _header_float(response, "X-RateLimit-Remaining")
+        reset = _header_float(response, "X-RateLimit-Reset")
+        if limit is not None:
+            self.rate_limit = limit
+        if remaining is not None:
+            self.rate_remaining = remaining
+        if reset is not None:
+            self.rate_reset = reset
+
+    def _retry_delay(self, response, attempt):
+        """Return seconds to wait before retrying, or None if not retryable."""
+        if response.status_code not in RETRY_STATUSES:
+            return None
+        wait = _header_float(response, "Retry-After")
+        if wait is None and self.rate_remaining == 0 and self.rate_reset is not None:
+            wait = max(self.rate_reset - self.clock(), 0.0)
+        if wait is None and response.status_code == 403 and _secondary_limit(response):
+            wait = SECONDARY_LIMIT_WAIT
+        if wait is not None:
+            # Give up rather than stall the run past the backoff cap.
+            return wait if wait <= self.max_backoff else None
+        if response.status_code == 403:
+            # A plain 403 is a permission problem, not a limit.
+            return None
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _cache_key(self, url, params):
+        # Keyed by the full URL (API host included) but not the token, which
+        # changes with every Action job. Entries are always revalidated, and
+        # GitHub only answers 304 to a token allowed to read the resource.
+        if params:
+            url = f"{url}?{urlencode(sorted(dict(params).items()))}"
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        if method != "get" or self.cache is None:
+            return self._send(method, url, **kwargs)
+
+        key = self._cache_key(url, kwargs.get("params"))
+        entry = self.cache.lookup(key)
+        if entry is not None:
+            conditional = {}
+            if "ETag" in entry["headers"]:
+                conditional["If-None-Match"] = entry["headers"]["ETag"]
+            if "Last-Modified" in entry["headers"]:
+                conditional["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+            kwargs["headers"] = {**conditional, **(kwargs.get("headers") or {})}
+        response = self._send(method, url, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            self.stats["cache_hits"] += 1
+            return _cached_response(entry)
+        if response.status_code == 200:
+            self.cache.store(key, response)
+        return response
+
+    def _send(self, method, url, **kwargs):
+        tracer = get_tracer()
+        if not tracer.enabled:
+            return self._attempt(method, url, **kwargs)
+        retries = self.stats["retries"]
+        with tracer.span("api", method=method, route=_route(url)) as span:
+            response = self._attempt(method, url, **kwargs)
+            span["status"] = response.status_code
+            span["retries"] = self.stats["retries"] - retries
+            try:
+                span["bytes"] = len(response.content or b"")
+            except TypeError:
+                pass
+        return response
+
+    def _attempt(self, method, url, **kwargs):
+        if self.offline:
+            return _offline_response(url)
+        send = getattr(self.session, method)
+        attempt = 0
+        while True:
+            if self.budget is not None:
+                self.budget.acquire(url)
+            self._pace()
+            self.stats["requests"] += 1
+            try:
+                response = send(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            else:
+                self._record_limits(response)
+                delay = self._retry_delay(response, attempt)
+                if delay is None or attempt >= self.max_retries:
+                    return response
+                print(f"{method.upper()} {url} returned {response.status_code}, retrying in {delay:.1f}s")
+            attempt += 1
+            self.stats["retries"] += 1
+            # Block every caller on this client, not just this request.
+            self.blocked_until = max(self.blocked_until, self.clock() + delay)
+
+    def get(self, url, **kwargs):
+        return self.request("get", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("post", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("put", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("delete", url, **kwargs)
+
+    def graphql(self, query, variables=None):
+        """Run a GraphQL document and return (data, errors).
+
+        Raises RuntimeError when the request fails outright; field-level errors
+        (for example a merge mutation GitHub refused) come back alongside
+        whatever data the other fields produced.
+        """
+        response = self.post(self.graphql_url, json={"query": query, "variables": variables or {}})
+        if response.status_code != 200:
+            raise RuntimeError(f"GraphQL request failed: {response.status_code}")
+        payload = response.json()
+        if payload.get("data") is None:
+            raise RuntimeError(f"GraphQL request failed: {payload.get('errors')}")
+        return payload["data"], payload.get("errors") or []
+
+_REPO_PATH = re.compile(r"/repos/([^/]+/[^/?#]+)")
+
+class RateBudget:
+    """Splits a client's rate limit window fairly between repositories.
+
+    Every repository that made requests in the current window, or is about to,
+    gets an equal share of the window's budget; budget left unused by
+    repositories marked finished is shared among the rest. A repository over
+    its share waits until the window resets or another one finishes. Requests
+    not about a repository (GraphQL, org teams) are not metered.
+    """
+
+    def __init__(self, client, reserve=None):
+        self.client = client
+        self.reserve = client.pace_below if reserve is None else reserve
+        self.cond = threading.Condition()
+        self.window = None
+        self.spent = {}
+        self.finished = set()
+
+    def _roll(self):
+        if self.client.rate_reset != self.window:
+            self.window = self.client.rate_reset
+            self.spent.clear()
+            self.finished.clear()
+
+    def share(self, repo):
+        """Return how many requests repo may make this window, or None if unlimited."""
+        reset = self.client.rate_reset
+        if self.client.rate_limit is None or reset is None or reset <= self.client.clock():
+            # No window is known to be in force yet.
+            return None
+        active = (set(self.spent) | {repo}) - self.finished
+        finished_spent = sum(self.spent[name] for name in self.finished if name in self.spent)
+        return (self.client.rate_limit - self.reserve - finished_spent) / len(active)
+
+    def acquire(self, url):
+        match = _REPO_PATH.search(url)
+        if match is None:
+            return
+        repo = match.group(1).lower()
+        with self.cond:
+            while True:
+                self._roll()
+                self.finished.discard(repo)
+                share = self.share(repo)
+                if share is None or self.spent.get(repo, 0) < share:
+                    self.spent[repo] = self.spent.get(repo, 0) + 1
+                    return
+                now = self.client.clock()
+                wait = self.window - now if self.window and self.window > now else 1.0
+                self.cond.wait(timeout=min(wait, 1.0))
+
+    def finish(self, repo):
+        """Release what is left of repo's share to the other repositories."""
+        with self.cond:
+            self.finished.add(repo.lower())
+            self.cond.notify_all()
+
+_client = None
+_client_lock = threading.Lock()
+
+def response_cache_from_env():
+    """Build the response cache configured by HTTP_CACHE and HTTP_CACHE_MB."""
+    if os.environ.get("HTTP_CACHE", "true").lower() not in ["true", "1", "yes"]:
+        return None
+    cache_dir = _cache_dir()
+    return ResponseCache(
+        path=os.path.join(cache_dir, "http") if cache_dir else None,
+        max_bytes=int(float(os.environ.get("HTTP_CACHE_MB", "64")) * 1024 * 1024),
+    )
+
+def get_client(token):
+    """Return the run-wide GitHubClient, creating it on first use.
+
+    A dry run without a token plans offline.
+    """
+    global _client
+    offline = not token and isinstance(_executor, DryRunExecutor)
+    with _client_lock:
+        if _client is None or _client.token != token or _client.offline != offline:
+            _client = GitHubClient(
+                token,
+                base_url=os.environ.get("GITHUB_API_URL", DEFAULT_API_URL),
+                pool_size=int(os.environ.get("HTTP_POOL_SIZE", "10")),
+                timeout=float(os.environ.get("HTTP_TIMEOUT", "10")),
+                max_retries=int(os.environ.get("HTTP_MAX_RETRIES", "3")),
+                backoff=float(os.environ.get("HTTP_BACKOFF", "1")),
+                graphql_url=os.environ.get("GITHUB_GRAPHQL_URL"),
+                cache=response_cache_from_env(),
+                offline=offline,
+            )
+        return _client
+
+_io_slots = weakref.WeakKeyDictionary()
+_io_executor = None
+
+async def blocking(func, *args, **kwargs):
+    """Run a blocking call (API request, file read) in a worker thread.
+
+    The handlers' async core overlaps independent calls through this; at most
+    HTTP_POOL_SIZE of them run at once per event loop, matching the
+    connections the client keeps open. The worker threads are shared by all
+    event loops, so a loop per event does not start threads of its own.
+    """
+    global _io_executor
+    loop = asyncio.get_running_loop()
+    slots = _io_slots.get(loop)
+    if slots is None:
+        slots = _io_slots[loop] = asyncio.Semaphore(int(os.environ.get("HTTP_POOL_SIZE", "10")))
+    with _client_lock:
+        if _io_executor is None:
+            _io_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="owners-io")
+    async with slots:
+        # Like asyncio.to_thread, carry the caller's context (its open span) along.
+        call = partial(contextvars.copy_context().run, func, *args, **kwargs)
+        return await loop.run_in_executor(_io_executor, call)
+
+def run_sync(coro):
+    """Run an async handler to completion for a synchronous caller."""
+    return asyncio.run(coro)
+
+OWNERS_CACHE_VERSION = 1
+
+class Owners:
+    """Compiled OWNERS file: ordered tuples of approvers and reviewers.
+
+    Membership is checked through an AuthIndex, not on the tuples.
+    """
+
+    def __init__(self, approvers=(), reviewers=()):
+        self.approvers = tuple(approvers)
+        self.reviewers = tuple(reviewers)
+
+    def to_dict(self):
+        return {"approvers": list(self.approvers), "reviewers": list(self.reviewers)}
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data or {}
+        return cls(data.get("approvers") or [], data.get("reviewers") or [])
+
+    @classmethod
+    def union(cls, owners_list):
+        """Merge several OWNERS files, keeping first-seen order."""
+        approvers, reviewers = {}, {}
+        for owners in owners_list:
+            approvers.update(dict.fromkeys(owners.approvers))
+            reviewers.update(dict.fromkeys(owners.reviewers))
+        return cls(approvers, reviewers)
+
+# Role bits of the authorization index, by the role names commands use.
+ROLES = {"reviewers": 1, "approvers": 2}
+
+AUTH_INDEX_VERSION = 1
+
+def _expand_offline(entries, aliases, seen=None):
+    """Expand OWNERS entries through aliases into (logins, (org, slug) teams)."""
+    seen = set() if seen is None else seen
+    logins, teams = [], []
+    for entry in entries:
+        if entry in seen:
+            continue
+        seen.add(entry)
+        if entry in aliases:
+            more_logins, more_teams = _expand_offline(aliases[entry], aliases, seen)
+            logins += more_logins
+            teams += more_teams
+        elif _team_ref(entry) is not None:
+            teams.append(_team_ref(entry))
+        else:
+            logins.append(entry)
+    return logins, teams
+
+class AuthIndex:
+    """Precompiled authorization: case-folded login -> role bitmask per scope.
+
+    A scope is the directory of an OWNERS file ("" for the root). The roles
+    recorded for a scope include those inherited from ancestor OWNERS files,
+    and OWNERS_ALIASES are expanded when the index is built, so checking a
+    login costs one dict lookup per scope. Teams cannot be expanded without
+    the API; they are indexed per scope and role, and their members are only
+    fetched (through the resolver) when a login holds no role directly.
+    """
+
+    def __init__(self, scopes, logins, teams):
+        self.scopes = list(scopes)
+        self.scope_ids = {scope: i for i, scope in enumerate(self.scopes)}
+        self.logins = logins
+        self.teams = teams
+        self.scope_teams = {}
+        for team, roles in teams.items():
+            for scope_id, mask in roles.items():
+                for bit in ROLES.values():
+                    if mask & bit:
+                        self.scope_teams.setdefault((scope_id, bit), []).append(team)
+
+    @classmethod
+    def build(cls, scoped_owners, aliases):
+        """Index {scope directory: effective Owners}, expanding aliases."""
+        scopes = sorted(scoped_owners)
+        logins, teams = {}, {}
+        for scope_id, scope in enumerate(scopes):
+            owners = scoped_owners[scope]
+            for role, entries in (("reviewers", owners.reviewers), ("approvers", owners.approvers)):
+                members, groups = _expand_offline(entries, aliases)
+                for key, table in [(login.casefold(), logins) for login in members] + \
+                                  [(f"{org}/{slug}".lower(), teams) for org, slug in groups]:
+                    roles = table.setdefault(key, {})
+                    roles[scope_id] = roles.get(scope_id, 0) | ROLES[role]
+        return cls(scopes, logins, teams)
+
+    def to_dict(self):
+        """Serialize compactly: each {scope id: mask} becomes a flat [id, mask, ...] list."""
+        def flat(roles):
+            return [value for item in sorted(roles.items()) for value in item]
+        return {"version": AUTH_INDEX_VERSION, "scopes": self.scopes,
+                "logins": {login: flat(roles) for login, roles in self.logins.items()},
+                "teams": {team: flat(roles) for team, roles in self.teams.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        def pairs(values):
+            return dict(zip(values[::2], values[1::2]))
+        return cls(data["scopes"],
+                   {login: pairs(roles) for login, roles in data["logins"].items()},
+                   {team: pairs(roles) for team, roles in data["teams"].items()})
+
+    def allows(self, login, role, scope_ids, resolver=None):
+        """Whether login holds role in every one of the given scopes."""
+        if role == "anyone":
+            return True
+        bit = ROLES[role]
+        login = login.casefold()
+        roles = self.logins.get(login, {})
+        for scope_id in scope_ids:
+            if roles.get(scope_id, 0) & bit:
+                continue
+            if resolver is None or not any(
+                    login in (member.casefold() for member in resolver.team_members(*team.split("/", 1)))
+                    for team in self.scope_teams.get((scope_id, bit), ())):
+                return False
+        return True
+
+    def scoped(self, scopes):
+        """Return the authorization for a PR touching the given scope directories."""
+        return ScopedOwners(self, [self.scope_ids[scope] for scope in scopes])
+
+class ScopedOwners:
+    """Authorization across several OWNERS scopes: a role must hold in all of them."""
+
+    def __init__(self, index, scope_ids):
+        self.index = index
+        self.scope_ids = list(scope_ids)
+
+    def allows(self, login, role, resolver=None):
+        return self.index.allows(login, role, self.scope_ids, resolver)
+
+_owners_cache = {}
+
+def _owners_cache_file(digest):
+    cache_dir = _cache_dir()
+    if not cache_dir:
+        return None
+    return os.path.join(cache_dir, f"v{OWNERS_CACHE_VERSION}-{digest}.json")
+
+def load_owners(path):
+    """Load a compiled OWNERS file, reusing earlier parses of identical content.
+
+    Parses are cached in memory for the run and, when OWNERS_CACHE_DIR or
+    RUNNER_TEMP is set, on disk as JSON keyed by the SHA-256 of the file, so
+    later runs on the same commit skip YAML parsing entirely.
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    if digest in _owners_cache:
+        return _owners_cache[digest]
+
+    cache_file = _owners_cache_file(digest)
+    owners = None
+    if cache_file:
+        try:
+            with open(cache_file, "r") as f:
+                owners = Owners.from_dict(json.load(f))
+        except (OSError, ValueError):
+            owners = None
+
+    if owners is None:
+        with get_tracer().span("owners.parse", path=path, bytes=len(raw)):
+            owners = Owners.from_dict(yaml.safe_load(raw))
+        if cache_file:
+            try:
+                os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+                with open(tmp_file, "w") as f:
+                    json.dump(owners.to_dict(), f)
+                os.replace(tmp_file, cache_file)
+            except OSError as e:
+                print(f"Could not write OWNERS cache: {e}")
+
+    _owners_cache[digest] = owners
+    return owners
+
+def _cache_dir():
+    cache_dir = os.environ.get("OWNERS_CACHE_DIR") or os.environ.get("RUNNER_TEMP")
+    return os.path.join(cache_dir, "owners-cache") if cache_dir else None
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries expire after `ttl` seconds.
+
+    When `path` is given the cache is loaded from and saved to a JSON file so
+    entries survive between runs. Values must be JSON-serializable.
+    """
+
+    def __init__(self, maxsize=256, ttl=3600.0, path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.clock = time.time
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        if path:
+            try:
+                with open(path, "r") as f:
+                    self.entries.update((key, tuple(entry)) for key, entry in json.load(f).items())
+            except (OSError, ValueError):
+                pass
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= self.clock():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (self.clock() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            snapshot = {key: list(entry) for key, entry in self.entries.items()}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_file = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_file, self.path)
+        except OSError as e:
+            print(f"Could not write cache {self.path}: {e}")
+
+_team_cache = None
+_team_cache_lock = threading.Lock()
+
+def get_team_cache():
+    """Return the process-wide team membership cache, loading it on first use."""
+    global _team_cache
+    with _team_cache_lock:
+        if _team_cache is None:
+            cache_dir = _cache_dir()
+            _team_cache = TTLCache(
+                maxsize=int(os.environ.get("TEAM_CACHE_SIZE", "256")),
+                ttl=float(os.environ.get("TEAM_CACHE_TTL", "3600")),
+                path=os.path.join(cache_dir, "teams.json") if cache_dir else None,
+            )
+        return _team_cache
+
+_aliases_cache = {}
+
+# Shared, so a checkout without aliases gets the same object every time.
+_NO_ALIASES = {}
+
+def load_aliases(path):
+    """Load an OWNERS_ALIASES file as {alias: [members]}; missing files are empty."""
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return _NO_ALIASES
+    digest = hashlib.sha256(raw).hexdigest()
+    if digest not in _aliases_cache:
+        data = yaml.safe_load(raw) or {}
+        _aliases_cache[digest] = {name: list(members or []) for name, members in (data.get("aliases") or {}).items()}
+    return _aliases_cache[digest]
+
+def _team_ref(entry):
+    """Return (org, team slug) for an @org/team entry, or None."""
+    org, sep, slug = entry.lstrip("@").partition("/")
+    return (org, slug) if sep and org and slug else None
+
+class OwnersResolver:
+    """Expands OWNERS_ALIASES names and @org/team entries into logins.
+
+    Expansion is lazy: the AuthIndex only asks for a team's members after a
+    login holds no role directly, and reviewer selection expands the entries
+    it picks from. Team members are fetched from the API and kept in a TTL
+    cache shared across runs.
+    """
+
+    def __init__(self, client, aliases, team_cache):
+        self.client = client
+        self.aliases = aliases
+        self.team_cache = team_cache
+
+    def team_members(self, org, slug):
+        key = f"{org}/{slug}".lower()
+        members = self.team_cache.get(key)
+        if members is not None:
+            return members
+        members = []
+        url = f"{self.client.base_url}/orgs/{org}/teams/{slug}/members?per_page=100"
+        while url:
+            response = self.client.get(url)
+            if response.status_code != 200:
+                print(f"Could not expand team @{org}/{slug}: {response.status_code}")
+                return []
+            members.extend(member['login'] for member in response.json())
+            url = response.links.get("next", {}).get("url")
+        self.team_cache.put(key, members)
+        return members
+
+    def expand(self, entry, seen=None):
+        """Return the logins an entry stands for."""
+        seen = set() if seen is None else seen
+        if entry in seen:
+            return []
+        seen.add(entry)
+        if entry in self.aliases:
+            logins = []
+            for member in self.aliases[entry]:
+                logins.extend(self.expand(member, seen))
+            return logins
+        team = _team_ref(entry)
+        if team is not None:
+            return self.team_members(*team)
+        return [entry]
+
+    def teams(self, entries, seen=None):
+        """Return the (org, slug) of every team entries refer to, directly or through aliases."""
+        seen = set() if seen is None else seen
+        teams = {}
+        for entry in entries:
+            if entry in seen:
+                continue
+            seen.add(entry)
+            if entry in self.aliases:
+                teams.update(dict.fromkeys(self.teams(self.aliases[entry], seen)))
+            elif _team_ref(entry) is not None:
+                teams[_team_ref(entry)] = None
+        return list(teams)
+
+    def expand_all(self, entries):
+        """Expand a list of OWNERS entries into unique logins, in order."""
+        logins = {}
+        for entry in entries:
+            logins.update(dict.fromkeys(self.expand(entry)))
+        return list(logins)
+
+def get_owners_resolver(client, repo_full_name, owners_path):
+    """Build the alias/team resolver for a repository's OWNERS files."""
+    root_dir = os.path.join(get_workspace(repo_full_name), os.path.dirname(owners_path))
+    return OwnersResolver(client, load_aliases(aliases_file(root_dir)), get_team_cache())
+
+def aliases_file(root_dir):
+    return os.path.join(root_dir, os.environ.get("OWNERS_ALIASES_FILE", "OWNERS_ALIASES"))
+
+class _OwnersNode:
+    __slots__ = ("children", "own", "closest", "scope")
+
+    def __init__(self):
+        self.children = {}
+        self.own = None
+        self.closest = None
+        self.scope = None
+
+def _path_parts(path):
+    return [part for part in path.replace(os.sep, "/").split("/") if part and part != "."]
+
+class OwnersTree:
+    """Path-prefix trie of per-directory OWNERS files.
+
+    Every node carries the closest OWNERS file at or above it, used to pick
+    reviewers, and the directory of that file (its scope). `scope_owners`
+    maps each scope to its effective owners (that file merged with all of its
+    ancestors), from which the AuthIndex is built. Resolving a path is a single walk down
+    its directory components and results are memoized per directory, so
+    resolving a PR stays linear in the number of changed paths.
+    """
+
+    def __init__(self):
+        self.root = _OwnersNode()
+        self.scope_owners = {}
+        self._dir_cache = {}
+
+    def add(self, directory, owners):
+        node = self.root
+        for part in _path_parts(directory):
+            node = node.children.setdefault(part, _OwnersNode())
+        node.own = owners
+
+    def finalize(self):
+        stack = [(self.root, "", None, None, None)]
+        self.scope_owners = {}
+        while stack:
+            node, directory, closest, effective, scope = stack.pop()
+            if node.own is not None:
+                closest, scope = node.own, directory
+                effective = node.own if effective is None else Owners.union([node.own, effective])
+                self.scope_owners[scope] = effective
+            node.closest, node.scope = closest, scope
+            stack.extend((child, f"{directory}/{name}".lstrip("/"), closest, effective, scope)
+                         for name, child in node.children.items())
+        self._dir_cache.clear()
+
+    def lookup(self, path):
+        """Return the deepest trie node covering the directory of a file path."""
+        directory = path.rpartition("/")[0]
+        node = self._dir_cache.get(directory)
+        if node is None:
+            node = self.root
+            for part in _path_parts(directory):
+                child = node.children.get(part)
+                if child is None:
+                    break
+                node = child
+            self._dir_cache[directory] = node
+        return node
+
+    def scopes(self, paths):
+        """Return the distinct OWNERS scopes covering the given file paths."""
+        nodes = {}
+        for path in paths:
+            node = self.lookup(path)
+            if node.scope is not None:
+                nodes[node.scope] = node
+        return list(nodes.values())
+
+    @classmethod
+    def build(cls, root_dir, filename):
+        tree = cls()
+        for dirpath, dirnames, filenames in os.walk(root_dir):
+            dirnames[:] = [d for d in dirnames if d != ".git"]
+            if filename in filenames:
+                tree.add(os.path.relpath(dirpath, root_dir), load_owners(os.path.join(dirpath, filename)))
+        tree.finalize()
+        return tree
+
+def _git_head(root_dir):
+    """Return the commit a git checkout's HEAD points at, or None."""
+    git_dir = os.path.join(root_dir, ".git")
+    try:
+        with open(os.path.join(git_dir, "HEAD"), "r") as f:
+            head = f.read().strip()
+        if not head.startswith("ref:"):
+            return head
+        ref = head[len("ref:"):].strip()
+        try:
+            with open(os.path.join(git_dir, ref), "r") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            with open(os.path.join(git_dir, "packed-refs"), "r") as f:
+                for line in f:
+                    sha, _, name = line.strip().partition(" ")
+                    if name == ref:
+                        return sha
+    except OSError:
+        pass
+    return None
+
+def checkout_fingerprint(root_dir, filename):
+    """Return a value that changes whenever a checkout's OWNERS files may have.
+
+    For a git checkout this is the commit HEAD points at, which costs a file
+    read or two. Anything else falls back to the path, size and modification
+    time of every OWNERS file.
+    """
+    head = _git_head(root_dir)
+    if head:
+        return head
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        dirnames[:] = [d for d in dirnames if d != ".git"]
+        if filename in filenames:
+            stat = os.stat(os.path.join(dirpath, filename))
+            found.append((os.path.relpath(dirpath, root_dir), stat.st_size, stat.st_mtime_ns))
+    return tuple(sorted(found))
+
+_owners_trees = {}
+
+def get_owners_tree(root_dir, filename):
+    """Return the OWNERS trie for a checkout, rebuilding it when the checkout changes.
+
+    Long-running modes keep checkouts up to date underneath the process, so
+    a cached trie is only reused while checkout_fingerprint() is unchanged.
+    """
+    key = (os.path.abspath(root_dir), filename)
+    fingerprint = checkout_fingerprint(root_dir, filename)
+    cached = _owners_trees.get(key)
+    if cached is None or cached[0] != fingerprint:
+        cached = _owners_trees[key] = (fingerprint, OwnersTree.build(root_dir, filename))
+    return cached[1]
+
+_auth_indexes = {}
+_checkout_indexes = {}
+
+def get_auth_index(root_dir, filename):
+    """Return the AuthIndex for a checkout's OWNERS files and aliases.
+
+    Indexes are keyed by the SHA-256 of the OWNERS contents and aliases they
+    are built from, kept in memory and, next to the OWNERS cache, on disk as
+    compact JSON, so a checkout is only indexed once. The index last used for
+    a checkout is reused as long as its OWNERS files and aliases load as the
+    same objects, so an unchanged checkout costs no hashing at all.
+    """
+    if hierarchical_owners_enabled():
+        owned = get_owners_tree(root_dir, filename)
+        scoped = owned.scope_owners
+    else:
+        owned = load_owners(os.path.join(root_dir, filename))
+        scoped = {"": owned}
+    aliases = load_aliases(aliases_file(root_dir))
+    # Trees and parsed files are shared while their content is unchanged, so
+    # the same objects as last time mean the same index, without re-hashing.
+    key = (os.path.abspath(root_dir), filename)
+    last = _checkout_indexes.get(key)
+    if last is not None and last[0] is owned and last[1] is aliases:
+        return last[2]
+
+    source = json.dumps([sorted((scope, owners.to_dict()) for scope, owners in scoped.items()), aliases],
+                        sort_keys=True)
+    digest = hashlib.sha256(source.encode("utf-8")).hexdigest()
+    index = _auth_indexes.get(digest)
+    if index is None:
+        index = _load_auth_index(digest, scoped, aliases)
+        _auth_indexes[digest] = index
+    _checkout_indexes[key] = (owned, aliases, index)
+    return index
+
+def _load_auth_index(digest, scoped, aliases):
+    """Read the index for digest from the disk cache, or build and store it."""
+    cache_dir = _cache_dir()
+    cache_file = os.path.join(cache_dir, f"authz-v{AUTH_INDEX_VERSION}-{digest}.json") if cache_dir else None
+    index = None
+    if cache_file:
+        try:
+            with open(cache_file, "r") as f:
+                index = AuthIndex.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            index = None
+
+    if index is None:
+        index = AuthIndex.build(scoped, aliases)
+        if cache_file:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_file, "w") as f:
+                    json.dump(index.to_dict(), f, separators=(",", ":"))
+                os.replace(tmp_file, cache_file)
+            except OSError as e:
+                print(f"Could not write authorization index: {e}")
+    return index
+
+MAX_PR_FILES = 3000
+
+def _page_url(url, page):
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    query["page"] = str(page)
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+def _last_page(response):
+    last = response.links.get("last", {}).get("url")
+    if not last:
+        return None
+    try:
+        return int(dict(parse_qsl(urlsplit(last).query))["page"])
+    except (KeyError, ValueError):
+        return None
+
+class ChangedFiles:
+    """Streaming iterator over the paths touched by a PR.
+
+    Pages of /pulls/{n}/files are yielded as they arrive. Once the first page
+    reveals the total through its Link header, the remaining pages are fetched
+    concurrently; otherwise "next" links are followed one by one. Renamed files
+    also yield their previous path. The endpoint stops at 3000 files, and the
+    compare API caps its file list lower still, so when that limit is reached
+    the listing is flagged as truncated and callers must treat the PR as
+    touching paths they have not seen.
+    """
+
+    def __init__(self, client, api_url, pr_number, workers=4):
+        self.client = client
+        self.url = f"{api_url}/pulls/{pr_number}/files?per_page=100"
+        self.pr_number = pr_number
+        self.workers = workers
+        self.count = 0
+        self.truncated = False
+
+    def _fetch(self, url):
+        response = self.client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"Failed to list files for PR #{self.pr_number}: {response.status_code}")
+        return response
+
+    def _paths(self, response):
+        for entry in response.json():
+            self.count += 1
+            yield entry["filename"]
+            if entry.get("previous_filename"):
+                yield entry["previous_filename"]
+
+    def __iter__(self):
+        response = self._fetch(self.url)
+        yield from self._paths(response)
+
+        last_page = _last_page(response)
+        if last_page and last_page > 1 and self.workers > 1:
+            urls = [_page_url(self.url, page) for page in range(2, last_page + 1)]
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(urls))) as pool:
+                for future in as_completed([pool.submit(self._fetch, url) for url in urls]):
+                    yield from self._paths(future.result())
+        else:
+            url = response.links.get("next", {}).get("url")
+            while url:
+                response = self._fetch(url)
+                yield from self._paths(response)
+                url = response.links.get("next", {}).get("url")
+
+        if self.count >= MAX_PR_FILES:
+            self.truncated = True
+            print(f"PR #{self.pr_number} lists {self.count} files, the API limit; treating it as touching the repository root")
+
+def hierarchical_owners_enabled():
+    return os.environ.get("OWNERS_HIERARCHY", "false").lower() in ["true", "1", "yes"]
+
+def get_workspace(repo_full_name):
+    """Return the checkout holding a repository's OWNERS files.
+
+    In the Action this is GITHUB_WORKSPACE. A long-running server handling
+    several repositories sets WORKSPACES_ROOT instead and keeps one checkout
+    per repository at WORKSPACES_ROOT/<owner>/<repo>.
+    """
+    workspaces_root = os.environ.get("WORKSPACES_ROOT")
+    if workspaces_root:
+        return os.path.join(workspaces_root, *repo_full_name.split("/"))
+    return os.environ.get("GITHUB_WORKSPACE", ".")
+
+@traced("owners.resolve")
+def resolve_pr_owners(client, api_url, pr_number, owners_path, repo_full_name=""):
+    """Return (assignable, authorized) owners for a PR.
+
+    With OWNERS_HIERARCHY disabled both are the root OWNERS file. Otherwise
+    assignable owners are the union of the closest OWNERS for every changed
+    path, and a login is authorized for a role only if it holds that role in
+    every touched scope (directly or through an ancestor OWNERS file).
+    Authorization is answered by the checkout's AuthIndex. Raises
+    FileNotFoundError if the root OWNERS file is missing.
+    """
+    workspace = get_workspace(repo_full_name)
+    full_owners_path = os.path.join(workspace, owners_path)
+
+    print(f"Reading OWNERS from: {full_owners_path}")
+
+    root_owners = load_owners(full_owners_path)
+    root_dir, filename = os.path.split(full_owners_path)
+    index = get_auth_index(root_dir, filename)
+    if not hierarchical_owners_enabled():
+        return root_owners, index.scoped([""])
+
+    tree = get_owners_tree(root_dir, filename)
+    changed_files = ChangedFiles(client, api_url, pr_number, workers=client.pool_size)
+    try:
+        scopes = tree.scopes(changed_files)
+    except RuntimeError as e:
+        print(f"{e}, falling back to root OWNERS")
+        return root_owners, index.scoped([""])
+
+    if changed_files.truncated:
+        root_scopes = tree.scopes([""])
+        scopes = root_scopes + [node for node in scopes if node not in root_scopes]
+    if not scopes:
+        return root_owners, index.scoped([""])
+    print(f"Resolved {changed_files.count} changed file(s) to {len(scopes)} OWNERS scope(s)")
+    return (Owners.union(node.closest for node in scopes),
+            index.scoped(node.scope for node in scopes))
+
+BOT_LABELS = ['lgtm', 'approved', 'hold']
 
 def is_protected_label(label_name):
     return label_name in ['lgtm', 'approved']
 
-def check_and_merge(event, token):
-    """Check if PR has required labels and merge if conditions are met."""
-    auto_merge = os.environ.get("AUTO_MERGE", "true").lower()
-    if auto_merge not in ["true", "1", "yes"]:
+def auto_merge_enabled():
+    return os.environ.get("AUTO_MERGE", "true").lower() in ["true", "1", "yes"]
+
+def graphql_enabled():
+    return os.environ.get("GITHUB_BACKEND", "rest").lower() == "graphql"
+
+def get_merge_strategy():
+    merge_strategy = os.environ.get("MERGE_STRATEGY", "merge")
+    if merge_strategy not in ["merge", "squash", "rebase"]:
+        print(f"Invalid merge strategy: {merge_strategy}, using 'merge'")
+        merge_strategy = "merge"
+    return merge_strategy
+
+class PullRequestState:
+    """What the bot knows about a PR.
+
+    Label mutations only fill in `labels`. Reading the PR also records its
+    head SHA and mergeability ("MERGEABLE", "CONFLICTING" or "UNKNOWN" while
+    GitHub computes it); REST adds GitHub's `merge_state` summary and the
+    GraphQL backend the node ids needed for mutations and the required
+    checks. Unknown fields are None.
+    """
+
+    def __init__(self, labels, node_id=None, author=None, head_sha=None, base_ref=None,
+                 mergeable=None, checks=None, label_ids=None, merged=False, merge_attempted=False,
+                 merge_state=None):
+        self.labels = list(labels)
+        self.node_id = node_id
+        self.author = author
+        self.head_sha = head_sha
+        self.base_ref = base_ref
+        self.mergeable = mergeable
+        self.merge_state = merge_state
+        self.checks = checks
+        self.label_ids = label_ids or {}
+        self.merged = merged
+        self.merge_attempted = merge_attempted
+
+def label_blocker(state):
+    """Return why the PR's labels keep it from merging, or None."""
+    if not ('lgtm' in state.labels and 'approved' in state.labels and 'hold' not in state.labels):
+        return f"Labels: {state.labels}"
+    return None
+
+PR_STATE_QUERY = """
+query($owner: String!, $name: String!, $number: Int!) {
+  repository(owner: $owner, name: $name) {
+    lgtm: label(name: "lgtm") { id }
+    approved: label(name: "approved") { id }
+    hold: label(name: "hold") { id }
+    pullRequest(number: $number) {
+      id
+      merged
+      mergeable
+      headRefOid
+      baseRefName
+      author { login }
+      labels(first: 100) { nodes { id name } }
+      commits(last: 1) {
+        nodes {
+          commit {
+            statusCheckRollup {
+              contexts(first: 100) {
+                nodes {
+                  ... on CheckRun { status conclusion isRequired(pullRequestNumber: $number) }
+                  ... on StatusContext { state isRequired(pullRequestNumber: $number) }
+                }
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+def _required_checks_state(pr):
+    """Summarise required checks on the head commit as SUCCESS, PENDING or FAILURE."""
+    commits = pr["commits"]["nodes"]
+    rollup = commits[0]["commit"]["statusCheckRollup"] if commits else None
+    if not rollup:
+        return "SUCCESS"
+    state = "SUCCESS"
+    for context in rollup["contexts"]["nodes"]:
+        if not context.get("isRequired"):
+            continue
+        if "status" in context:
+            if context["status"] != "COMPLETED":
+                state = "PENDING"
+            elif context["conclusion"] not in ("SUCCESS", "NEUTRAL", "SKIPPED"):
+                return "FAILURE"
+        elif context.get("state") in ("PENDING", "EXPECTED"):
+            state = "PENDING"
+        elif context.get("state") != "SUCCESS":
+            return "FAILURE"
+    return state
+
+def fetch_pr_state(client, repo_full_name, pr_number):
+    """Read labels, mergeability, head SHA, required checks and author in one query."""
+    owner, name = repo_full_name.split("/", 1)
+    data, _ = client.graphql(PR_STATE_QUERY, {"owner": owner, "name": name, "number": pr_number})
+    repository = data["repository"]
+    pr = repository["pullRequest"]
+    label_ids = {label: repository[label]["id"] for label in BOT_LABELS if repository.get(label)}
+    label_ids.update((label["name"], label["id"]) for label in pr["labels"]["nodes"])
+    return PullRequestState(
+        [label["name"] for label in pr["labels"]["nodes"]],
+        node_id=pr["id"],
+        author=(pr.get("author") or {}).get("login"),
+        head_sha=pr["headRefOid"],
+        base_ref=pr["baseRefName"],
+        mergeable=pr["mergeable"],
+        checks=_required_checks_state(pr),
+        label_ids=label_ids,
+        merged=pr["merged"],
+    )
+
+def apply_graphql_changes(client, state, additions=(), removals=(), merge_strategy=None):
+    """Apply label changes and an optional merge as a single GraphQL mutation.
+
+    Mutation fields run in order, so the merge only sees the labels after
+    they have been updated. `state` is updated in place and returned.
+    """
+    fields, params = [], ["$id: ID!"]
+    variables = {"id": state.node_id}
+    if removals:
+        params.append("$remove: [ID!]!")
+        variables["remove"] = [state.label_ids[label] for label in removals]
+        fields.append("remove: removeLabelsFromLabelable(input: {labelableId: $id, labelIds: $remove}) { clientMutationId }")
+    if additions:
+        params.append("$add: [ID!]!")
+        variables["add"] = [state.label_ids[label] for label in additions]
+        fields.append("add: addLabelsToLabelable(input: {labelableId: $id, labelIds: $add}) { clientMutationId }")
+    if merge_strategy:
+        params.extend(["$method: PullRequestMergeMethod!", "$head: GitObjectID!"])
+        variables["method"] = merge_strategy.upper()
+        variables["head"] = state.head_sha
+        fields.append("merge: mergePullRequest(input: {pullRequestId: $id, mergeMethod: $method, expectedHeadOid: $head}) { pullRequest { merged } }")
+    if not fields:
+        return state
+
+    for label in removals:
+        print(f"Removing label: {label}")
+    if additions:
+        print(f"Adding label: {', '.join(additions)}")
+
+    data, errors = client.graphql(f"mutation({', '.join(params)}) {{ {' '.join(fields)} }}", variables)
+    for error in errors:
+        print(f"GraphQL error: {error.get('message')}")
+    if removals and data.get("remove") is not None:
+        state.labels = [label for label in state.labels if label not in removals]
+    if additions and data.get("add") is not None:
+        state.labels = list(dict.fromkeys(state.labels + list(additions)))
+    if merge_strategy:
+        state.merge_attempted = True
+        state.merged = bool((data.get("merge") or {}).get("pullRequest", {}).get("merged"))
+    return state
+
+def _label_names(response):
+    """Return label names from a label mutation response, or None if unknown."""
+    if response.status_code != 200:
+        return None
+    try:
+        return [label['name'] for label in response.json()]
+    except (ValueError, TypeError, KeyError):
+        return None
+
+def apply_label_changes(client, api_url, pr_number, additions, removals):
+    """Apply label changes with one DELETE per removal and a single POST for additions.
+
+    GitHub answers both calls with the issue's full label list, so the
+    resulting state is returned for check_and_merge to reuse. Returns None
+    when the outcome could not be read back.
+    """
+    labels = None
+    for label in removals:
+        print(f"Removing label: {label}")
+        response = client.delete(f"{api_url}/issues/{pr_number}/labels/{quote(label, safe='')}")
+        if response.status_code == 404 and labels is not None:
+            # The label was already gone; the last known state still holds.
+            continue
+        labels = _label_names(response)
+    if additions:
+        print(f"Adding label: {', '.join(additions)}")
+        response = client.post(f"{api_url}/issues/{pr_number}/labels", json={"labels": list(additions)})
+        labels = _label_names(response)
+    return PullRequestState(labels) if labels is not None else None
+
+def read_pr_state(client, repo_full_name, pr_number):
+    """Fetch a PR's state through the configured backend, or None on failure."""
+    if graphql_enabled():
+        try:
+            return fetch_pr_state(client, repo_full_name, pr_number)
+        except RuntimeError as e:
+            print(f"Failed to get PR info: {e}")
+            return None
+
+    response = client.get(f"{client.repo_url(repo_full_name)}/pulls/{pr_number}")
+    if response.status_code != 200:
+        print(f"Failed to get PR info: {response.status_code}")
+        return None
+
+    pr = response.json()
+    return PullRequestState([label['name'] for label in pr.get('labels', [])],
+                            head_sha=(pr.get('head') or {}).get('sha'),
+                            base_ref=(pr.get('base') or {}).get('ref'),
+                            mergeable=REST_MERGEABLE.get(pr.get('mergeable'), "UNKNOWN"),
+                            merge_state=(pr.get('mergeable_state') or "unknown").upper(),
+                            merged=pr.get('merged') is True)
+
+REST_MERGEABLE = {True: "MERGEABLE", False: "CONFLICTING"}
+
+FAILED_CONCLUSIONS = {"failure", "cancelled", "timed_out", "action_required", "startup_failure", "stale"}
+
+def commit_checks_state(client, repo_full_name, sha):
+    """Summarise the check runs and statuses on a commit as SUCCESS, PENDING or FAILURE.
+
+    REST cannot tell which checks branch protection requires, so this looks
+    at all of them; it is only consulted once GitHub reports the PR blocked.
+    """
+    api_url = client.repo_url(repo_full_name)
+    state = "SUCCESS"
+    response = client.get(f"{api_url}/commits/{sha}/check-runs", params={"filter": "latest", "per_page": 100})
+    if response.status_code == 200:
+        for run in response.json().get('check_runs', []):
+            if run.get('status') != "completed":
+                state = "PENDING"
+            elif run.get('conclusion') in FAILED_CONCLUSIONS:
+                return "FAILURE"
+    response = client.get(f"{api_url}/commits/{sha}/status")
+    if response.status_code == 200:
+        combined = response.json()
+        if combined.get('statuses') and combined.get('state') == "pending":
+            state = "PENDING"
+        elif combined.get('state') in ("failure", "error"):
+            return "FAILURE"
+    return state
+
+def merge_readiness(client, repo_full_name, pr_number, state):
+    """Decide whether a PR can be merged now; returns (verdict, reason, state).
+
+    The verdict is "ready", "wait" when GitHub is still computing
+    mergeability or checks are still running, or "blocked". A state that
+    only carries labels (or none) is re-read first, and the state the verdict was
+    based on is returned.
+    """
+    if state is None or state.mergeable is None:
+        state = read_pr_state(client, repo_full_name, pr_number)
+        if state is None:
+            return "blocked", "its state could not be read", None
+    if state.merged:
+        return "blocked", "it is already merged", state
+    blocker = label_blocker(state)
+    if blocker:
+        return "blocked", blocker, state
+    if state.mergeable == "CONFLICTING" or state.merge_state == "DIRTY":
+        return "blocked", "it has merge conflicts", state
+    if state.checks is None and state.merge_state == "BLOCKED" and state.head_sha:
+        state.checks = commit_checks_state(client, repo_full_name, state.head_sha)
+    if state.checks == "FAILURE":
+        return "blocked", "required checks are failing", state
+    if state.checks == "PENDING":
+        return "wait", "required checks are pending", state
+    if state.mergeable == "UNKNOWN" or state.merge_state == "UNKNOWN":
+        return "wait", "GitHub is still computing its mergeability", state
+    if state.merge_state in ("BLOCKED", "BEHIND", "DRAFT"):
+        return "blocked", f"GitHub reports it as {state.merge_state.lower()}", state
+    return "ready", None, state
+
+def merge_pull_request(client, repo_full_name, pr_number, state):
+    """Merge a PR that is ready to go; returns True if GitHub merged it."""
+    merge_strategy = get_merge_strategy()
+    print(f"Using merge strategy: {merge_strategy}")
+
+    if graphql_enabled():
+        try:
+            apply_graphql_changes(client, state, merge_strategy=merge_strategy)
+        except RuntimeError as e:
+            print(f"Failed to merge PR #{pr_number}: {e}")
+            return False
+        if state.merged:
+            print(f"✅ Successfully merged PR #{pr_number}")
+        else:
+            print(f"Failed to merge PR #{pr_number}")
+        return state.merged
+
+    merge_data = {"merge_strategy": merge_strategy}
+    if state.head_sha:
+        # Only merge the commit whose checks were looked at.
+        merge_data["sha"] = state.head_sha
+    merge_response = client.put(f"{client.repo_url(repo_full_name)}/pulls/{pr_number}/merge", json=merge_data)
+
+    if merge_response.status_code == 200:
+        print(f"✅ Successfully merged PR #{pr_number}")
+        return True
+    print(f"Failed to merge PR #{pr_number}: {merge_response.status_code} - {merge_response.text}")
+    return False
+
+def check_and_merge(event, token, state=None):
+    """Check if PR has required labels and merge if conditions are met.
+
+    Synchronous wrapper around check_and_merge_async.
+    """
+    return run_sync(check_and_merge_async(event, token, state))
+
+@traced_async("merge.check")
+async def check_and_merge_async(event, token, state=None):
+    """Check if PR has required labels and merge if conditions are met.
+
+    `state` is a PullRequestState the caller already holds, which saves
+    re-reading the pull request. When a merge queue is running the PR is
+    queued instead of merged straight away.
+    """
+    if not auto_merge_enabled():
         print("Auto-merge is disabled")
         return
 
@@ -22,221 +1664,1682 @@ def check_and_merge(event, token):
         print("Event does not appear to be a comment on an issue/PR.")
         return
 
-    api_url = f"https://api.github.com/repos/{repo_full_name}"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
+    client = get_client(token)
 
-    response = requests.get(f"{api_url}/pulls/{pr_number}", headers=headers)
-    if response.status_code != 200:
-        print(f"Failed to get PR info: {response.status_code}")
+    if state is None or (graphql_enabled() and state.node_id is None):
+        state = await blocking(read_pr_state, client, repo_full_name, pr_number)
+        if state is None:
+            return
+    if state.merged:
+        print(f"PR #{pr_number} is merged")
+        return
+    if state.merge_attempted:
+        print(f"PR #{pr_number} merge was already attempted for this event")
         return
 
-    labels = [label['name'] for label in response.json().get('labels', [])]
+    blocker = label_blocker(state)
+    if blocker:
+        print(f"PR #{pr_number} not ready to merge. {blocker}")
+        return
 
-    if 'lgtm' in labels and 'approved' in labels and 'hold' not in labels:
-        print(f"PR #{pr_number} has lgtm and approved labels, attempting to merge...")
+    if _merge_queue is not None:
+        await blocking(_merge_queue.enqueue, client, repo_full_name, pr_number, state)
+        return
 
-        merge_strategy = os.environ.get("MERGE_STRATEGY", "merge")
-        if merge_strategy not in ["merge", "squash", "rebase"]:
-            print(f"Invalid merge strategy: {merge_strategy}, using 'merge'")
-            merge_strategy = "merge"
+    print(f"PR #{pr_number} has lgtm and approved labels, checking whether it can be merged...")
+    await blocking(get_merge_controller(token).attempt, client, repo_full_name, pr_number, state)
 
-        print(f"Using merge strategy: {merge_strategy}")
-        merge_data = {"merge_strategy": merge_strategy}
-        merge_response = requests.put(f"{api_url}/pulls/{pr_number}/merge", json=merge_data, headers=headers)
+class MergeQueue:
+    """Merges ready PRs in batches per base branch instead of all at once.
 
-        if merge_response.status_code == 200:
-            print(f"✅ Successfully merged PR #{pr_number}")
+    check_and_merge enqueues ready PRs while a queue is installed. Every
+    `interval` seconds up to `batch_size` PRs per (repository, base branch)
+    are merged, PRs carrying an earlier label from `priority_labels` first
+    and otherwise oldest first. Each PR is re-read just before merging so a
+    later /hold or /lgtm cancel still wins; one whose checks are still
+    running leaves the queue and waits in the MergeController, which queues
+    it again once they finish.
+    """
+
+    def __init__(self, token, batch_size=5, interval=60.0, priority_labels=()):
+        self.token = token
+        self.batch_size = batch_size
+        self.interval = interval
+        self.priority_labels = list(priority_labels)
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.queued = {}
+        self.seq = itertools.count()
+        self.clock = time.time
+        self.merge_times = deque(maxlen=1000)
+        self.stats = {"enqueued": 0, "merged": 0, "dropped": 0, "waiting": 0}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def priority(self, labels):
+        for rank, label in enumerate(self.priority_labels):
+            if label in labels:
+                return rank
+        return len(self.priority_labels)
+
+    def enqueue(self, client, repo_full_name, pr_number, state):
+        """Queue a ready PR; returns False if it was already queued."""
+        if state.base_ref is None:
+            fresh = read_pr_state(client, repo_full_name, pr_number)
+            state.base_ref = fresh.base_ref if fresh else None
+        queue_key = (repo_full_name, state.base_ref or "")
+        with self.lock:
+            if (repo_full_name, pr_number) in self.queued:
+                print(f"PR #{pr_number} is already in the merge queue")
+                return False
+            entry = (self.priority(state.labels), self.clock(), next(self.seq), repo_full_name, pr_number)
+            heapq.heappush(self.queues.setdefault(queue_key, []), entry)
+            self.queued[(repo_full_name, pr_number)] = entry
+            self.stats["enqueued"] += 1
+            depth = len(self.queues[queue_key])
+        print(f"PR #{pr_number} queued for merge into {state.base_ref or 'its base branch'} (depth {depth})")
+        return True
+
+    def drain_once(self):
+        """Merge up to batch_size PRs from every base branch queue."""
+        with self.lock:
+            batch = []
+            for queue_key, heap in list(self.queues.items()):
+                for _ in range(min(self.batch_size, len(heap))):
+                    batch.append(heapq.heappop(heap))
+                if not heap:
+                    del self.queues[queue_key]
+            for entry in batch:
+                del self.queued[(entry[3], entry[4])]
+
+        client = get_client(self.token)
+        controller = get_merge_controller(self.token)
+        for _, enqueued_at, _, repo_full_name, pr_number in batch:
+            print(f"Merging queued PR #{pr_number} from {repo_full_name}")
+            outcome = controller.attempt(client, repo_full_name, pr_number)
+            if outcome == "merged":
+                self.stats["merged"] += 1
+                self.merge_times.append(self.clock() - enqueued_at)
+            elif outcome == "waiting":
+                self.stats["waiting"] += 1
+            else:
+                print(f"Dropped PR #{pr_number} from the merge queue")
+                self.stats["dropped"] += 1
+        return len(batch)
+
+    def metrics(self):
+        with self.lock:
+            depth = {f"{repo}:{base}": len(heap) for (repo, base), heap in self.queues.items()}
+        times = sorted(self.merge_times)
+        return dict(self.stats, depth=depth,
+                    time_to_merge_p50=times[len(times) // 2] if times else None,
+                    time_to_merge_max=times[-1] if times else None)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.drain_once()
+            except Exception as e:
+                print(f"Merge queue pass failed: {e!r}")
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="merge-queue", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+_merge_queue = None
+
+def set_merge_queue(queue):
+    """Install (or with None, remove) the process-wide merge queue."""
+    global _merge_queue
+    _merge_queue = queue
+
+def merge_queue_enabled():
+    return os.environ.get("MERGE_QUEUE", "false").lower() in ["true", "1", "yes"]
+
+def merge_queue_from_env(token):
+    priority_labels = [label.strip() for label in os.environ.get("MERGE_PRIORITY_LABELS", "").split(",") if label.strip()]
+    return MergeQueue(
+        token,
+        batch_size=int(os.environ.get("MERGE_QUEUE_BATCH", "5")),
+        interval=float(os.environ.get("MERGE_QUEUE_INTERVAL", "60")),
+        priority_labels=priority_labels,
+    )
+
+class MergeController:
+    """Merges each ready PR exactly once, waiting out checks instead of failing.
+
+    attempt() looks at mergeability and required checks before it spends a
+    merge call. A PR that only has to wait (checks running, mergeability
+    still being computed) is remembered with its head SHA: a completion
+    event for that commit retries it through checks_completed(), and while
+    the poller runs it is re-checked after `interval` seconds, doubling up
+    to `max_interval`, until `timeout` seconds have passed. Attempts for a
+    PR that is already being merged are dropped, and the merge names the
+    head SHA that was checked, so a PR is merged at most once and never at
+    a commit its checks did not cover.
+    """
+
+    def __init__(self, token, interval=15.0, max_interval=300.0, timeout=3600.0):
+        self.token = token
+        self.interval = interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.waiting = {}
+        self.inflight = set()
+        self.clock = time.time
+        self.stats = {"attempts": 0, "merged": 0, "waited": 0, "blocked": 0, "failed": 0, "expired": 0}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def attempt(self, client, repo_full_name, pr_number, state=None):
+        """Merge the PR if it is ready.
+
+        Returns "merged", "waiting", "blocked", "failed" or "busy" when
+        another attempt for the PR is in flight.
+        """
+        if not self.claim(repo_full_name, pr_number):
+            return "busy"
+        outcome = None
+        try:
+            verdict, reason, state = merge_readiness(client, repo_full_name, pr_number, state)
+            if verdict == "wait":
+                self._wait((repo_full_name, pr_number), state.head_sha, reason)
+                return "waiting"
+            if verdict == "blocked":
+                print(f"PR #{pr_number} not ready to merge. {reason}")
+                outcome = "blocked"
+            else:
+                print(f"PR #{pr_number} is mergeable, attempting to merge...")
+                outcome = "merged" if merge_pull_request(client, repo_full_name, pr_number, state) else "failed"
+            return outcome
+        finally:
+            self.release(repo_full_name, pr_number, outcome)
+
+    def claim(self, repo_full_name, pr_number):
+        """Reserve a PR for one merge attempt; False if one is already in flight."""
+        key = (repo_full_name, pr_number)
+        with self.lock:
+            if key in self.inflight:
+                print(f"PR #{pr_number} is already being merged")
+                return False
+            self.inflight.add(key)
+            self.stats["attempts"] += 1
+            return True
+
+    def release(self, repo_full_name, pr_number, outcome=None):
+        """End a claimed attempt; an outcome ("merged", "blocked", "failed") stops the wait."""
+        key = (repo_full_name, pr_number)
+        with self.lock:
+            self.inflight.discard(key)
+            if outcome is not None:
+                self.waiting.pop(key, None)
+                self.stats[outcome] += 1
+
+    def _wait(self, key, head_sha, reason):
+        now = self.clock()
+        with self.lock:
+            entry = self.waiting.get(key)
+            if entry is None or entry["sha"] != head_sha:
+                entry = self.waiting[key] = {"sha": head_sha, "since": now, "delay": self.interval}
+                self.stats["waited"] += 1
+            else:
+                entry["delay"] = min(entry["delay"] * 2, self.max_interval)
+            entry["due"] = now + entry["delay"]
+        print(f"PR #{key[1]} is waiting to merge: {reason}. It is retried when its checks complete.")
+
+    def checks_completed(self, repo_full_name, sha):
+        """Return the waiting PRs of a repository whose head is `sha`."""
+        with self.lock:
+            return [pr_number for (repo, pr_number), entry in self.waiting.items()
+                    if repo == repo_full_name and entry["sha"] == sha]
+
+    def retry(self, repo_full_name, pr_number):
+        """Re-run the whole merge check for a PR, labels and merge queue included."""
+        key = (repo_full_name, pr_number)
+        with self.lock:
+            entry = self.waiting.get(key)
+            due = entry and entry["due"]
+        check_and_merge(pr_event(repo_full_name, pr_number), self.token)
+        with self.lock:
+            if entry is not None and self.waiting.get(key) is entry and entry["due"] == due:
+                # It never got back to attempt(): merged elsewhere, labels
+                # taken away, or handed to the merge queue.
+                del self.waiting[key]
+
+    def poll_once(self):
+        """Retry every waiting PR that is due; returns how many were retried."""
+        now = self.clock()
+        with self.lock:
+            expired = [key for key, entry in self.waiting.items() if now - entry["since"] >= self.timeout]
+            for key in expired:
+                del self.waiting[key]
+                self.stats["expired"] += 1
+            due = [key for key, entry in self.waiting.items() if entry["due"] <= now]
+        for repo_full_name, pr_number in expired:
+            print(f"Gave up waiting to merge PR #{pr_number} of {repo_full_name} after {self.timeout:.0f}s")
+        for repo_full_name, pr_number in due:
+            try:
+                self.retry(repo_full_name, pr_number)
+            except Exception as e:
+                print(f"Retrying the merge of PR #{pr_number} failed: {e!r}")
+        return len(due)
+
+    def next_due(self):
+        with self.lock:
+            return min((entry["due"] for entry in self.waiting.values()), default=None)
+
+    def settle(self, timeout):
+        """Poll waiting PRs in the foreground for up to `timeout` seconds."""
+        deadline = self.clock() + timeout
+        while (due := self.next_due()) is not None and self.clock() < deadline:
+            if self.stopped.wait(max(0.0, min(due, deadline) - self.clock())):
+                return
+            self.poll_once()
+
+    def metrics(self):
+        with self.lock:
+            return dict(self.stats, waiting=len(self.waiting))
+
+    def _run(self):
+        while not self.stopped.wait(self.interval / 4):
+            try:
+                self.poll_once()
+            except Exception as e:
+                print(f"Merge retry pass failed: {e!r}")
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="merge-retry", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+_merge_controller = None
+_merge_controller_lock = threading.Lock()
+
+def get_merge_controller(token):
+    """Return the process-wide MergeController, configured from the environment.
+
+    Retries use the latest token it was asked for with.
+    """
+    global _merge_controller
+    with _merge_controller_lock:
+        if _merge_controller is None:
+            _merge_controller = MergeController(
+                token,
+                interval=float(os.environ.get("MERGE_RETRY_INTERVAL", "15")),
+                max_interval=float(os.environ.get("MERGE_RETRY_MAX_INTERVAL", "300")),
+                timeout=float(os.environ.get("MERGE_RETRY_TIMEOUT", "3600")),
+            )
+        elif token:
+            _merge_controller.token = token
+        return _merge_controller
+
+REVIEW_LOAD_CHUNK = 50
+
+_review_loads = None
+
+def get_review_load_cache():
+    global _review_loads
+    with _team_cache_lock:
+        if _review_loads is None:
+            _review_loads = TTLCache(maxsize=4096, ttl=float(os.environ.get("REVIEW_LOAD_TTL", "300")))
+        return _review_loads
+
+def fetch_review_loads(client, repo_full_name, logins):
+    """Return {login: open PRs in the repo awaiting their review}.
+
+    Counts come from one aliased GraphQL search query per 50 candidates and
+    are cached briefly. Logins whose count could not be fetched are left out.
+    """
+    cache = get_review_load_cache()
+    loads = {}
+    missing = []
+    for login in logins:
+        count = cache.get(f"{repo_full_name}:{login}")
+        if count is None:
+            missing.append(login)
         else:
-            print(f"Failed to merge PR #{pr_number}: {merge_response.status_code} - {merge_response.text}")
-    else:
-        print(f"PR #{pr_number} not ready to merge. Labels: {labels}")
+            loads[login] = count
+
+    for start in range(0, len(missing), REVIEW_LOAD_CHUNK):
+        chunk = missing[start:start + REVIEW_LOAD_CHUNK]
+        fields = " ".join(
+            f"u{i}: search(query: {json.dumps(f'is:pr is:open repo:{repo_full_name} review-requested:{login}')}, "
+            f"type: ISSUE, first: 0) {{ issueCount }}"
+            for i, login in enumerate(chunk))
+        try:
+            data, _ = client.graphql(f"query {{ {fields} }}")
+        except RuntimeError as e:
+            print(f"Could not fetch review load: {e}")
+            continue
+        for i, login in enumerate(chunk):
+            result = data.get(f"u{i}")
+            if result is not None:
+                loads[login] = result["issueCount"]
+                cache.put(f"{repo_full_name}:{login}", result["issueCount"])
+    return loads
+
+def pick_least_loaded(candidates, count, loads):
+    """Pick `count` candidates at random, favouring those with fewer pending reviews.
+
+    Candidates are sampled without replacement with weight 1 / (1 + load), so
+    the least loaded are picked most often without one idle person getting
+    every review. Each candidate draws the key u ** (1 / weight) and the
+    highest keys win, which keeps this O(n log n) in the number of
+    candidates. Candidates without a known load rank after all known ones,
+    so the pick degrades to uniform random when loads are missing.
+    """
+    def key(login):
+        load = loads.get(login)
+        if load is None:
+            return (1, -random.random())
+        return (0, -random.random() ** (1 + load))
+    return sorted(candidates, key=key)[:count]
 
 def assign_reviewers(event, token, owners_path):
-    """Assign random reviewers and approvers when a PR is opened."""
+    """Assign reviewers and approvers when a PR is opened.
+
+    Synchronous wrapper around assign_reviewers_async.
+    """
+    return run_sync(assign_reviewers_async(event, token, owners_path))
+
+async def resolve_owners_async(client, pr_number, owners_path, repo_full_name):
+    """Resolve a PR's OWNERS and build its alias/team resolver side by side.
+
+    Returns (assignable, authorized, resolver). Raises FileNotFoundError if
+    the root OWNERS file is missing.
+    """
+    api_url = client.repo_url(repo_full_name)
+    try:
+        async with asyncio.TaskGroup() as tg:
+            owners = tg.create_task(blocking(resolve_pr_owners, client, api_url, pr_number, owners_path, repo_full_name))
+            resolver = tg.create_task(blocking(get_owners_resolver, client, repo_full_name, owners_path))
+    except* FileNotFoundError as group:
+        raise group.exceptions[0] from None
+    return (*owners.result(), resolver.result())
+
+@traced_async("reviewers.assign")
+async def assign_reviewers_async(event, token, owners_path):
+    """Assign reviewers and approvers when a PR is opened."""
+    plan = await reviewer_plan_async(event, token, owners_path)
+    if plan:
+        await get_executor().execute("opened", *event_pr_key(event), plan, token)
+
+@traced_async("reviewers.plan")
+async def reviewer_plan_async(event, token, owners_path):
+    """Pick reviewers and approvers for a newly opened PR, as a CommandPlan.
+
+    Picks at random, or with REVIEWER_SELECTION=load the candidates with the
+    fewest pending review requests. The members of every team among the
+    candidates are fetched concurrently. Returns None if the event is not a
+    usable PR opened event or the OWNERS file is missing.
+    """
     try:
         pr_number = event['pull_request']['number']
         repo_full_name = event['repository']['full_name']
         pr_author = event['pull_request']['user']['login']
     except KeyError:
         print("Event does not appear to be a PR opened event.")
-        return
-
-    workspace = os.environ.get("GITHUB_WORKSPACE", ".")
-    full_owners_path = os.path.join(workspace, owners_path)
+        return None
 
-    print(f"Reading OWNERS from: {full_owners_path}")
+    client = get_client(token)
 
     try:
-        with open(full_owners_path, "r") as f:
-            owners_data = yaml.safe_load(f)
+        owners, _, resolver = await resolve_owners_async(client, pr_number, owners_path, repo_full_name)
     except FileNotFoundError:
         print(f"ERROR: Could not find {owners_path} in the repository root.")
-        return
+        return None
 
-    approvers = owners_data.get("approvers", [])
-    reviewers = owners_data.get("reviewers", [])
+    async with asyncio.TaskGroup() as tg:
+        for org, slug in resolver.teams(owners.approvers + owners.reviewers):
+            tg.create_task(blocking(resolver.team_members, org, slug))
 
     # Remove PR author from potential reviewers
-    approvers = [a for a in approvers if a != pr_author]
-    reviewers = [r for r in reviewers if r != pr_author]
+    approvers = [a for a in resolver.expand_all(owners.approvers) if a != pr_author]
+    reviewers = [r for r in resolver.expand_all(owners.reviewers) if r != pr_author]
 
     num_reviewers = int(os.environ.get("AUTO_ASSIGN_REVIEWERS", "2"))
     num_approvers = int(os.environ.get("AUTO_ASSIGN_APPROVERS", "1"))
 
-    selected_reviewers = random.sample(reviewers, min(num_reviewers, len(reviewers))) if reviewers else []
-    selected_approvers = random.sample(approvers, min(num_approvers, len(approvers))) if approvers else []
+    loads = {}
+    if os.environ.get("REVIEWER_SELECTION", "random").lower() == "load":
+        loads = await blocking(fetch_review_loads, client, repo_full_name, list(dict.fromkeys(reviewers + approvers)))
 
-    all_assignees = list(set(selected_reviewers + selected_approvers))
+    if loads:
+        selected_reviewers = pick_least_loaded(reviewers, num_reviewers, loads)
+        selected_approvers = pick_least_loaded(approvers, num_approvers, loads)
+    else:
+        selected_reviewers = random.sample(reviewers, min(num_reviewers, len(reviewers))) if reviewers else []
+        selected_approvers = random.sample(approvers, min(num_approvers, len(approvers))) if approvers else []
 
-    if not all_assignees:
+    plan = CommandPlan()
+    plan.reviewers = list(dict.fromkeys(selected_reviewers + selected_approvers))
+    if plan.reviewers:
+        print(f"Assigning reviewers: {selected_reviewers}, approvers: {selected_approvers}")
+    else:
         print("No reviewers to assign.")
-        return
+    return plan
 
-    api_url = f"https://api.github.com/repos/{repo_full_name}"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
+class CommandPlan:
+    """Everything the handlers of one or more events want done to a PR.
+
+    Comment commands, label corrections and reviewer selection only record
+    their effects here, and `try_merge` asks for a merge attempt afterwards.
+    An executor then carries the plan out: ApiExecutor with one label
+    update, one reviewer request, one assignee update and at most one
+    retest, however many commands contributed; DryRunExecutor only reports
+    the operations.
+    """
+
+    def __init__(self):
+        self.labels = {}
+        self.reviewers = []
+        self.assignees = []
+        self.retest = False
+        self.try_merge = False
+
+    def __bool__(self):
+        return bool(self.labels or self.reviewers or self.assignees or self.retest)
+
+    def set_label(self, label, present):
+        # Later commands override earlier ones; move the label to the end so
+        # additions keep command order.
+        self.labels.pop(label, None)
+        self.labels[label] = present
+
+    def merge(self, other):
+        for label, present in other.labels.items():
+            self.set_label(label, present)
+        self.reviewers = list(dict.fromkeys(self.reviewers + other.reviewers))
+        self.assignees = list(dict.fromkeys(self.assignees + other.assignees))
+        self.retest = self.retest or other.retest
+        self.try_merge = self.try_merge or other.try_merge
+        return self
+
+    def operations(self):
+        """Return the API operations the plan stands for, in execution order.
+
+        Each removal is its own call and all additions share one; "merge"
+        is the merge attempt, which reads the PR and merges it only if it
+        is ready.
+        """
+        operations = [{"op": "remove_label", "label": label} for label, add in self.labels.items() if not add]
+        additions = [label for label, add in self.labels.items() if add]
+        if additions:
+            operations.append({"op": "add_labels", "labels": additions})
+        if self.reviewers:
+            operations.append({"op": "request_reviewers", "reviewers": self.reviewers})
+        if self.assignees:
+            operations.append({"op": "add_assignees", "assignees": self.assignees})
+        if self.retest:
+            operations.append({"op": "rerun_failed_jobs"})
+        if self.try_merge:
+            operations.append({"op": "merge", "strategy": get_merge_strategy()})
+        return operations
+
+class Command:
+    """A registered /command: who may use it and what it does to the plan."""
+
+    def __init__(self, name, role, handler, description):
+        self.name = name
+        self.role = role
+        self.handler = handler
+        self.description = description
+
+# name -> Command. Roles: "reviewers", "approvers" (checked against OWNERS)
+# or "anyone".
+COMMANDS = {}
+
+def command(name, role, description=""):
+    """Register a comment command handler(plan, args, author)."""
+    def register(handler):
+        COMMANDS[name] = Command(name, role, handler, description or handler.__doc__)
+        return handler
+    return register
+
+def _is_cancel(args):
+    return args[:1] == ["cancel"]
+
+def _logins(args, author):
+    return [arg.lstrip("@") for arg in args if arg.lstrip("@")] or [author]
 
-    print(f"Assigning reviewers: {selected_reviewers}, approvers: {selected_approvers}")
+@command("lgtm", "reviewers")
+def _lgtm(plan, args, author):
+    """Add or (with cancel) remove the lgtm label."""
+    plan.set_label("lgtm", not _is_cancel(args))
 
-    assign_data = {"reviewers": all_assignees}
-    response = requests.post(f"{api_url}/pulls/{pr_number}/requested_reviewers", json=assign_data, headers=headers)
+@command("approve", "approvers")
+def _approve(plan, args, author):
+    """Add or (with cancel) remove the approved label."""
+    plan.set_label("approved", not _is_cancel(args))
 
-    if response.status_code == 201:
-        print(f"✅ Successfully assigned {len(all_assignees)} reviewer(s) to PR #{pr_number}")
+@command("hold", "approvers")
+def _hold(plan, args, author):
+    """Add or (with cancel) remove the hold label."""
+    plan.set_label("hold", not _is_cancel(args))
+
+@command("unhold", "approvers")
+def _unhold(plan, args, author):
+    """Remove the hold label."""
+    plan.set_label("hold", False)
+
+@command("label", "reviewers")
+def _label(plan, args, author):
+    """Add labels, or remove them with /label cancel <name>; bot labels are refused."""
+    present = not _is_cancel(args)
+    for label in args[1:] if not present else args:
+        if label in BOT_LABELS:
+            print(f"Label '{label}' is managed by commands and cannot be set with /label")
+            continue
+        plan.set_label(label, present)
+
+@command("assign", "reviewers")
+def _assign(plan, args, author):
+    """Assign the PR to the given users, or to the commenter."""
+    plan.assignees = list(dict.fromkeys(plan.assignees + _logins(args, author)))
+
+@command("cc", "reviewers")
+def _cc(plan, args, author):
+    """Request reviews from the given users, or from the commenter."""
+    plan.reviewers = list(dict.fromkeys(plan.reviewers + _logins(args, author)))
+
+@command("retest", "reviewers")
+def _retest(plan, args, author):
+    """Re-run failed workflow runs for the PR head."""
+    plan.retest = True
+
+MAX_COMMENT_SCAN = 64 * 1024
+
+def parse_commands(body, commands=COMMANDS, limit=MAX_COMMENT_SCAN):
+    """Return the [(name, args)] commands in a comment, in order, in one pass.
+
+    A command is a registered /name at the start of a line, followed by its
+    lowercased arguments. Quoted lines and fenced code blocks are skipped
+    without tokenizing them, and only the first `limit` characters are
+    scanned, so pasted logs cannot trigger commands or slow the bot down.
+    """
+    found = []
+    in_fence = False
+    for line in body[:limit].splitlines():
+        line = line.lstrip()
+        if line.startswith(("```", "~~~")):
+            in_fence = not in_fence
+            continue
+        if in_fence or not line.startswith("/"):
+            continue
+        words = line.lower().split()
+        name = words[0][1:]
+        if name in commands:
+            found.append((name, words[1:]))
+    return found
+
+_label_snapshots = None
+
+def get_label_snapshots():
+    """Return the per-PR label snapshot cache, loading it on first use."""
+    global _label_snapshots
+    with _team_cache_lock:
+        if _label_snapshots is None:
+            cache_dir = _cache_dir()
+            _label_snapshots = TTLCache(
+                maxsize=int(os.environ.get("LABEL_SNAPSHOT_SIZE", "1024")),
+                ttl=float(os.environ.get("LABEL_SNAPSHOT_TTL", "604800")),
+                path=os.path.join(cache_dir, "labels.json") if cache_dir else None,
+            )
+        return _label_snapshots
+
+def record_expected_labels(repo_full_name, pr_number, labels):
+    """Remember the protected labels the bot's own change left on a PR."""
+    get_label_snapshots().put(f"{repo_full_name}#{pr_number}",
+                              {"expected": [label for label in labels if is_protected_label(label)]})
+
+def read_labels(client, repo_full_name, pr_number):
+    """Return a PR's labels, or None when they could not be read.
+
+    The read goes through the client's response cache, so labels unchanged
+    since the last read cost a 304 that does not count against the rate limit.
+    """
+    response = client.get(f"{client.repo_url(repo_full_name)}/issues/{pr_number}/labels",
+                          params={"per_page": 100})
+    if response.status_code != 200:
+        print(f"Failed to read labels of PR #{pr_number}: {response.status_code}")
+        return None
+    return [label['name'] for label in response.json()]
+
+def reconcile_labels(client, repo_full_name, pr_number, fallback):
+    """Work out how to bring a PR's protected labels back to the state the bot expects.
+
+    The desired state comes from the PR's snapshot, or from `fallback` (a
+    {label: add} mapping) when the bot has not changed the PR's labels yet.
+    Returns (changes, state): only labels whose actual state differs are
+    changed, and `state` is the PR's current state when no change is needed.
+    """
+    snapshot = get_label_snapshots().get(f"{repo_full_name}#{pr_number}")
+    if snapshot is None:
+        desired = fallback
     else:
-        print(f"Failed to assign reviewers to PR #{pr_number}: {response.status_code} - {response.text}")
+        desired = {label: label in snapshot["expected"] for label in fallback}
+    labels = read_labels(client, repo_full_name, pr_number)
+    if labels is None:
+        return desired, None
+
+    changes = {label: add for label, add in desired.items() if (label in labels) != add}
+    if not changes:
+        print(f"Labels of PR #{pr_number} already match the expected state")
+        return {}, PullRequestState(labels)
+    return changes, None
+
+# The role a protected label stands for.
+LABEL_ROLES = {"lgtm": "reviewers", "approved": "approvers"}
+
+def accept_label_change(repo_full_name, pr_number, label, present):
+    """Fold an authorized manual change of a protected label into the PR's snapshot."""
+    snapshots = get_label_snapshots()
+    key = f"{repo_full_name}#{pr_number}"
+    snapshot = snapshots.get(key)
+    if snapshot is None:
+        return
+    expected = [name for name in snapshot["expected"] if name != label]
+    snapshots.put(key, {"expected": expected + [label] if present else expected})
+
+def label_authorizer(token, event, owners_path):
+    """Return a check(login, label) of whether login holds the role a
+    protected label stands for on the event's PR."""
+    def check(login, label):
+        client = get_client(token)
+        repo_full_name, pr_number = event_pr_key(event)
+        try:
+            _, owners = resolve_pr_owners(client, client.repo_url(repo_full_name), pr_number,
+                                          owners_path, repo_full_name)
+        except FileNotFoundError:
+            return False
+        return owners.allows(login, LABEL_ROLES[label], get_owners_resolver(client, repo_full_name, owners_path))
+    return check
 
-def handle_label_event(event, token):
-    """Handle label added/removed events to protect bot-managed labels."""
+def label_event_changes(event, authorized=None):
+    """Return the label corrections a labeled/unlabeled event calls for.
+
+    Manual changes to protected labels are reverted unless `authorized`
+    (a check(login, label)) says the sender holds the role the label stands
+    for, in which case the change is accepted into the PR's snapshot.
+    Changes made by the bot itself (BOT_LOGIN, default github-actions[bot])
+    are left alone so the bot never fights its own updates.
+    """
     action = event.get('action')
     if action not in ['labeled', 'unlabeled']:
         print(f"Not a label event (action: {action})")
-        return
+        return None
 
     label_name = event.get('label', {}).get('name', '')
     if not is_protected_label(label_name):
         print(f"Label '{label_name}' is not protected, ignoring")
-        return
+        return None
 
-    pr_number = event.get('pull_request', {}).get('number')
-    repo_full_name = event.get('repository', {}).get('full_name', '')
     actor = event.get('sender', {}).get('login', 'unknown')
+    if actor == os.environ.get("BOT_LOGIN", "github-actions[bot]"):
+        print(f"Label '{label_name}' was changed by the bot itself, ignoring")
+        return None
 
-    api_url = f"https://api.github.com/repos/{repo_full_name}"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
+    if authorized is not None and authorized(actor, label_name):
+        change = "addition" if action == 'labeled' else "removal"
+        print(f"Authorized {change} of '{label_name}' label by {actor}, who is in '{LABEL_ROLES[label_name]}' list")
+        accept_label_change(*event_pr_key(event), label_name, action == 'labeled')
+        return None
 
     if action == 'labeled':
         # Unauthorized addition - remove the label
         print(f"Unauthorized addition of '{label_name}' label by {actor}, removing it")
-        requests.delete(f"{api_url}/issues/{pr_number}/labels/{label_name}", headers=headers)
-    elif action == 'unlabeled':
-        # Unauthorized removal - add the label back
-        print(f"Unauthorized removal of '{label_name}' label by {actor}, adding it back")
-        requests.post(f"{api_url}/issues/{pr_number}/labels", json={"labels": [label_name]}, headers=headers)
+        return {label_name: False}
+    # Unauthorized removal - add the label back
+    print(f"Unauthorized removal of '{label_name}' label by {actor}, adding it back")
+    return {label_name: True}
 
-def handle_comment_event(event, token, owners_path):
-    """Handle comment events for /lgtm /approve /hold commands."""
+@traced("labels.reconcile")
+def label_event_plan(event, token, owners_path=None):
+    """Plan the corrections a label added/removed event calls for.
+
+    With `owners_path`, changes by users who hold the label's role in the
+    OWNERS files are kept. Returns (plan, state), where `state` is the PR's
+    current state when it was read and needs no correction.
+    """
+    plan = CommandPlan()
+    changes = label_event_changes(event, label_authorizer(token, event, owners_path) if owners_path else None)
+    if not changes:
+        return plan, None
+
+    changes, state = reconcile_labels(get_client(token), *event_pr_key(event), changes)
+    for label, present in changes.items():
+        plan.set_label(label, present)
+    return plan, state
+
+def handle_label_event(event, token, owners_path=None):
+    """Handle label added/removed events to protect bot-managed labels.
+
+    Synchronous wrapper around handle_label_event_async.
+    """
+    return run_sync(handle_label_event_async(event, token, owners_path))
+
+async def handle_label_event_async(event, token, owners_path=None):
+    """Handle label added/removed events to protect bot-managed labels.
+
+    The corrections are planned by label_event_plan and carried out by the
+    executor. Returns the PR's resulting state when known.
+    """
+    plan, state = await blocking(label_event_plan, event, token, owners_path)
+    if not plan:
+        return state
+    return await get_executor().execute("label", *event_pr_key(event), plan, token, state)
+
+@traced_async("commands.plan")
+async def comment_plan_async(event, token, owners_path):
+    """Resolve every command in a comment into one CommandPlan.
+
+    Each command is checked against its role before its handler runs.
+    Returns None if the event is not a usable PR comment.
+    """
     try:
-        comment_body = event['comment']['body'].lower().strip()
+        comment_body = event['comment']['body']
         comment_author = event['comment']['user']['login']
         pr_number = event['issue']['number']
         repo_full_name = event['repository']['full_name']
     except KeyError:
         print("Event does not appear to be a comment on an issue/PR.")
-        return
+        return None
 
-    workspace = os.environ.get("GITHUB_WORKSPACE", ".")
-    full_owners_path = os.path.join(workspace, owners_path)
+    plan = CommandPlan()
+    commands = parse_commands(comment_body)
+    if not commands:
+        return plan
 
-    print(f"Reading OWNERS from: {full_owners_path}")
+    client = get_client(token)
 
     try:
-        with open(full_owners_path, "r") as f:
-            owners_data = yaml.safe_load(f)
+        _, owners, resolver = await resolve_owners_async(client, pr_number, owners_path, repo_full_name)
     except FileNotFoundError:
         print(f"ERROR: Could not find {owners_path} in the repository root.")
-        return
+        return None
 
-    approvers = owners_data.get("approvers", [])
-    reviewers = owners_data.get("reviewers", [])
+    for name, args in commands:
+        cmd = COMMANDS[name]
+        # Team lookups may hit the API.
+        if not await blocking(owners.allows, comment_author, cmd.role, resolver):
+            print(f"User {comment_author} is not in '{cmd.role}' list.")
+            continue
+        cmd.handler(plan, args, comment_author)
+    return plan
 
-    api_url = f"https://api.github.com/repos/{repo_full_name}"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
+def handle_comment_event(event, token, owners_path):
+    """Handle comment commands such as /lgtm, /approve and /hold.
 
-    def add_label(label):
-        print(f"Adding label: {label}")
-        requests.post(f"{api_url}/issues/{pr_number}/labels", json={"labels": [label]}, headers=headers)
+    Synchronous wrapper around handle_comment_event_async.
+    """
+    return run_sync(handle_comment_event_async(event, token, owners_path))
 
-    def remove_label(label):
-        print(f"Removing label: {label}")
-        requests.delete(f"{api_url}/issues/{pr_number}/labels/{label}", headers=headers)
+async def handle_comment_event_async(event, token, owners_path):
+    """Handle comment commands such as /lgtm, /approve and /hold.
 
-    words = comment_body.split()
+    All commands in the comment are folded into one plan before any API
+    call, which the executor then carries out. Returns the PR's resulting
+    state when known.
+    """
+    plan = await comment_plan_async(event, token, owners_path)
+    if not plan:
+        return None
+    return await get_executor().execute("comment", *event_pr_key(event), plan, token)
 
-    if "/lgtm" in words:
-        if comment_author in reviewers:
-            if "/lgtm cancel" in comment_body:
-                remove_label("lgtm")
-            else:
-                add_label("lgtm")
+def apply_plan(client, repo_full_name, pr_number, plan):
+    """Carry out a CommandPlan with one call per kind of effect.
+
+    Synchronous wrapper around apply_plan_async.
+    """
+    return run_sync(apply_plan_async(client, repo_full_name, pr_number, plan))
+
+async def apply_plan_async(client, repo_full_name, pr_number, plan):
+    """Carry out a CommandPlan with one call per kind of effect.
+
+    The label update, review request, assignment and retest do not depend on
+    each other and run concurrently. Returns the PR state produced by the
+    label update, if any.
+    """
+    api_url = client.repo_url(repo_full_name)
+    async with asyncio.TaskGroup() as tg:
+        labels = tg.create_task(blocking(apply_changes, client, repo_full_name, pr_number, plan.labels)) if plan.labels else None
+        if plan.reviewers:
+            tg.create_task(blocking(request_reviews, client, api_url, pr_number, plan.reviewers))
+        if plan.assignees:
+            tg.create_task(blocking(add_assignees, client, api_url, pr_number, plan.assignees))
+        if plan.retest:
+            tg.create_task(rerun_failed_runs_async(client, api_url, pr_number))
+    return labels.result() if labels else None
+
+def pr_event(repo_full_name, pr_number):
+    """Return a minimal issue event for a PR, as check_and_merge expects."""
+    return {"issue": {"number": pr_number}, "repository": {"full_name": repo_full_name}}
+
+class ApiExecutor:
+    """Carries CommandPlans out against the GitHub API."""
+
+    async def execute(self, kind, repo_full_name, pr_number, plan, token, state=None):
+        """Apply `plan` to a PR, then attempt the merge if the plan asks for it.
+
+        `state` is what planning already learned about the PR. A plan that
+        changes no labels leaves the state unknown, so when the merge
+        attempt needs it, it is read while the plan's other effects are in
+        flight. Returns the PR's resulting state when known.
+        """
+        client = get_client(token)
+        if plan.labels or state is not None or not plan.try_merge:
+            state = await apply_plan_async(client, repo_full_name, pr_number, plan) or state
         else:
-            print(f"User {comment_author} is not in 'reviewers' list.")
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(apply_plan_async(client, repo_full_name, pr_number, plan))
+                read = tg.create_task(blocking(read_pr_state, client, repo_full_name, pr_number))
+            state = read.result()
+        if plan.try_merge:
+            await check_and_merge_async(pr_event(repo_full_name, pr_number), token, state)
+        return state
 
-    if "/approve" in words:
-        if comment_author in approvers:
-            if "/approve cancel" in comment_body:
-                remove_label("approved")
-            else:
-                add_label("approved")
+class DryRunExecutor:
+    """Reports CommandPlans instead of carrying them out.
+
+    Each plan is written to `stream` as one JSON line and its operations
+    are counted per event kind, so the API cost of a corpus of events can be
+    measured without changing any PR. Planning still reads what it needs:
+    OWNERS files from disk, and the API only for nested OWNERS, teams,
+    review loads and label checks.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else sys.stdout
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    async def execute(self, kind, repo_full_name, pr_number, plan, token, state=None):
+        operations = plan.operations()
+        line = json.dumps({"event": kind, "repository": repo_full_name, "pull_request": pr_number,
+                           "operations": operations})
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+            counts = self.counts.setdefault(kind, {"plans": 0, "operations": {}})
+            counts["plans"] += 1
+            for operation in operations:
+                counts["operations"][operation["op"]] = counts["operations"].get(operation["op"], 0) + 1
+        return state
+
+    def summary(self):
+        """Return {event kind: plans, operations per plan and count per operation}."""
+        with self.lock:
+            return {kind: {"plans": counts["plans"],
+                           "operations_per_plan": round(sum(counts["operations"].values()) / counts["plans"], 3),
+                           "operations": dict(sorted(counts["operations"].items()))}
+                    for kind, counts in sorted(self.counts.items())}
+
+_executor = None
+
+def get_executor():
+    """Return the process-wide plan executor; plans run against the API by default."""
+    return _executor if _executor is not None else ApiExecutor()
+
+def set_executor(executor):
+    """Install (or with None, remove) the process-wide plan executor."""
+    global _executor
+    _executor = executor
+
+def dry_run_enabled():
+    return os.environ.get("DRY_RUN", "false").lower() in ["true", "1", "yes"]
+
+def request_reviews(client, api_url, pr_number, reviewers):
+    print(f"Requesting reviews from: {reviewers}")
+    response = client.post(f"{api_url}/pulls/{pr_number}/requested_reviewers", json={"reviewers": reviewers})
+    if response.status_code != 201:
+        print(f"Failed to request reviews on PR #{pr_number}: {response.status_code}")
+
+def add_assignees(client, api_url, pr_number, assignees):
+    print(f"Assigning: {assignees}")
+    response = client.post(f"{api_url}/issues/{pr_number}/assignees", json={"assignees": assignees})
+    if response.status_code != 201:
+        print(f"Failed to assign PR #{pr_number}: {response.status_code}")
+
+async def rerun_failed_runs_async(client, api_url, pr_number):
+    """Re-run the failed jobs of every failed workflow run on the PR head."""
+    response = await blocking(client.get, f"{api_url}/pulls/{pr_number}")
+    if response.status_code != 200:
+        print(f"Failed to get PR info: {response.status_code}")
+        return
+    head_sha = response.json()['head']['sha']
+
+    response = await blocking(client.get, f"{api_url}/actions/runs", params={"head_sha": head_sha, "status": "failure"})
+    if response.status_code != 200:
+        print(f"Failed to list workflow runs: {response.status_code}")
+        return
+    runs = response.json().get('workflow_runs', [])
+    if not runs:
+        print(f"No failed workflow runs to retest on {head_sha[:7]}")
+    async with asyncio.TaskGroup() as tg:
+        for run in runs:
+            print(f"Re-running failed jobs of workflow run {run['id']}")
+            tg.create_task(blocking(client.post, f"{api_url}/actions/runs/{run['id']}/rerun-failed-jobs"))
+
+def apply_changes(client, repo_full_name, pr_number, changes):
+    """Apply a {label: add} mapping through the configured backend.
+
+    The resulting labels are recorded as the state the bot expects.
+    """
+    additions = [label for label, add in changes.items() if add]
+    removals = [label for label, add in changes.items() if not add]
+    if graphql_enabled():
+        state = apply_changes_graphql(client, repo_full_name, pr_number, additions, removals)
+    else:
+        state = apply_label_changes(client, client.repo_url(repo_full_name), pr_number, additions, removals)
+    if state is not None:
+        record_expected_labels(repo_full_name, pr_number, state.labels)
+    return state
+
+def apply_changes_graphql(client, repo_full_name, pr_number, additions, removals):
+    """Apply label changes, and the merge they unlock, in two GraphQL calls.
+
+    The first call reads the PR state. The second carries the label mutations
+    and, when auto-merge is on and the resulting labels, mergeability and
+    required checks all allow it, the merge itself.
+    """
+    try:
+        state = fetch_pr_state(client, repo_full_name, pr_number)
+    except RuntimeError as e:
+        print(f"Failed to get PR info: {e}")
+        return None
+
+    # Skip no-op mutations; labels without a known id (other than the bot's
+    # and the PR's own) cannot be changed by id.
+    removals = [label for label in removals if label in state.labels]
+    additions = [label for label in additions if label not in state.labels]
+    missing = [label for label in additions + removals if label not in state.label_ids]
+    if missing:
+        print(f"No label ids known for {missing}, using REST")
+        return apply_label_changes(client, client.repo_url(repo_full_name), pr_number, additions, removals)
+
+    # The GraphQL state carries mergeability and required checks, so this
+    # verdict needs no further reads.
+    predicted = PullRequestState(
+        [label for label in state.labels if label not in removals] + additions,
+        head_sha=state.head_sha, mergeable=state.mergeable, checks=state.checks, merged=state.merged)
+    merge_strategy = None
+    controller = get_merge_controller(client.token)
+    if auto_merge_enabled() and _merge_queue is None and \
+            merge_readiness(client, repo_full_name, pr_number, predicted)[0] == "ready" and \
+            controller.claim(repo_full_name, pr_number):
+        merge_strategy = get_merge_strategy()
+        print(f"PR #{pr_number} will be ready to merge, merging with strategy: {merge_strategy}")
+
+    outcome = None
+    try:
+        apply_graphql_changes(client, state, additions, removals, merge_strategy)
+        outcome = "merged" if state.merged else "failed"
+    except RuntimeError as e:
+        print(f"Failed to update PR #{pr_number}: {e}")
+        return None
+    finally:
+        if merge_strategy:
+            controller.release(repo_full_name, pr_number, outcome or "failed")
+    if merge_strategy:
+        if state.merged:
+            print(f"✅ Successfully merged PR #{pr_number}")
         else:
-            print(f"User {comment_author} is not in 'approvers' list.")
+            # GitHub may not have agreed it was mergeable; a fresh attempt
+            # re-reads the PR and waits if it has to.
+            print(f"Failed to merge PR #{pr_number}, checking it again")
+            state.merged = controller.attempt(client, repo_full_name, pr_number) == "merged"
+    return state
+
+def event_kind(event):
+    """Classify an event payload as "opened", "label", "comment" or "checks", or None.
+
+    "checks" covers completed check suites and workflow runs and finished
+    commit statuses, which may be what a waiting PR needs to merge.
+
+    This only looks at the payload, so unsupported events can be turned away
+    before anything heavy is loaded.
+    """
+    if 'pull_request' in event and event.get('action') == 'opened':
+        return "opened"
+    if 'pull_request' in event and event.get('action') in ['labeled', 'unlabeled']:
+        return "label"
+    if 'comment' in event:
+        return "comment"
+    if event.get('action') == 'completed' and ('check_suite' in event or 'workflow_run' in event):
+        return "checks"
+    if 'sha' in event and 'context' in event and event.get('state') in ('success', 'failure', 'error'):
+        return "checks"
+    return None
 
-    if "/hold" in words:
-        if comment_author in approvers:
-            if "/hold cancel" in comment_body:
-                remove_label("hold")
+def delivery_ignored(name, event):
+    """Return why a webhook delivery carries no command for the bot, or None.
+
+    The Action's workflow only runs for new comments on PRs; the webhook
+    server is sent every comment, so it applies the same filter. `name` is
+    the X-GitHub-Event header, if there was one.
+    """
+    if 'comment' not in event:
+        return None
+    if name not in (None, "issue_comment") or 'issue' not in event:
+        return f"{name or 'comment'} events are not supported"
+    if event.get('action') != 'created':
+        return f"comment was {event.get('action')}"
+    if not event['issue'].get('pull_request'):
+        return "comment is not on a pull request"
+    return None
+
+@traced("dispatch")
+def dispatch_event(event, token, owners_path):
+    """Route one event payload to its handler, then try to merge.
+
+    Returns False if the event is not one the bot handles. Synchronous
+    wrapper around dispatch_event_async; unsupported events are turned away
+    before an event loop is started.
+    """
+    if event_kind(event) is None:
+        print("Event type not recognized or not supported")
+        return False
+    return run_sync(dispatch_event_async(event, token, owners_path))
+
+async def dispatch_event_async(event, token, owners_path):
+    """Plan what one event payload calls for, then execute the plan.
+
+    The plan carries the handler's effects and, for comments with auto-merge
+    on, a merge attempt. Returns False if the event is not one the bot
+    handles.
+    """
+    kind = event_kind(event)
+    state = None
+    if kind == "opened":
+        print("Detected PR opened event")
+        plan = await reviewer_plan_async(event, token, owners_path)
+    elif kind == "label":
+        print(f"Detected label event: {event.get('action')}")
+        plan, state = await blocking(label_event_plan, event, token, owners_path)
+    elif kind == "comment":
+        print("Detected comment event")
+        plan = await comment_plan_async(event, token, owners_path)
+    elif kind == "checks":
+        print("Detected checks completion event")
+        await handle_checks_event_async(event, token)
+        return True
+    else:
+        print("Event type not recognized or not supported")
+        return False
+
+    plan = plan or CommandPlan()
+    # Comment commands are what make a PR ready to merge.
+    plan.try_merge = kind == "comment" and auto_merge_enabled() and event_pr_key(event) is not None
+    if plan or plan.try_merge:
+        await get_executor().execute(kind, *event_pr_key(event), plan, token, state)
+    return True
+
+@traced("dispatch.batch")
+def dispatch_events(events, token, owners_path):
+    """Process a burst of events for one PR as a unit.
+
+    Synchronous wrapper around dispatch_events_async.
+    """
+    if len(events) == 1:
+        return dispatch_event(events[0], token, owners_path)
+    return run_sync(dispatch_events_async(events, token, owners_path))
+
+async def dispatch_events_async(events, token, owners_path):
+    """Process a burst of events for one PR as a unit.
+
+    Label corrections and comment commands from every event are folded into
+    one CommandPlan, applied once and followed by a single merge attempt. The
+    label events' corrections are reconciled once against the PR's snapshot
+    and its actual labels, like a single label event, so a burst that
+    cancels itself out changes nothing. The comments' plans are resolved
+    concurrently and merged on top in arrival order. PR opened events still
+    assign reviewers. Returns False if none of the events is one the bot
+    handles.
+    """
+    if len(events) == 1:
+        return await dispatch_event_async(events[0], token, owners_path)
+
+    corrections, plans = [], []
+    wants_merge = False
+    handled = False
+    async with asyncio.TaskGroup() as tg:
+        for event in events:
+            kind = event_kind(event)
+            if kind == "opened":
+                tg.create_task(assign_reviewers_async(event, token, owners_path))
+            elif kind == "label":
+                authorized = label_authorizer(token, event, owners_path)
+                corrections.append(tg.create_task(label_plan_async(event, authorized)))
+            elif kind == "comment":
+                plans.append(tg.create_task(comment_plan_async(event, token, owners_path)))
+                wants_merge = True
             else:
-                add_label("hold")
-        else:
-            print(f"User {comment_author} is not in 'approvers' list.")
+                continue
+            handled = True
+
+    plan = CommandPlan()
+    for part in corrections:
+        plan.merge(part.result())
+    if plan.labels:
+        changes, _ = await blocking(reconcile_labels, get_client(token), *event_pr_key(events[-1]), plan.labels)
+        plan.labels = dict(changes)
+    for part in plans:
+        plan.merge(part.result() or CommandPlan())
+    print(f"Coalesced {len(events)} events into {len(plan.labels)} label change(s)")
+    plan.try_merge = wants_merge and auto_merge_enabled()
+    if plan or plan.try_merge:
+        await get_executor().execute("batch", *event_pr_key(events[-1]), plan, token)
+    return handled
+
+def checks_event_pulls(client, event):
+    """Return the open PR numbers a checks completion event may unblock.
+
+    Check suites and workflow runs name the PRs of their head commit, except
+    for PRs from forks; those and commit statuses are found by the commit's
+    SHA, among the PRs the MergeController is waiting on or else through the
+    API.
+    """
+    repo_full_name = event['repository']['full_name']
+    run = event.get('check_suite') or event.get('workflow_run')
+    sha = run['head_sha'] if run else event['sha']
+    numbers = [pr['number'] for pr in (run or {}).get('pull_requests') or []]
+    numbers += get_merge_controller(client.token).checks_completed(repo_full_name, sha)
+    if not numbers:
+        response = client.get(f"{client.repo_url(repo_full_name)}/commits/{sha}/pulls")
+        if response.status_code != 200:
+            print(f"Failed to find pull requests for {sha[:7]}: {response.status_code}")
+            return []
+        numbers = [pr['number'] for pr in response.json() if pr.get('state') == 'open']
+    return list(dict.fromkeys(numbers))
+
+@traced_async("merge.checks")
+async def handle_checks_event_async(event, token):
+    """Retry the merge of every PR whose checks just completed."""
+    if not auto_merge_enabled():
+        print("Auto-merge is disabled")
+        return
+    client = get_client(token)
+    repo_full_name = event['repository']['full_name']
+    numbers = await blocking(checks_event_pulls, client, event)
+    if not numbers:
+        print("No open pull requests are waiting on these checks")
+    plan = CommandPlan()
+    plan.try_merge = True
+    executor = get_executor()
+    async with asyncio.TaskGroup() as tg:
+        for pr_number in numbers:
+            tg.create_task(executor.execute("checks", repo_full_name, pr_number, plan, token))
+
+async def label_plan_async(event, authorized):
+    """Return the label corrections of a label event as a CommandPlan."""
+    plan = CommandPlan()
+    for label, present in (await blocking(label_event_changes, event, authorized) or {}).items():
+        plan.set_label(label, present)
+    return plan
+
+def event_pr_key(event):
+    """Return (repo, PR number) for an event, or None if it is not about a PR."""
+    repo_full_name = event.get('repository', {}).get('full_name')
+    pr_number = (event.get('pull_request') or event.get('issue') or {}).get('number')
+    if not repo_full_name or pr_number is None:
+        return None
+    return (repo_full_name, pr_number)
+
+class EventQueue:
+    """Serializes events per (repo, PR) and coalesces bursts.
+
+    Each PR has at most one worker. Events that arrive while a batch for the
+    same PR is running, or within `window` seconds of the first one, are
+    handed to `process` together, so a burst of comments and label events
+    costs one label update and one merge attempt. Different PRs are processed
+    in parallel on `executor`.
+    """
+
+    def __init__(self, process, executor, window=0.0):
+        self.process = process
+        self.executor = executor
+        self.window = window
+        self.pending = {}
+        self.workers = {}
+        self.stats = {"events": 0, "batches": 0}
+
+    def put(self, event, key=None):
+        """Queue an event; returns the task that will process it."""
+        self.stats["events"] += 1
+        if key is None:
+            key = ("", id(event))
+        self.pending.setdefault(key, []).append(event)
+        if key not in self.workers:
+            self.workers[key] = asyncio.get_running_loop().create_task(self._drain(key))
+        return self.workers[key]
+
+    async def join(self):
+        """Wait until every queued event has been processed."""
+        while self.workers:
+            await asyncio.gather(*list(self.workers.values()), return_exceptions=True)
+
+    async def _drain(self, key):
+        loop = asyncio.get_running_loop()
+        try:
+            while self.pending.get(key):
+                if self.window:
+                    await asyncio.sleep(self.window)
+                batch = self.pending.pop(key)
+                self.stats["batches"] += 1
+                try:
+                    await loop.run_in_executor(self.executor, self.process, batch)
+                except Exception as e:
+                    print(f"Processing {len(batch)} event(s) for {key} failed: {e!r}")
+        finally:
+            del self.workers[key]
+
+MAX_WEBHOOK_BODY = 25 * 1024 * 1024
+WEBHOOK_READ_TIMEOUT = 10.0
+
+class WebhookServer:
+    """asyncio receiver that feeds GitHub webhook deliveries to the handlers.
+
+    Deliveries are checked against the X-Hub-Signature-256 HMAC, acknowledged
+    with 202 straight away and handed to an EventQueue, which processes each
+    pull request's events in arrival order (coalescing bursts) while
+    different pull requests run concurrently on a bounded thread pool. The
+    GitHub client, OWNERS caches and tries are module-level, so they stay
+    warm across deliveries.
+    """
+
+    def __init__(self, secret, token, owners_path, workers=8, window=0.0, dispatch=dispatch_events,
+                 read_timeout=WEBHOOK_READ_TIMEOUT):
+        self.secret = secret.encode()
+        self.read_timeout = read_timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.queue = EventQueue(lambda batch: self._process(dispatch, batch, token, owners_path),
+                                self.executor, window)
+        self.server = None
+
+    def _process(self, dispatch, batch, token, owners_path):
+        try:
+            return dispatch(batch, token, owners_path)
+        finally:
+            get_tracer().flush()
+
+    def metrics(self):
+        metrics = {"events": self.queue.stats}
+        if _client is not None:
+            metrics["api"] = _client.stats
+        if _merge_queue is not None:
+            metrics["merge_queue"] = _merge_queue.metrics()
+        if _merge_controller is not None:
+            metrics["merges"] = _merge_controller.metrics()
+        return metrics
+
+    def verify(self, body, signature):
+        expected = "sha256=" + hmac.new(self.secret, body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature or "")
+
+    async def start(self, host="0.0.0.0", port=8080):
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        await self.queue.join()
+        self.executor.shutdown(wait=True)
+
+    async def _respond(self, writer, status, reason, body=b""):
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+        writer.close()
+
+    async def _read_head(self, reader):
+        request_line = await reader.readline()
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return method, path, headers
+
+    async def _handle_connection(self, reader, writer):
+        # Each read is bounded so a slow or stalled client cannot hold a
+        # connection open indefinitely.
+        try:
+            method, path, headers = await asyncio.wait_for(self._read_head(reader), self.read_timeout)
+            length = int(headers.get("content-length", "0"))
+            if length < 0:
+                raise ValueError(f"negative Content-Length {length}")
+        except asyncio.TimeoutError:
+            await self._respond(writer, 408, "Request Timeout")
+            return
+        except (ValueError, UnicodeDecodeError):
+            await self._respond(writer, 400, "Bad Request")
+            return
+
+        if method == "GET" and path == "/healthz":
+            await self._respond(writer, 200, "OK", b"ok")
+            return
+        if method == "GET" and path == "/metrics":
+            await self._respond(writer, 200, "OK", json.dumps(self.metrics()).encode())
+            return
+        if method != "POST":
+            await self._respond(writer, 405, "Method Not Allowed")
+            return
+        if length > MAX_WEBHOOK_BODY:
+            await self._respond(writer, 413, "Payload Too Large")
+            return
+
+        try:
+            body = await asyncio.wait_for(reader.readexactly(length), self.read_timeout)
+        except asyncio.TimeoutError:
+            await self._respond(writer, 408, "Request Timeout")
+            return
+        except asyncio.IncompleteReadError:
+            await self._respond(writer, 400, "Bad Request")
+            return
+        if not self.verify(body, headers.get("x-hub-signature-256")):
+            await self._respond(writer, 401, "Unauthorized")
+            return
+        try:
+            event = json.loads(body)
+        except ValueError:
+            await self._respond(writer, 400, "Bad Request")
+            return
+
+        await self._respond(writer, 202, "Accepted")
+        reason = delivery_ignored(headers.get("x-github-event"), event)
+        if reason:
+            print(f"Ignoring delivery: {reason}")
+            return
+        self.queue.put(event, event_pr_key(event))
+
+def open_pull_requests(client, repo_full_name):
+    """Yield the open PRs of a repository, page by page as they arrive."""
+    url = f"{client.repo_url(repo_full_name)}/pulls?state=open&per_page=100"
+    while url:
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"Failed to list open pull requests: {response.status_code}")
+        yield from response.json()
+        url = response.links.get("next", {}).get("url")
+
+@traced("sweep.pr")
+def sweep_pull_request(client, repo_full_name, pr):
+    """Reconcile one open PR from its list entry; returns what was done.
+
+    Protected labels that drifted from the bot's snapshot are corrected and
+    a PR whose labels allow it is merged (or queued) once GitHub reports it
+    mergeable, or left waiting for its checks. The list entry already
+    carries the labels, so a PR that needs nothing costs no API call.
+    """
+    pr_number = pr['number']
+    if pr.get('draft'):
+        return "skipped"
+    labels = [label['name'] for label in pr.get('labels', [])]
+    outcome = "unchanged"
+
+    snapshot = get_label_snapshots().get(f"{repo_full_name}#{pr_number}")
+    if snapshot is not None:
+        changes = {label: label in snapshot["expected"] for label in BOT_LABELS
+                   if is_protected_label(label) and (label in labels) != (label in snapshot["expected"])}
+        if changes:
+            print(f"PR #{pr_number} labels drifted from the expected state, correcting {sorted(changes)}")
+            corrected = apply_changes(client, repo_full_name, pr_number, changes)
+            if corrected is None:
+                return "failed"
+            labels = corrected.labels
+            outcome = "corrected"
+
+    state = PullRequestState(labels, head_sha=(pr.get('head') or {}).get('sha'),
+                             base_ref=(pr.get('base') or {}).get('ref'))
+    if not auto_merge_enabled() or label_blocker(state):
+        return outcome
+    if _merge_queue is not None:
+        _merge_queue.enqueue(client, repo_full_name, pr_number, state)
+        return "queued"
+    # The list lacks mergeability and checks, so the controller reads the PR.
+    print(f"PR #{pr_number} has lgtm and approved labels, checking whether it can be merged...")
+    result = get_merge_controller(client.token).attempt(client, repo_full_name, pr_number)
+    return outcome if result in ("blocked", "busy") else result
+
+def sweep(repo_full_name, token, workers=8):
+    """Reconcile every open PR of a repository; returns {outcome: count}.
+
+    PRs are handed to `workers` threads as the listing streams in, so the
+    first PRs are being fixed while later pages are still being fetched.
+    """
+    client = get_client(token)
+    outcomes = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(sweep_pull_request, client, repo_full_name, pr): pr['number']
+                   for pr in open_pull_requests(client, repo_full_name)}
+        for future in as_completed(futures):
+            try:
+                outcome = future.result()
+            except Exception as e:
+                print(f"Sweeping PR #{futures[future]} failed: {e}")
+                outcome = "failed"
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    summary = ", ".join(f"{count} {outcome}" for outcome, count in sorted(outcomes.items()))
+    print(f"✅ Swept {sum(outcomes.values())} open PR(s) in {repo_full_name}: {summary or 'nothing to do'}")
+    return outcomes
+
+def refuse_dry_run(mode):
+    """Exit when DRY_RUN is set for a mode that acts without building plans."""
+    if dry_run_enabled():
+        print(f"DRY_RUN is not supported in {mode} mode; it only applies to events.")
+        sys.exit(1)
+
+def run_sweep():
+    """Sweep the repository named by GITHUB_REPOSITORY (schedule triggers)."""
+    refuse_dry_run("sweep")
+    repo_full_name = os.environ.get("GITHUB_REPOSITORY")
+    if not repo_full_name:
+        print("GITHUB_REPOSITORY must be set to sweep a repository.")
+        sys.exit(1)
+    try:
+        sweep(repo_full_name, os.environ.get("GITHUB_TOKEN"), workers=int(os.environ.get("SWEEP_WORKERS", "8")))
+    except RuntimeError as e:
+        print(f"Sweep failed: {e}")
+        sys.exit(1)
+    finally:
+        get_tracer().flush()
+
+def org_repositories(client, org):
+    """Yield the full names of an organization's active repositories."""
+    url = f"{client.base_url}/orgs/{org}/repos?per_page=100"
+    while url:
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"Failed to list repositories of {org}: {response.status_code}")
+        for repo in response.json():
+            if not repo.get('archived'):
+                yield repo['full_name']
+        url = response.links.get("next", {}).get("url")
+
+def sweep_repositories(repos, token, workers=4, sweep_workers=4):
+    """Sweep many repositories in one process; returns {repo: outcomes}.
+
+    All repositories share one client (connection pool, response cache and
+    a RateBudget) and the process-wide OWNERS, team and label caches.
+    `workers` repositories are swept at a time.
+    """
+    client = get_client(token)
+    if client.budget is None:
+        client.budget = RateBudget(client)
+
+    def run(repo):
+        try:
+            return sweep(repo, token, workers=sweep_workers)
+        except RuntimeError as e:
+            print(f"Sweep of {repo} failed: {e}")
+            return None
+        finally:
+            client.budget.finish(repo)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = dict(zip(repos, pool.map(run, repos)))
+    failed = [repo for repo, outcomes in results.items() if outcomes is None]
+    print(f"✅ Swept {len(results) - len(failed)} of {len(results)} repositories")
+    return results
+
+def run_org():
+    """Sweep the repositories in ORG_REPOS, or every repository of ORG_NAME."""
+    refuse_dry_run("organization")
+    token = os.environ.get("GITHUB_TOKEN")
+    repos = [repo.strip() for repo in os.environ.get("ORG_REPOS", "").split(",") if repo.strip()]
+    org = os.environ.get("ORG_NAME")
+    if not repos and org:
+        try:
+            repos = list(org_repositories(get_client(token), org))
+        except RuntimeError as e:
+            print(e)
+            sys.exit(1)
+    if not repos:
+        print("ORG_REPOS or ORG_NAME must be set to run across repositories.")
+        sys.exit(1)
+    try:
+        results = sweep_repositories(repos, token,
+                                     workers=int(os.environ.get("ORG_WORKERS", "4")),
+                                     sweep_workers=int(os.environ.get("SWEEP_WORKERS", "8")))
+    finally:
+        get_tracer().flush()
+    if any(outcomes is None for outcomes in results.values()):
+        sys.exit(1)
+
+def serve():
+    """Run the bot as a long-lived webhook server instead of a one-shot Action."""
+    refuse_dry_run("webhook server")
+    secret = os.environ.get("WEBHOOK_SECRET")
+    if not secret:
+        print("WEBHOOK_SECRET must be set to run the webhook server.")
+        sys.exit(1)
+
+    server = WebhookServer(
+        secret,
+        os.environ.get("GITHUB_TOKEN"),
+        os.environ.get("OWNERS_FILE", "OWNERS"),
+        workers=int(os.environ.get("SERVER_WORKERS", "8")),
+        window=float(os.environ.get("COALESCE_WINDOW", "0")),
+    )
+    # Events for many repositories share one client; split its budget fairly.
+    client = get_client(os.environ.get("GITHUB_TOKEN"))
+    client.budget = RateBudget(client)
+
+    if merge_queue_enabled():
+        merge_queue = merge_queue_from_env(os.environ.get("GITHUB_TOKEN"))
+        set_merge_queue(merge_queue)
+        merge_queue.start()
+    # PRs waiting on checks are polled in case a completion event is missed.
+    get_merge_controller(os.environ.get("GITHUB_TOKEN")).start()
+
+    async def run():
+        port = await server.start(os.environ.get("HOST", "0.0.0.0"), int(os.environ.get("PORT", "8080")))
+        print(f"Listening for webhooks on port {port}")
+        await server.server.serve_forever()
+
+    asyncio.run(run())
+
+def read_event_file(path):
+    """Return the event payloads in a file: one JSON object, or one per line."""
+    with open(path) as f:
+        text = f.read()
+    try:
+        return [json.loads(text)]
+    except ValueError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def run_plan(paths):
+    """Plan recorded events without executing anything; returns the DryRunExecutor.
+
+    Every event is dispatched as usual, but its plan is written as a JSON
+    line to DRY_RUN_OUTPUT (default: stdout) instead of being carried out,
+    and the operations per event kind are summarised at the end. Without a
+    GITHUB_TOKEN no request leaves the process.
+    """
+    token = os.environ.get("GITHUB_TOKEN")
+    owners_path = os.environ.get("OWNERS_FILE")
+    output_path = os.environ.get("DRY_RUN_OUTPUT")
+    output = open(output_path, "a") if output_path else None
+    executor = DryRunExecutor(output)
+    set_executor(executor)
+    events = {}
+    try:
+        for path in paths:
+            for event in read_event_file(path):
+                kind = event_kind(event) or "ignored"
+                events[kind] = events.get(kind, 0) + 1
+                dispatch_event(event, token, owners_path)
+    finally:
+        set_executor(None)
+        if output is not None:
+            output.close()
+        get_tracer().flush()
+
+    summary = executor.summary()
+    for kind, count in sorted(events.items()):
+        operations = summary.get(kind, {}).get("operations", {})
+        detail = ", ".join(f"{op}: {n}" for op, n in operations.items()) or "none"
+        print(f"Planned {count} {kind} event(s): {sum(operations.values()) / count:.3f} operation(s) per event ({detail})")
+    return executor
 
 def main():
     token = os.environ.get("GITHUB_TOKEN")
     owners_path = os.environ.get("OWNERS_FILE")
 
+    if os.environ.get("GITHUB_EVENT_NAME") in ["schedule", "workflow_dispatch"]:
+        run_sweep()
+        return
+
     event_path = os.environ.get("GITHUB_EVENT_PATH")
     if not event_path:
         print("No event path found. Is this running in GitHub Actions?")
         sys.exit(1)
 
-    with open(event_path, 'r') as f:
-        event = json.load(f)
+    if dry_run_enabled():
+        run_plan([event_path])
+        return
 
-    if 'pull_request' in event and event.get('action') == 'opened':
-        print("Detected PR opened event")
-        assign_reviewers(event, token, owners_path)
-    elif 'pull_request' in event and event.get('action') in ['labeled', 'unlabeled']:
-        print(f"Detected label event: {event.get('action')}")
-        handle_label_event(event, token)
-    elif 'comment' in event:
-        print("Detected comment event")
-        handle_comment_event(event, token, owners_path)
-    else:
-        print("Event type not recognized or not supported")
+    try:
+        with get_tracer().span("event.load", path=event_path):
+            with open(event_path, 'r') as f:
+                event = json.load(f)
+        handled = dispatch_event(event, token, owners_path)
+        merge_wait = float(os.environ.get("MERGE_WAIT", "0"))
+        if handled and merge_wait > 0 and _merge_controller is not None:
+            _merge_controller.settle(merge_wait)
+    finally:
+        get_tracer().flush()
+    if not handled:
         sys.exit(0)
 
-    check_and_merge(event, token)
+    if _client is not None and (_client.stats["retries"] or _client.stats["throttled_seconds"]):
+        stats = _client.stats
+        print(f"API usage: {stats['requests']} request(s), {stats['retries']} retried, "
+              f"{stats['throttled_seconds']:.1f}s throttled")
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:2] == ["serve"]:
+        serve()
+    elif sys.argv[1:2] == ["sweep"]:
+        run_sweep()
+    elif sys.argv[1:2] == ["org"]:
+        run_org()
+    elif sys.argv[1:2] == ["plan"]:
+        run_plan(sys.argv[2:] or [os.environ.get("GITHUB_EVENT_PATH")])
+    else:
+        main()
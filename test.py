@@ -1,9 +1,19 @@
 import os
 import json
 import yaml
+import asyncio
+import hashlib
+import hmac
+import subprocess
+import sys
+import tempfile
+import time
+import threading
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import patch, MagicMock
 import entrypoint
+import bench
 
 def createGitHubEvent(user, command):
     event = {
@@ -42,8 +52,40 @@ def createPROpenedEvent(author):
     with open("event.json", "w") as f:
         json.dump(event, f)
 
+def isolate_caches(test):
+    """Give test its own on-disk cache directory for the rest of the test.
+
+    GitHub runners always set RUNNER_TEMP, so without this the label
+    snapshots and responses one test leaves behind leak into the next.
+    """
+    cache_dir = tempfile.TemporaryDirectory()
+    environ = patch.dict(os.environ, {"OWNERS_CACHE_DIR": cache_dir.name})
+    environ.start()
+    entrypoint._label_snapshots = None
+    entrypoint._client = None
+
+    def cleanup():
+        entrypoint._label_snapshots = None
+        entrypoint._client = None
+        environ.stop()
+        cache_dir.cleanup()
+    test.addCleanup(cleanup)
+
+def stub_network(test):
+    """Answer any request a test does not patch explicitly with a 404.
+
+    Every verb falls through to Session.request, so this keeps the suite off
+    the network for the rest of the test.
+    """
+    fallback_response = MagicMock()
+    fallback_response.status_code = 404
+    patcher = patch('requests.Session.request', return_value=fallback_response)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
 class TestOwnersBot(unittest.TestCase):
     def setUp(self):
+        isolate_caches(self)
         # 1. Create a dummy OWNERS file
         self.owners_data = {
             "approvers": ["approver"],
@@ -56,12 +98,15 @@ class TestOwnersBot(unittest.TestCase):
         os.environ["OWNERS_FILE"] = "OWNERS"
         os.environ["GITHUB_EVENT_PATH"] = "event.json"
         os.environ["GITHUB_WORKSPACE"] = os.getcwd()
+        entrypoint._merge_controller = None
+
+        stub_network(self)
 
     def tearDown(self):
         if os.path.exists("OWNERS"): os.remove("OWNERS")
         if os.path.exists("event.json"): os.remove("event.json")
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_lgtm_success(self, mock_post):
         print("\n--- Testing Valid /lgtm ---")
 
@@ -71,11 +116,11 @@ class TestOwnersBot(unittest.TestCase):
         mock_post.assert_called_with(
             "https://api.github.com/repos/test/repo/issues/42/labels",
             json={"labels": ["lgtm"]},
-            headers={'Authorization': 'Bearer dummy-token', 'Accept': 'application/vnd.github.v3+json'}
+            timeout=10.0
         )
         print("✅ Success: /lgtm added label.")
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_unauthorized_lgtm(self, mock_post):
         print("\n--- Testing Unauthorized User ---")
 
@@ -85,7 +130,7 @@ class TestOwnersBot(unittest.TestCase):
         mock_post.assert_not_called()
         print("✅ Success: Random user was ignored.")
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_unauthorized_approve(self, mock_post):
         print("\n--- Testing Unauthorized User ---")
 
@@ -95,7 +140,7 @@ class TestOwnersBot(unittest.TestCase):
         mock_post.assert_not_called()
         print("✅ Success: Random user was ignored.")
 
-    @patch('requests.delete')
+    @patch('requests.Session.delete')
     def test_lgtm_cancel(self, mock_delete):
         print("\n--- Testing /lgtm cancel ---")
 
@@ -104,11 +149,11 @@ class TestOwnersBot(unittest.TestCase):
 
         mock_delete.assert_called_with(
             "https://api.github.com/repos/test/repo/issues/42/labels/lgtm",
-            headers={'Authorization': 'Bearer dummy-token', 'Accept': 'application/vnd.github.v3+json'}
+            timeout=10.0
         )
         print("✅ Success: Label removed.")
 
-    @patch('requests.delete')
+    @patch('requests.Session.delete')
     def test_unauthorized_lgtm_cancel(self, mock_delete):
         print("\n--- Testing unathorized /lgtm cancel ---")
 
@@ -118,7 +163,7 @@ class TestOwnersBot(unittest.TestCase):
         mock_delete.assert_not_called()
         print("✅ Success: Label was not removed.")
 
-    @patch('requests.delete')
+    @patch('requests.Session.delete')
     def test_unauthorized_approve_cancel(self, mock_delete):
         print("\n--- Testing unathorized /approve cancel ---")
 
@@ -128,7 +173,7 @@ class TestOwnersBot(unittest.TestCase):
         mock_delete.assert_not_called()
         print("✅ Success: Label was not removed.")
 
-    @patch('requests.delete')
+    @patch('requests.Session.delete')
     def test_approve_cancel(self, mock_delete):
         print("\n--- Testing /approve cancel ---")
 
@@ -137,11 +182,11 @@ class TestOwnersBot(unittest.TestCase):
 
         mock_delete.assert_called_with(
             "https://api.github.com/repos/test/repo/issues/42/labels/approved",
-            headers={'Authorization': 'Bearer dummy-token', 'Accept': 'application/vnd.github.v3+json'}
+            timeout=10.0
         )
         print("✅ Success: Label removed.")
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_exactly_approve(self, mock_post):
         print("\n--- Testing random/approve doesn't get treated as /approve ---")
 
@@ -151,7 +196,7 @@ class TestOwnersBot(unittest.TestCase):
         mock_post.assert_not_called()
         print("✅ Success: command ignored.")
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_exactly_lgtm(self, mock_post):
         print("\n--- Testing random/lgtm doesn't get treated as /lgtm ---")
 
@@ -161,7 +206,7 @@ class TestOwnersBot(unittest.TestCase):
         mock_post.assert_not_called()
         print("✅ Success: command ignored.")
 
-    @patch('requests.delete')
+    @patch('requests.Session.delete')
     def test_unauthorized_label_addition(self, mock_delete):
         print("\n--- Testing Unauthorized Label Addition ---")
 
@@ -170,11 +215,25 @@ class TestOwnersBot(unittest.TestCase):
 
         mock_delete.assert_called_with(
             "https://api.github.com/repos/test/repo/issues/42/labels/lgtm",
-            headers={'Authorization': 'Bearer dummy-token', 'Accept': 'application/vnd.github.v3+json'}
+            timeout=10.0
         )
         print("✅ Success: Unauthorized label addition was reverted.")
 
-    @patch('requests.post')
+    @patch('requests.Session.delete')
+    def test_handle_label_event_reverts_manual_change(self, mock_delete):
+        print("\n--- Testing handle_label_event plans and executes the correction ---")
+
+        event = {"action": "labeled", "pull_request": {"number": 42}, "label": {"name": "lgtm"},
+                 "sender": {"login": "random-user"}, "repository": {"full_name": "test/repo"}}
+        entrypoint.handle_label_event(event, "dummy-token")
+
+        mock_delete.assert_called_with(
+            "https://api.github.com/repos/test/repo/issues/42/labels/lgtm",
+            timeout=10.0
+        )
+        print("✅ Success: Manual label addition reverted through the wrapper.")
+
+    @patch('requests.Session.post')
     def test_unauthorized_label_removal(self, mock_post):
         print("\n--- Testing Unauthorized Label Removal ---")
 
@@ -184,12 +243,39 @@ class TestOwnersBot(unittest.TestCase):
         mock_post.assert_called_with(
             "https://api.github.com/repos/test/repo/issues/42/labels",
             json={"labels": ["approved"]},
-            headers={'Authorization': 'Bearer dummy-token', 'Accept': 'application/vnd.github.v3+json'}
+            timeout=10.0
         )
         print("✅ Success: Unauthorized label removal was reverted.")
 
-    @patch('requests.delete')
-    @patch('requests.post')
+    @patch('requests.Session.delete')
+    @patch('requests.Session.post')
+    def test_authorized_label_change_kept(self, mock_post, mock_delete):
+        print("\n--- Testing label changes by OWNERS with the label's role are kept ---")
+
+        createLabelEvent("Reviewer", "labeled", "lgtm")
+        entrypoint.main()
+        createLabelEvent("approver", "unlabeled", "approved")
+        entrypoint.main()
+
+        mock_delete.assert_not_called()
+        mock_post.assert_not_called()
+        print("✅ Success: Authorized label changes left alone.")
+
+    @patch('requests.Session.delete')
+    def test_label_needs_its_own_role(self, mock_delete):
+        print("\n--- Testing a reviewer cannot add the approved label by hand ---")
+
+        createLabelEvent("reviewer", "labeled", "approved")
+        entrypoint.main()
+
+        mock_delete.assert_called_with(
+            "https://api.github.com/repos/test/repo/issues/42/labels/approved",
+            timeout=10.0
+        )
+        print("✅ Success: Label reverted for a user without the approver role.")
+
+    @patch('requests.Session.delete')
+    @patch('requests.Session.post')
     def test_unprotected_label_ignored(self, mock_post, mock_delete):
         print("\n--- Testing Unprotected Label Ignored ---")
 
@@ -200,7 +286,54 @@ class TestOwnersBot(unittest.TestCase):
         mock_post.assert_not_called()
         print("✅ Success: Unprotected label was ignored.")
 
-    @patch('requests.post')
+    @patch('requests.Session.delete')
+    @patch('requests.Session.post')
+    def test_bot_label_change_ignored(self, mock_post, mock_delete):
+        print("\n--- Testing the bot's own label changes are ignored ---")
+
+        createLabelEvent("github-actions[bot]", "labeled", "lgtm")
+        entrypoint.main()
+
+        mock_delete.assert_not_called()
+        mock_post.assert_not_called()
+        print("✅ Success: Bot label change left alone.")
+
+    @patch('requests.Session.get')
+    @patch('requests.Session.delete')
+    @patch('requests.Session.post')
+    def test_label_reconciled_against_snapshot(self, mock_post, mock_delete, mock_get):
+        print("\n--- Testing label events reconcile against the bot's snapshot ---")
+
+        labels_url = "https://api.github.com/repos/test/repo/issues/42/labels"
+        post_response = MagicMock()
+        post_response.status_code = 200
+        post_response.json.return_value = [{"name": "lgtm"}]
+        mock_post.return_value = post_response
+        createGitHubEvent("reviewer", "/lgtm")
+        entrypoint.main()
+        mock_post.reset_mock()
+
+        # Someone removes lgtm by hand: the bot set it, so it goes back.
+        get_response = MagicMock()
+        get_response.status_code = 200
+        get_response.json.return_value = []
+        mock_get.return_value = get_response
+        createLabelEvent("random-user", "unlabeled", "lgtm")
+        entrypoint.main()
+
+        mock_post.assert_called_with(labels_url, json={"labels": ["lgtm"]}, timeout=10.0)
+        mock_post.reset_mock()
+
+        # A redelivered event finds lgtm already back: no mutation.
+        get_response.json.return_value = [{"name": "lgtm"}]
+        entrypoint.main()
+
+        mock_get.assert_any_call(labels_url, params={"per_page": 100}, timeout=10.0)
+        mock_post.assert_not_called()
+        mock_delete.assert_not_called()
+        print("✅ Success: Only the needed label mutation was sent.")
+
+    @patch('requests.Session.post')
     def test_hold_success(self, mock_post):
         print("\n--- Testing Valid /hold ---")
 
@@ -210,11 +343,11 @@ class TestOwnersBot(unittest.TestCase):
         mock_post.assert_called_with(
             "https://api.github.com/repos/test/repo/issues/42/labels",
             json={"labels": ["hold"]},
-            headers={'Authorization': 'Bearer dummy-token', 'Accept': 'application/vnd.github.v3+json'}
+            timeout=10.0
         )
         print("✅ Success: /hold added label.")
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_unauthorized_hold(self, mock_post):
         print("\n--- Testing Unauthorized /hold ---")
 
@@ -224,7 +357,7 @@ class TestOwnersBot(unittest.TestCase):
         mock_post.assert_not_called()
         print("✅ Success: Reviewer cannot add hold label.")
 
-    @patch('requests.delete')
+    @patch('requests.Session.delete')
     def test_hold_cancel(self, mock_delete):
         print("\n--- Testing /hold cancel ---")
 
@@ -233,11 +366,11 @@ class TestOwnersBot(unittest.TestCase):
 
         mock_delete.assert_called_with(
             "https://api.github.com/repos/test/repo/issues/42/labels/hold",
-            headers={'Authorization': 'Bearer dummy-token', 'Accept': 'application/vnd.github.v3+json'}
+            timeout=10.0
         )
         print("✅ Success: Hold label removed.")
 
-    @patch('requests.delete')
+    @patch('requests.Session.delete')
     def test_unauthorized_hold_cancel(self, mock_delete):
         print("\n--- Testing unauthorized /hold cancel ---")
 
@@ -247,7 +380,7 @@ class TestOwnersBot(unittest.TestCase):
         mock_delete.assert_not_called()
         print("✅ Success: Reviewer cannot remove hold label.")
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_exactly_hold(self, mock_post):
         print("\n--- Testing random/hold doesn't get treated as /hold ---")
 
@@ -257,8 +390,8 @@ class TestOwnersBot(unittest.TestCase):
         mock_post.assert_not_called()
         print("✅ Success: command ignored.")
 
-    @patch('requests.put')
-    @patch('requests.get')
+    @patch('requests.Session.put')
+    @patch('requests.Session.get')
     def test_merge_when_ready(self, mock_get, mock_put):
         print("\n--- Testing PR merges when lgtm and approved labels present ---")
 
@@ -271,7 +404,9 @@ class TestOwnersBot(unittest.TestCase):
             "labels": [
                 {"name": "lgtm"},
                 {"name": "approved"}
-            ]
+            ],
+            "mergeable": True,
+            "mergeable_state": "clean"
         }
         mock_get.return_value = mock_pr_response
 
@@ -285,12 +420,12 @@ class TestOwnersBot(unittest.TestCase):
         mock_put.assert_called_with(
             "https://api.github.com/repos/test/repo/pulls/42/merge",
             json={"merge_strategy": "merge"},
-            headers={'Authorization': 'Bearer dummy-token', 'Accept': 'application/vnd.github.v3+json'}
+            timeout=10.0
         )
         print("✅ Success: PR merged when ready.")
 
-    @patch('requests.put')
-    @patch('requests.get')
+    @patch('requests.Session.put')
+    @patch('requests.Session.get')
     def test_no_merge_when_only_lgtm(self, mock_get, mock_put):
         print("\n--- Testing PR doesn't merge with only lgtm label ---")
 
@@ -311,8 +446,8 @@ class TestOwnersBot(unittest.TestCase):
         mock_put.assert_not_called()
         print("✅ Success: PR not merged with only lgtm.")
 
-    @patch('requests.put')
-    @patch('requests.get')
+    @patch('requests.Session.put')
+    @patch('requests.Session.get')
     def test_no_merge_when_only_approved(self, mock_get, mock_put):
         print("\n--- Testing PR doesn't merge with only approved label ---")
 
@@ -333,8 +468,8 @@ class TestOwnersBot(unittest.TestCase):
         mock_put.assert_not_called()
         print("✅ Success: PR not merged with only approved.")
 
-    @patch('requests.put')
-    @patch('requests.get')
+    @patch('requests.Session.put')
+    @patch('requests.Session.get')
     def test_no_merge_when_hold_present(self, mock_get, mock_put):
         print("\n--- Testing PR doesn't merge when hold label present ---")
 
@@ -357,8 +492,8 @@ class TestOwnersBot(unittest.TestCase):
         mock_put.assert_not_called()
         print("✅ Success: PR not merged when hold is present.")
 
-    @patch('requests.put')
-    @patch('requests.get')
+    @patch('requests.Session.put')
+    @patch('requests.Session.get')
     def test_merge_with_squash_strategy(self, mock_get, mock_put):
         print("\n--- Testing PR merges with squash strategy ---")
 
@@ -372,7 +507,9 @@ class TestOwnersBot(unittest.TestCase):
             "labels": [
                 {"name": "lgtm"},
                 {"name": "approved"}
-            ]
+            ],
+            "mergeable": True,
+            "mergeable_state": "clean"
         }
         mock_get.return_value = mock_pr_response
 
@@ -386,7 +523,7 @@ class TestOwnersBot(unittest.TestCase):
         mock_put.assert_called_with(
             "https://api.github.com/repos/test/repo/pulls/42/merge",
             json={"merge_strategy": "squash"},
-            headers={'Authorization': 'Bearer dummy-token', 'Accept': 'application/vnd.github.v3+json'}
+            timeout=10.0
         )
 
         # Clean up
@@ -395,8 +532,8 @@ class TestOwnersBot(unittest.TestCase):
 
         print("✅ Success: PR merged with squash strategy.")
 
-    @patch('requests.put')
-    @patch('requests.get')
+    @patch('requests.Session.put')
+    @patch('requests.Session.get')
     def test_merge_with_rebase_strategy(self, mock_get, mock_put):
         print("\n--- Testing PR merges with rebase strategy ---")
 
@@ -410,7 +547,9 @@ class TestOwnersBot(unittest.TestCase):
             "labels": [
                 {"name": "lgtm"},
                 {"name": "approved"}
-            ]
+            ],
+            "mergeable": True,
+            "mergeable_state": "clean"
         }
         mock_get.return_value = mock_pr_response
 
@@ -424,7 +563,7 @@ class TestOwnersBot(unittest.TestCase):
         mock_put.assert_called_with(
             "https://api.github.com/repos/test/repo/pulls/42/merge",
             json={"merge_strategy": "rebase"},
-            headers={'Authorization': 'Bearer dummy-token', 'Accept': 'application/vnd.github.v3+json'}
+            timeout=10.0
         )
 
         # Clean up
@@ -433,9 +572,9 @@ class TestOwnersBot(unittest.TestCase):
 
         print("✅ Success: PR merged with rebase strategy.")
 
-    @patch('requests.put')
-    @patch('requests.get')
-    @patch('requests.post')
+    @patch('requests.Session.put')
+    @patch('requests.Session.get')
+    @patch('requests.Session.post')
     def test_auto_merge_disabled(self, mock_post, mock_get, mock_put):
         print("\n--- Testing auto-merge disabled ---")
 
@@ -466,8 +605,138 @@ class TestOwnersBot(unittest.TestCase):
 
         print("✅ Success: Auto-merge was disabled.")
 
+    @patch('requests.Session.put')
+    @patch('requests.Session.get')
+    @patch('requests.Session.delete')
+    @patch('requests.Session.post')
+    def test_multiple_commands_batched(self, mock_post, mock_delete, mock_get, mock_put):
+        print("\n--- Testing several commands become one label POST ---")
+
+        createGitHubEvent("approver", "/lgtm\n/approve\n/hold cancel")
+
+        mock_delete_response = MagicMock()
+        mock_delete_response.status_code = 200
+        mock_delete_response.json.return_value = [{"name": "hold"}]
+        mock_delete.return_value = mock_delete_response
+
+        mock_post_response = MagicMock()
+        mock_post_response.status_code = 200
+        mock_post_response.json.return_value = [{"name": "lgtm"}, {"name": "approved"}]
+        mock_post.return_value = mock_post_response
+
+        mock_merge_response = MagicMock()
+        mock_merge_response.status_code = 200
+        mock_put.return_value = mock_merge_response
+
+        mock_pr_response = MagicMock()
+        mock_pr_response.status_code = 200
+        mock_pr_response.json.return_value = {
+            "labels": [{"name": "lgtm"}, {"name": "approved"}],
+            "mergeable": True,
+            "mergeable_state": "clean"
+        }
+        mock_get.return_value = mock_pr_response
+
+        entrypoint.main()
+
+        mock_post.assert_called_once_with(
+            "https://api.github.com/repos/test/repo/issues/42/labels",
+            json={"labels": ["lgtm", "approved"]},
+            timeout=10.0
+        )
+        mock_delete.assert_called_once_with(
+            "https://api.github.com/repos/test/repo/issues/42/labels/hold",
+            timeout=10.0
+        )
+        # The PR is read once, for its mergeability, before merging
+        mock_get.assert_called_once_with("https://api.github.com/repos/test/repo/pulls/42", timeout=10.0)
+        mock_put.assert_called_once()
+        print("✅ Success: Commands batched and labels reused for merge.")
+
+    @patch('requests.Session.delete')
+    @patch('requests.Session.post')
+    def test_new_commands_build_one_plan(self, mock_post, mock_delete):
+        print("\n--- Testing /cc /assign /label /unhold resolve into one plan ---")
+
+        createGitHubEvent("approver", "/cc @reviewer\n/assign\n/label kind/bug\n/label lgtm\n/cc other\n/unhold")
+        entrypoint.main()
+
+        mock_post.assert_any_call(
+            "https://api.github.com/repos/test/repo/issues/42/labels",
+            json={"labels": ["kind/bug"]},
+            timeout=10.0
+        )
+        mock_post.assert_any_call(
+            "https://api.github.com/repos/test/repo/pulls/42/requested_reviewers",
+            json={"reviewers": ["reviewer", "other"]},
+            timeout=10.0
+        )
+        mock_post.assert_any_call(
+            "https://api.github.com/repos/test/repo/issues/42/assignees",
+            json={"assignees": ["approver"]},
+            timeout=10.0
+        )
+        self.assertEqual(mock_post.call_count, 3)
+        mock_delete.assert_called_once_with(
+            "https://api.github.com/repos/test/repo/issues/42/labels/hold",
+            timeout=10.0
+        )
+        print("✅ Success: One call per kind of effect.")
+
+    @patch('requests.Session.delete')
+    def test_label_cancel_encodes_name(self, mock_delete):
+        print("\n--- Testing /label cancel escapes the label name in the URL ---")
+
+        createGitHubEvent("reviewer", "/label cancel kind/bug")
+        entrypoint.main()
+
+        mock_delete.assert_called_once_with(
+            "https://api.github.com/repos/test/repo/issues/42/labels/kind%2Fbug",
+            timeout=10.0
+        )
+        print("✅ Success: Label name sent as one path segment.")
+
+    @patch('requests.Session.post')
+    @patch('requests.Session.get')
+    def test_retest_reruns_failed_runs(self, mock_get, mock_post):
+        print("\n--- Testing /retest re-runs failed workflow runs ---")
+
+        def get(url, **kwargs):
+            response = MagicMock()
+            response.status_code = 200
+            if url.endswith("/actions/runs"):
+                response.json.return_value = {"workflow_runs": [{"id": 7}]}
+            else:
+                response.json.return_value = {"head": {"sha": "abc123"}, "labels": []}
+            return response
+        mock_get.side_effect = get
+
+        createGitHubEvent("reviewer", "/retest")
+        entrypoint.main()
+
+        mock_get.assert_any_call(
+            "https://api.github.com/repos/test/repo/actions/runs",
+            params={"head_sha": "abc123", "status": "failure"},
+            timeout=10.0
+        )
+        mock_post.assert_called_once_with(
+            "https://api.github.com/repos/test/repo/actions/runs/7/rerun-failed-jobs",
+            timeout=10.0
+        )
+        print("✅ Success: Failed runs re-run.")
+
+    @patch('requests.Session.post')
+    def test_unauthorized_cc(self, mock_post):
+        print("\n--- Testing unauthorized /cc ---")
+
+        createGitHubEvent("unathorized", "/cc @reviewer")
+        entrypoint.main()
+
+        mock_post.assert_not_called()
+        print("✅ Success: Random user was ignored.")
+
     @patch('random.sample')
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_assign_reviewers_on_pr_open(self, mock_post, mock_random):
         print("\n--- Testing reviewer assignment on PR open ---")
 
@@ -491,12 +760,12 @@ class TestOwnersBot(unittest.TestCase):
         mock_post.assert_called_with(
             "https://api.github.com/repos/test/repo/pulls/42/requested_reviewers",
             json={"reviewers": ["reviewer", "approver"]},
-            headers={'Authorization': 'Bearer dummy-token', 'Accept': 'application/vnd.github.v3+json'}
+            timeout=10.0
         )
         print("✅ Success: Reviewers assigned on PR open.")
 
     @patch('random.sample')
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_assign_custom_number_of_reviewers(self, mock_post, mock_random):
         print("\n--- Testing custom number of reviewers ---")
 
@@ -533,7 +802,66 @@ class TestOwnersBot(unittest.TestCase):
 
         print("✅ Success: Custom number of reviewers assigned.")
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
+    def test_assign_least_loaded_reviewers(self, mock_post):
+        print("\n--- Testing load-aware reviewer assignment ---")
+
+        os.environ["REVIEWER_SELECTION"] = "load"
+        entrypoint._review_loads = None
+        owners_data = {
+            "approvers": ["approver", "approver2"],
+            "reviewers": ["reviewer", "reviewer2", "reviewer3"]
+        }
+        with open("OWNERS", "w") as f:
+            yaml.dump(owners_data, f)
+        loads = {"reviewer": 5, "reviewer2": 0, "reviewer3": 1, "approver": 3, "approver2": 2}
+
+        def post(url, json=None, **kwargs):
+            response = MagicMock()
+            if url.endswith("/graphql"):
+                candidates = ["reviewer", "reviewer2", "reviewer3", "approver", "approver2"]
+                response.status_code = 200
+                response.json.return_value = {"data": {
+                    f"u{i}": {"issueCount": loads[login]} for i, login in enumerate(candidates)}}
+            else:
+                response.status_code = 201
+            return response
+        mock_post.side_effect = post
+
+        createPROpenedEvent("pr-author")
+        # With equal draws the weighting alone decides: least loaded first.
+        with patch.object(entrypoint.random, "random", return_value=0.5):
+            entrypoint.main()
+
+        graphql_calls = [call for call in mock_post.call_args_list if call.args[0].endswith("/graphql")]
+        self.assertEqual(len(graphql_calls), 1)
+        mock_post.assert_called_with(
+            "https://api.github.com/repos/test/repo/pulls/42/requested_reviewers",
+            json={"reviewers": ["reviewer2", "reviewer3", "approver2"]},
+            timeout=10.0
+        )
+
+        # Clean up
+        del os.environ["REVIEWER_SELECTION"]
+        entrypoint._review_loads = None
+
+        print("✅ Success: Least-loaded reviewers assigned.")
+
+    def test_load_weighted_pick_is_random(self):
+        print("\n--- Testing load-aware selection is a weighted random pick ---")
+
+        loads = {"idle": 0, "busy": 3}
+        # A high draw lets the busier candidate win despite its lower weight.
+        with patch.object(entrypoint.random, "random", side_effect=[0.1, 0.9]):
+            self.assertEqual(entrypoint.pick_least_loaded(["idle", "busy"], 1, loads), ["busy"])
+        with patch.object(entrypoint.random, "random", side_effect=[0.9, 0.9]):
+            self.assertEqual(entrypoint.pick_least_loaded(["idle", "busy"], 1, loads), ["idle"])
+        with patch.object(entrypoint.random, "random", side_effect=[0.9, 0.1, 0.5]):
+            self.assertEqual(entrypoint.pick_least_loaded(["new", "busy", "idle"], 3, loads),
+                             ["idle", "busy", "new"])
+        print("✅ Success: Draws weighted by inverse load, unknown loads last.")
+
+    @patch('requests.Session.post')
     def test_pr_author_not_assigned_as_reviewer(self, mock_post):
         print("\n--- Testing PR author is not assigned as reviewer ---")
 
@@ -560,5 +888,1698 @@ class TestOwnersBot(unittest.TestCase):
 
         print("✅ Success: PR author not assigned as reviewer.")
 
+    def test_client_shared_across_calls(self):
+        print("\n--- Testing GitHub client is shared and pooled ---")
+
+        os.environ["HTTP_POOL_SIZE"] = "4"
+        os.environ["HTTP_TIMEOUT"] = "3"
+        entrypoint._client = None
+
+        client = entrypoint.get_client("dummy-token")
+        self.assertIs(entrypoint.get_client("dummy-token"), client)
+        self.assertEqual(client.timeout, 3.0)
+        self.assertEqual(client.session.get_adapter("https://api.github.com")._pool_maxsize, 4)
+        self.assertEqual(client.session.headers["Authorization"], "Bearer dummy-token")
+        self.assertEqual(client.session.headers["Accept"], "application/vnd.github.v3+json")
+
+        # Clean up
+        del os.environ["HTTP_POOL_SIZE"]
+        del os.environ["HTTP_TIMEOUT"]
+        entrypoint._client = None
+
+        print("✅ Success: Client is shared and configurable.")
+
+class TestCommandParser(unittest.TestCase):
+    def test_commands_at_line_start_in_order(self):
+        print("\n--- Testing commands parsed line by line ---")
+
+        commands = entrypoint.parse_commands("Nice work!\n/LGTM\n  /approve cancel\n/unknown\n/hold")
+
+        self.assertEqual(commands, [("lgtm", []), ("approve", ["cancel"]), ("hold", [])])
+        print("✅ Success: Commands parsed.")
+
+    def test_cancel_on_other_line_ignored(self):
+        print("\n--- Testing 'cancel' elsewhere does not cancel ---")
+
+        commands = entrypoint.parse_commands("/lgtm\nI had to cancel my /approve cancel plans")
+
+        self.assertEqual(commands, [("lgtm", [])])
+        print("✅ Success: Stray cancel ignored.")
+
+    def test_quotes_and_code_blocks_skipped(self):
+        print("\n--- Testing quoted and fenced commands are ignored ---")
+
+        body = "> /lgtm\n```\n/approve\n/hold\n```\n/hold cancel"
+        commands = entrypoint.parse_commands(body)
+
+        self.assertEqual(commands, [("hold", ["cancel"])])
+        print("✅ Success: Quoted and fenced commands skipped.")
+
+    def test_scan_limit(self):
+        print("\n--- Testing only the start of huge comments is scanned ---")
+
+        body = "log line\n" * 10000 + "/lgtm"
+        self.assertEqual(entrypoint.parse_commands(body, limit=1024), [])
+        self.assertEqual(entrypoint.parse_commands(body, limit=len(body)), [("lgtm", [])])
+        print("✅ Success: Scan capped.")
+
+class TestGraphQLBackend(unittest.TestCase):
+    def setUp(self):
+        isolate_caches(self)
+        with open("OWNERS", "w") as f:
+            yaml.dump({"approvers": ["approver"], "reviewers": ["approver", "reviewer"]}, f)
+
+        os.environ["GITHUB_TOKEN"] = "dummy-token"
+        os.environ["OWNERS_FILE"] = "OWNERS"
+        os.environ["GITHUB_EVENT_PATH"] = "event.json"
+        os.environ["GITHUB_WORKSPACE"] = os.getcwd()
+        os.environ["GITHUB_BACKEND"] = "graphql"
+        entrypoint._merge_controller = None
+
+        stub_network(self)
+
+    def tearDown(self):
+        del os.environ["GITHUB_BACKEND"]
+        if os.path.exists("OWNERS"): os.remove("OWNERS")
+        if os.path.exists("event.json"): os.remove("event.json")
+
+    def graphql_post(self, labels, checks="SUCCESS", mergeable="MERGEABLE", merged=True):
+        """Answer the state query and echo every mutation field back as successful.
+
+        `mergeable` may be a list, answered in turn by successive state queries.
+        """
+        self.documents = []
+        answers = list(mergeable) if isinstance(mergeable, list) else None
+        labels = list(labels)
+
+        def post(url, json=None, **kwargs):
+            self.documents.append(json)
+            response = MagicMock()
+            response.status_code = 200
+            if json["query"].lstrip().startswith("query"):
+                status = "COMPLETED" if checks == "SUCCESS" else "IN_PROGRESS"
+                response.json.return_value = {"data": {"repository": {
+                    "lgtm": {"id": "L_lgtm"},
+                    "approved": {"id": "L_approved"},
+                    "hold": {"id": "L_hold"},
+                    "pullRequest": {
+                        "id": "PR_42",
+                        "merged": False,
+                        "mergeable": answers.pop(0) if answers else mergeable,
+                        "headRefOid": "abc123",
+                        "baseRefName": "main",
+                        "author": {"login": "pr-author"},
+                        "labels": {"nodes": [{"id": f"L_{name}", "name": name} for name in labels]},
+                        "commits": {"nodes": [{"commit": {"statusCheckRollup": {"contexts": {"nodes": [
+                            {"status": status, "conclusion": "SUCCESS" if checks == "SUCCESS" else None, "isRequired": True}
+                        ]}}}}]},
+                    },
+                }}}
+            else:
+                data = {}
+                for field in ("remove", "add"):
+                    if f"{field}: " in json["query"]:
+                        data[field] = {"clientMutationId": None}
+                        changed = [label_id[len("L_"):] for label_id in json["variables"][field]]
+                        labels[:] = [label for label in labels if label not in changed]
+                        if field == "add":
+                            labels.extend(changed)
+                if "merge: " in json["query"]:
+                    data["merge"] = {"pullRequest": {"merged": merged}}
+                response.json.return_value = {"data": data}
+            return response
+        return post
+
+    @patch('requests.Session.put')
+    @patch('requests.Session.get')
+    @patch('requests.Session.post')
+    def test_approve_and_merge_in_two_calls(self, mock_post, mock_get, mock_put):
+        print("\n--- Testing GraphQL approve + merge uses two requests ---")
+
+        mock_post.side_effect = self.graphql_post(["lgtm"])
+        createGitHubEvent("approver", "/approve")
+        entrypoint.main()
+
+        self.assertEqual(mock_post.call_count, 2)
+        mutation = self.documents[1]
+        self.assertIn("addLabelsToLabelable", mutation["query"])
+        self.assertIn("mergePullRequest", mutation["query"])
+        self.assertEqual(mutation["variables"]["add"], ["L_approved"])
+        self.assertEqual(mutation["variables"]["head"], "abc123")
+        mock_get.assert_not_called()
+        mock_put.assert_not_called()
+        print("✅ Success: Labels and merge batched.")
+
+    @patch('requests.Session.put')
+    @patch('requests.Session.post')
+    def test_pending_checks_block_merge(self, mock_post, mock_put):
+        print("\n--- Testing GraphQL skips merge while required checks run ---")
+
+        mock_post.side_effect = self.graphql_post(["lgtm"], checks="PENDING")
+        createGitHubEvent("approver", "/approve")
+        entrypoint.main()
+
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertNotIn("mergePullRequest", self.documents[1]["query"])
+        mock_put.assert_not_called()
+        print("✅ Success: Merge deferred until checks pass.")
+
+    @patch('requests.Session.post')
+    def test_noop_command_skips_mutation(self, mock_post):
+        print("\n--- Testing GraphQL skips mutations for labels already present ---")
+
+        mock_post.side_effect = self.graphql_post(["lgtm"], mergeable="CONFLICTING")
+        createGitHubEvent("reviewer", "/lgtm")
+        entrypoint.main()
+
+        self.assertEqual(mock_post.call_count, 1)
+        print("✅ Success: No mutation sent.")
+
+    @patch('requests.Session.post')
+    def test_unknown_mergeability_waits_instead_of_merging(self, mock_post):
+        print("\n--- Testing GraphQL waits while GitHub computes mergeability ---")
+
+        mock_post.side_effect = self.graphql_post(["lgtm"], mergeable="UNKNOWN")
+        createGitHubEvent("approver", "/approve")
+        entrypoint.main()
+
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertNotIn("mergePullRequest", self.documents[1]["query"])
+        self.assertIn(("test/repo", 42), entrypoint._merge_controller.waiting)
+        print("✅ Success: PR left waiting for its mergeability.")
+
+    @patch('requests.Session.post')
+    def test_failed_batched_merge_is_checked_again(self, mock_post):
+        print("\n--- Testing a failed GraphQL merge is handed to the merge controller ---")
+
+        mock_post.side_effect = self.graphql_post(["lgtm"], mergeable=["MERGEABLE", "UNKNOWN"], merged=False)
+        createGitHubEvent("approver", "/approve")
+        entrypoint.main()
+
+        self.assertEqual(mock_post.call_count, 3)
+        self.assertIn("mergePullRequest", self.documents[1]["query"])
+        self.assertTrue(self.documents[2]["query"].lstrip().startswith("query"))
+        self.assertIn(("test/repo", 42), entrypoint._merge_controller.waiting)
+        print("✅ Success: Failed merge re-read and left waiting.")
+
+    @patch('requests.Session.delete')
+    @patch('requests.Session.post')
+    def test_removes_labels_outside_the_bot_set(self, mock_post, mock_delete):
+        print("\n--- Testing GraphQL removes a label the bot does not manage ---")
+
+        mock_post.side_effect = self.graphql_post(["lgtm", "foo"])
+        createGitHubEvent("reviewer", "/label cancel foo")
+        entrypoint.main()
+
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(self.documents[1]["variables"]["remove"], ["L_foo"])
+        mock_delete.assert_not_called()
+        print("✅ Success: Label removed by the id read with the PR.")
+
+class TestMergeQueue(unittest.TestCase):
+    def setUp(self):
+        isolate_caches(self)
+        os.environ["GITHUB_TOKEN"] = "dummy-token"
+        self.queue = entrypoint.MergeQueue("dummy-token", batch_size=2, priority_labels=["priority/critical"])
+        self.now = 1000.0
+        self.queue.clock = lambda: self.now
+        entrypoint.set_merge_queue(self.queue)
+
+        stub_network(self)
+
+    def tearDown(self):
+        entrypoint.set_merge_queue(None)
+
+    def ready_get(self, url, **kwargs):
+        response = MagicMock()
+        response.status_code = 200
+        response.json.return_value = {"labels": [{"name": "lgtm"}, {"name": "approved"}], "base": {"ref": "main"},
+                                      "mergeable": True, "mergeable_state": "clean"}
+        return response
+
+    def merge_response(self):
+        response = MagicMock()
+        response.status_code = 200
+        return response
+
+    def queue_pr(self, number, labels=("lgtm", "approved")):
+        event = {"issue": {"number": number}, "repository": {"full_name": "test/repo"}}
+        state = entrypoint.PullRequestState(list(labels), base_ref="main")
+        entrypoint.check_and_merge(event, "dummy-token", state)
+
+    @patch('requests.Session.put')
+    @patch('requests.Session.get')
+    def test_ready_prs_queued_and_merged_in_priority_batches(self, mock_get, mock_put):
+        print("\n--- Testing merge queue merges batches in priority order ---")
+
+        mock_get.side_effect = self.ready_get
+        mock_put.return_value = self.merge_response()
+
+        self.queue_pr(1)
+        self.queue_pr(2)
+        self.queue_pr(3, labels=("lgtm", "approved", "priority/critical"))
+        self.queue_pr(1)
+        mock_put.assert_not_called()
+        self.assertEqual(self.queue.metrics()["depth"], {"test/repo:main": 3})
+
+        self.now += 30
+        self.assertEqual(self.queue.drain_once(), 2)
+
+        merged = [call.args[0].rsplit("/", 2)[-2] for call in mock_put.call_args_list]
+        self.assertEqual(merged, ["3", "1"])
+        metrics = self.queue.metrics()
+        self.assertEqual(metrics["depth"], {"test/repo:main": 1})
+        self.assertEqual(metrics["merged"], 2)
+        self.assertEqual(metrics["time_to_merge_max"], 30.0)
+        print("✅ Success: Queue honoured priority and batch size.")
+
+    @patch('requests.Session.put')
+    @patch('requests.Session.get')
+    def test_hold_after_queueing_drops_pr(self, mock_get, mock_put):
+        print("\n--- Testing a PR put on hold while queued is not merged ---")
+
+        held = MagicMock()
+        held.status_code = 200
+        held.json.return_value = {"labels": [{"name": "lgtm"}, {"name": "approved"}, {"name": "hold"}]}
+        mock_get.return_value = held
+
+        self.queue_pr(1)
+        self.queue.drain_once()
+
+        mock_put.assert_not_called()
+        self.assertEqual(self.queue.metrics()["dropped"], 1)
+        print("✅ Success: Held PR dropped from the queue.")
+
+class TestMergeController(unittest.TestCase):
+    MERGE = "PUT /repos/{repo}/pulls/{n}/merge"
+
+    def setUp(self):
+        isolate_caches(self)
+        self.github = bench.FakeGitHub().start()
+        self.environ = patch.dict(os.environ, {"GITHUB_TOKEN": "dummy-token", "GITHUB_API_URL": self.github.url})
+        self.environ.start()
+        entrypoint._client = None
+        entrypoint._merge_controller = None
+        self.controller = entrypoint.get_merge_controller("dummy-token")
+        self.now = 1000.0
+        self.controller.clock = lambda: self.now
+
+    def tearDown(self):
+        entrypoint._client = None
+        entrypoint._merge_controller = None
+        self.environ.stop()
+        self.github.stop()
+
+    def ready_pr(self, number, checks=("ci",), **kwargs):
+        self.github.add_pull("test/repo", number, labels=("lgtm", "approved"), checks=checks, **kwargs)
+
+    def check_and_merge(self, number):
+        entrypoint.check_and_merge({"issue": {"number": number}, "repository": {"full_name": "test/repo"}},
+                                   "dummy-token")
+
+    def test_waits_for_checks_and_merges_on_check_suite(self):
+        print("\n--- Testing a PR with running checks merges when its check suite completes ---")
+
+        self.ready_pr(1)
+        self.check_and_merge(1)
+        self.assertEqual(self.github.calls[self.MERGE], 0)
+        self.assertEqual(self.controller.metrics()["waiting"], 1)
+
+        self.github.complete_check("test/repo", 1, "ci")
+        sha = self.github.pull("test/repo", 1)["head"]["sha"]
+        handled = entrypoint.dispatch_event(
+            {"action": "completed", "check_suite": {"head_sha": sha, "pull_requests": [{"number": 1}]},
+             "repository": {"full_name": "test/repo"}}, "dummy-token", None)
+
+        self.assertTrue(handled)
+        self.assertTrue(self.github.pull("test/repo", 1)["merged"])
+        self.assertEqual(self.github.calls[self.MERGE], 1)
+        self.assertEqual(self.controller.metrics()["waiting"], 0)
+        print("✅ Success: No merge call while blocked, one once the checks passed.")
+
+    def test_status_event_finds_prs_by_head_sha(self):
+        print("\n--- Testing a status event retries the PRs of its commit ---")
+
+        self.ready_pr(2, checks=())
+        self.ready_pr(3, checks=())
+        sha = self.github.pull("test/repo", 3)["head"]["sha"]
+        entrypoint.dispatch_event({"sha": sha, "state": "success", "context": "ci/jenkins",
+                                   "repository": {"full_name": "test/repo"}}, "dummy-token", None)
+
+        self.assertTrue(self.github.pull("test/repo", 3)["merged"])
+        self.assertFalse(self.github.pull("test/repo", 2)["merged"])
+        print("✅ Success: PR found by SHA and merged.")
+
+    def test_poller_backs_off_then_merges_once(self):
+        print("\n--- Testing waiting PRs are polled with backoff and merged once ---")
+
+        self.ready_pr(4)
+        self.check_and_merge(4)
+        self.assertEqual(self.controller.poll_once(), 0)
+
+        self.now += 15
+        self.assertEqual(self.controller.poll_once(), 1)
+        self.assertEqual(self.controller.waiting[("test/repo", 4)]["delay"], 30)
+
+        self.github.complete_check("test/repo", 4, "ci")
+        self.now += 30
+        self.controller.poll_once()
+        self.now += 300
+        self.controller.poll_once()
+        self.check_and_merge(4)
+
+        self.assertTrue(self.github.pull("test/repo", 4)["merged"])
+        self.assertEqual(self.github.calls[self.MERGE], 1)
+        self.assertEqual(self.controller.metrics()["merged"], 1)
+        print("✅ Success: Backoff doubled and the merge was sent exactly once.")
+
+    def test_conflicts_and_failed_checks_are_not_retried(self):
+        print("\n--- Testing blocked PRs are neither merged nor kept waiting ---")
+
+        self.ready_pr(5, checks=(), mergeable=False)
+        self.ready_pr(6)
+        self.github.complete_check("test/repo", 6, "ci", conclusion="failure")
+        self.check_and_merge(5)
+        self.check_and_merge(6)
+
+        self.assertEqual(self.github.calls[self.MERGE], 0)
+        self.assertEqual(self.controller.metrics()["blocked"], 2)
+        self.assertEqual(self.controller.metrics()["waiting"], 0)
+        print("✅ Success: No merge call and nothing left waiting.")
+
+    def test_checks_event_first_keeps_the_token_for_retries(self):
+        print("\n--- Testing retries started by a checks event use the event's token ---")
+
+        entrypoint._merge_controller = None
+        self.ready_pr(8)
+        sha = self.github.pull("test/repo", 8)["head"]["sha"]
+        entrypoint.dispatch_event(
+            {"action": "completed", "workflow_run": {"head_sha": sha, "pull_requests": []},
+             "repository": {"full_name": "test/repo"}}, "dummy-token", None)
+        controller = entrypoint._merge_controller
+        controller.clock = lambda: self.now
+        self.assertEqual(controller.metrics()["waiting"], 1)
+
+        self.now += 15
+        controller.poll_once()
+
+        self.assertEqual(controller.token, "dummy-token")
+        self.assertEqual(entrypoint._client.token, "dummy-token")
+        print("✅ Success: Retry ran with the token.")
+
+    def test_gives_up_after_timeout(self):
+        print("\n--- Testing waiting for checks is bounded ---")
+
+        self.ready_pr(7)
+        self.check_and_merge(7)
+        self.now += self.controller.timeout
+
+        self.assertEqual(self.controller.poll_once(), 0)
+        self.assertEqual(self.controller.metrics()["expired"], 1)
+        self.assertEqual(self.controller.metrics()["waiting"], 0)
+        print("✅ Success: PR dropped after the timeout.")
+
+class TestDryRun(unittest.TestCase):
+    def setUp(self):
+        isolate_caches(self)
+        self.workspace = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.workspace.name, "OWNERS"), "w") as f:
+            yaml.dump({"approvers": ["approver"], "reviewers": ["approver", "reviewer"]}, f)
+        self.output = os.path.join(self.workspace.name, "plans.jsonl")
+        self.environ = patch.dict(os.environ, {"GITHUB_WORKSPACE": self.workspace.name, "OWNERS_FILE": "OWNERS",
+                                               "DRY_RUN_OUTPUT": self.output})
+        self.environ.start()
+        os.environ.pop("GITHUB_TOKEN", None)
+        entrypoint._client = None
+        self.request_patcher = patch('requests.Session.request')
+        self.mock_request = self.request_patcher.start()
+
+    def tearDown(self):
+        self.request_patcher.stop()
+        self.environ.stop()
+        entrypoint._label_snapshots = None
+
+    def plans(self):
+        with open(self.output) as f:
+            return [json.loads(line) for line in f]
+
+    def test_plan_mode_reports_operations_without_requests(self):
+        print("\n--- Testing recorded events are planned offline ---")
+
+        events_path = os.path.join(self.workspace.name, "events.jsonl")
+        with open(events_path, "w") as f:
+            for event in [
+                {"comment": {"body": "/lgtm\n/cc @approver", "user": {"login": "reviewer"}},
+                 "issue": {"number": 42}, "repository": {"full_name": "test/repo"}},
+                {"action": "labeled", "label": {"name": "approved"}, "sender": {"login": "outsider"},
+                 "pull_request": {"number": 42}, "repository": {"full_name": "test/repo"}},
+                {"action": "closed", "pull_request": {"number": 42}, "repository": {"full_name": "test/repo"}},
+            ]:
+                f.write(json.dumps(event) + "\n")
+
+        executor = entrypoint.run_plan([events_path])
+
+        self.mock_request.assert_not_called()
+        self.assertEqual([plan["operations"] for plan in self.plans()], [
+            [{"op": "add_labels", "labels": ["lgtm"]},
+             {"op": "request_reviewers", "reviewers": ["approver"]},
+             {"op": "merge", "strategy": "merge"}],
+            [{"op": "remove_label", "label": "approved"}],
+        ])
+        self.assertEqual(executor.summary()["comment"]["operations_per_plan"], 3.0)
+        self.assertIsNone(entrypoint._executor)
+        print("✅ Success: Plans written and nothing sent.")
+
+    @patch('requests.Session.put')
+    @patch('requests.Session.post')
+    def test_dry_run_action_does_not_act(self, mock_post, mock_put):
+        print("\n--- Testing DRY_RUN makes the Action report instead of act ---")
+
+        event_path = os.path.join(self.workspace.name, "event.json")
+        with open(event_path, "w") as f:
+            json.dump({"comment": {"body": "/approve", "user": {"login": "approver"}},
+                       "issue": {"number": 7}, "repository": {"full_name": "test/repo"}}, f)
+        with patch.dict(os.environ, {"DRY_RUN": "true", "GITHUB_EVENT_PATH": event_path,
+                                     "AUTO_MERGE": "false", "GITHUB_TOKEN": "dummy-token"}):
+            entrypoint.main()
+
+        mock_post.assert_not_called()
+        mock_put.assert_not_called()
+        self.assertEqual(self.plans(), [{"event": "comment", "repository": "test/repo", "pull_request": 7,
+                                         "operations": [{"op": "add_labels", "labels": ["approved"]}]}])
+        print("✅ Success: Plan reported, no labels or merge sent.")
+
+    def test_sweep_refuses_dry_run(self):
+        print("\n--- Testing modes without plans refuse DRY_RUN ---")
+
+        with patch.dict(os.environ, {"DRY_RUN": "true", "GITHUB_REPOSITORY": "test/repo"}):
+            with self.assertRaises(SystemExit):
+                entrypoint.run_sweep()
+        self.mock_request.assert_not_called()
+        print("✅ Success: Sweep exited before any request.")
+
+class TestOwnersCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        os.environ["OWNERS_CACHE_DIR"] = self.cache_dir.name
+        entrypoint._owners_cache.clear()
+        with open("OWNERS", "w") as f:
+            yaml.dump({"approvers": ["approver"], "reviewers": ["approver", "reviewer"]}, f)
+
+    def tearDown(self):
+        del os.environ["OWNERS_CACHE_DIR"]
+        entrypoint._owners_cache.clear()
+        self.cache_dir.cleanup()
+        if os.path.exists("OWNERS"): os.remove("OWNERS")
+
+    def test_compiled_owners_membership(self):
+        print("\n--- Testing compiled OWNERS membership ---")
+
+        owners = entrypoint.load_owners("OWNERS")
+        index = entrypoint.AuthIndex.build({"": owners}, {})
+
+        self.assertTrue(index.allows("reviewer", "reviewers", [0]))
+        self.assertTrue(index.allows("approver", "approvers", [0]))
+        self.assertFalse(index.allows("reviewer", "approvers", [0]))
+        self.assertEqual(owners.reviewers, ("approver", "reviewer"))
+        print("✅ Success: OWNERS compiled.")
+
+    def test_disk_cache_skips_yaml(self):
+        print("\n--- Testing OWNERS disk cache skips YAML parsing ---")
+
+        first = entrypoint.load_owners("OWNERS")
+        entrypoint._owners_cache.clear()
+
+        with patch('yaml.safe_load') as mock_load:
+            second = entrypoint.load_owners("OWNERS")
+            mock_load.assert_not_called()
+
+        self.assertEqual(second.to_dict(), first.to_dict())
+        print("✅ Success: Cached OWNERS reused.")
+
+    def test_changed_content_reparsed(self):
+        print("\n--- Testing changed OWNERS content is reparsed ---")
+
+        entrypoint.load_owners("OWNERS")
+        with open("OWNERS", "w") as f:
+            yaml.dump({"approvers": ["someone-else"]}, f)
+
+        owners = entrypoint.load_owners("OWNERS")
+
+        self.assertEqual(owners.approvers, ("someone-else",))
+        print("✅ Success: New content picked up.")
+
+class TestAliasesAndTeams(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        os.environ["OWNERS_CACHE_DIR"] = self.cache_dir.name
+        os.environ["GITHUB_TOKEN"] = "dummy-token"
+        os.environ["OWNERS_FILE"] = "OWNERS"
+        os.environ["GITHUB_EVENT_PATH"] = "event.json"
+        os.environ["GITHUB_WORKSPACE"] = os.getcwd()
+        entrypoint._team_cache = None
+        with open("OWNERS", "w") as f:
+            yaml.dump({"approvers": ["sig-leads"], "reviewers": ["reviewer", "@org/reviewers"]}, f)
+        with open("OWNERS_ALIASES", "w") as f:
+            yaml.dump({"aliases": {"sig-leads": ["alice", "@org/leads"]}}, f)
+
+        stub_network(self)
+
+    def tearDown(self):
+        del os.environ["OWNERS_CACHE_DIR"]
+        entrypoint._team_cache = None
+        self.cache_dir.cleanup()
+        for path in ("OWNERS", "OWNERS_ALIASES", "event.json"):
+            if os.path.exists(path): os.remove(path)
+
+    def team_get(self, url, **kwargs):
+        response = MagicMock()
+        response.status_code = 200
+        response.links = {}
+        if "/teams/" in url:
+            team = url.split("/teams/")[1].split("/")[0]
+            response.json.return_value = [{"login": f"{team}-member"}]
+        else:
+            response.json.return_value = {"labels": []}
+        return response
+
+    @patch('requests.Session.post')
+    @patch('requests.Session.get')
+    def test_alias_member_can_approve_without_team_lookup(self, mock_get, mock_post):
+        print("\n--- Testing alias member approves, team stays unexpanded ---")
+
+        mock_get.side_effect = self.team_get
+        createGitHubEvent("alice", "/approve")
+        entrypoint.main()
+
+        mock_post.assert_called_with(
+            "https://api.github.com/repos/test/repo/issues/42/labels",
+            json={"labels": ["approved"]},
+            timeout=10.0
+        )
+        self.assertFalse(any("/teams/" in call.args[0] for call in mock_get.call_args_list))
+        print("✅ Success: Alias expanded lazily.")
+
+    @patch('requests.Session.post')
+    @patch('requests.Session.get')
+    def test_team_member_expansion_is_cached(self, mock_get, mock_post):
+        print("\n--- Testing team expansion is cached between events ---")
+
+        mock_get.side_effect = self.team_get
+        createGitHubEvent("leads-member", "/approve")
+        entrypoint.main()
+        entrypoint.main()
+
+        team_calls = [call.args[0] for call in mock_get.call_args_list if "/teams/" in call.args[0]]
+        self.assertEqual(team_calls, ["https://api.github.com/orgs/org/teams/leads/members?per_page=100"])
+        self.assertEqual(mock_post.call_count, 2)
+
+        # A fresh process reads the persisted cache instead of the API
+        entrypoint._team_cache = None
+        self.assertEqual(entrypoint.get_team_cache().get("org/leads"), ["leads-member"])
+        print("✅ Success: Team members cached and persisted.")
+
+    @patch('requests.Session.post')
+    @patch('requests.Session.get')
+    def test_literal_reviewer_skips_expansion(self, mock_get, mock_post):
+        print("\n--- Testing literal reviewers never trigger team lookups ---")
+
+        mock_get.side_effect = self.team_get
+        createGitHubEvent("reviewer", "/lgtm")
+        entrypoint.main()
+
+        self.assertFalse(any("/teams/" in call.args[0] for call in mock_get.call_args_list))
+        mock_post.assert_called_once()
+        print("✅ Success: No expansion needed.")
+
+    def test_ttl_cache_expiry_and_lru(self):
+        print("\n--- Testing TTL cache expiry and LRU eviction ---")
+
+        cache = entrypoint.TTLCache(maxsize=2, ttl=10)
+        now = [0.0]
+        cache.clock = lambda: now[0]
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        now[0] = 11.0
+        self.assertIsNone(cache.get("a"))
+        print("✅ Success: Entries expire and least recently used is evicted.")
+
+class TestHierarchicalOwners(unittest.TestCase):
+    def setUp(self):
+        isolate_caches(self)
+        self.workspace = tempfile.TemporaryDirectory()
+        root = self.workspace.name
+        os.makedirs(os.path.join(root, "sub", "deep"))
+        with open(os.path.join(root, "OWNERS"), "w") as f:
+            yaml.dump({"approvers": ["root-approver"], "reviewers": ["root-reviewer"]}, f)
+        with open(os.path.join(root, "sub", "OWNERS"), "w") as f:
+            yaml.dump({"approvers": ["sub-approver"], "reviewers": ["sub-reviewer"]}, f)
+
+        os.environ["GITHUB_TOKEN"] = "dummy-token"
+        os.environ["OWNERS_FILE"] = "OWNERS"
+        os.environ["GITHUB_EVENT_PATH"] = "event.json"
+        os.environ["GITHUB_WORKSPACE"] = root
+        os.environ["OWNERS_HIERARCHY"] = "true"
+        entrypoint._owners_trees.clear()
+
+        stub_network(self)
+
+    def tearDown(self):
+        del os.environ["OWNERS_HIERARCHY"]
+        os.environ["GITHUB_WORKSPACE"] = os.getcwd()
+        entrypoint._owners_trees.clear()
+        self.workspace.cleanup()
+        if os.path.exists("event.json"): os.remove("event.json")
+
+    def files_response(self, paths):
+        """Serve the PR file list for /files and an unlabeled PR otherwise."""
+        def get(url, **kwargs):
+            response = MagicMock()
+            response.status_code = 200
+            response.links = {}
+            if "/files" in url:
+                response.json.return_value = [{"filename": p} for p in paths]
+            else:
+                response.json.return_value = {"labels": []}
+            return response
+        return get
+
+    def test_trie_resolves_closest_owners(self):
+        print("\n--- Testing OWNERS trie resolves closest ancestor ---")
+
+        tree = entrypoint.get_owners_tree(self.workspace.name, "OWNERS")
+
+        deep = tree.lookup("sub/deep/file.py")
+        self.assertEqual(deep.closest.approvers, ("sub-approver",))
+        self.assertEqual(deep.scope, "sub")
+        self.assertIn("root-approver", tree.scope_owners[deep.scope].approvers)
+        self.assertEqual(tree.lookup("README.md").closest.approvers, ("root-approver",))
+        self.assertEqual(len(tree.scopes(["sub/a.py", "sub/deep/b.py", "c.py"])), 2)
+        self.assertIs(entrypoint.get_owners_tree(self.workspace.name, "OWNERS"), tree)
+        print("✅ Success: Trie lookup works.")
+
+    def test_trie_rebuilt_when_checkout_moves(self):
+        print("\n--- Testing the OWNERS trie follows the checkout's HEAD ---")
+
+        root = self.workspace.name
+        os.makedirs(os.path.join(root, ".git", "refs", "heads"))
+        with open(os.path.join(root, ".git", "HEAD"), "w") as f:
+            f.write("ref: refs/heads/main\n")
+        with open(os.path.join(root, ".git", "refs", "heads", "main"), "w") as f:
+            f.write("1" * 40 + "\n")
+        tree = entrypoint.get_owners_tree(root, "OWNERS")
+
+        with open(os.path.join(root, "sub", "OWNERS"), "w") as f:
+            yaml.dump({"approvers": ["new-approver"]}, f)
+        self.assertIs(entrypoint.get_owners_tree(root, "OWNERS"), tree)
+
+        with open(os.path.join(root, ".git", "refs", "heads", "main"), "w") as f:
+            f.write("2" * 40 + "\n")
+        rebuilt = entrypoint.get_owners_tree(root, "OWNERS")
+
+        self.assertEqual(rebuilt.lookup("sub/a.py").closest.approvers, ("new-approver",))
+        self.assertIs(entrypoint.get_owners_tree(root, "OWNERS"), rebuilt)
+        print("✅ Success: New commit picked up without a restart.")
+
+    def test_trie_rebuilt_when_owners_file_changes(self):
+        print("\n--- Testing the OWNERS trie of a plain directory follows its files ---")
+
+        root = self.workspace.name
+        entrypoint.get_owners_tree(root, "OWNERS")
+        with open(os.path.join(root, "sub", "deep", "OWNERS"), "w") as f:
+            yaml.dump({"approvers": ["deep-approver"]}, f)
+
+        tree = entrypoint.get_owners_tree(root, "OWNERS")
+
+        self.assertEqual(tree.lookup("sub/deep/a.py").closest.approvers, ("deep-approver",))
+        print("✅ Success: Added OWNERS file picked up.")
+
+    @patch('requests.Session.post')
+    @patch('requests.Session.get')
+    def test_sub_approver_can_approve_own_scope(self, mock_get, mock_post):
+        print("\n--- Testing nested approver approves PR in their directory ---")
+
+        mock_get.side_effect = self.files_response(["sub/deep/file.py"])
+        createGitHubEvent("sub-approver", "/approve")
+        entrypoint.main()
+
+        mock_post.assert_called_with(
+            "https://api.github.com/repos/test/repo/issues/42/labels",
+            json={"labels": ["approved"]},
+            timeout=10.0
+        )
+        print("✅ Success: Nested approver approved.")
+
+    @patch('requests.Session.post')
+    @patch('requests.Session.get')
+    def test_sub_approver_cannot_approve_outside_scope(self, mock_get, mock_post):
+        print("\n--- Testing nested approver cannot approve root changes ---")
+
+        mock_get.side_effect = self.files_response(["sub/file.py", "README.md"])
+        createGitHubEvent("sub-approver", "/approve")
+        entrypoint.main()
+
+        mock_post.assert_not_called()
+        print("✅ Success: Out-of-scope approval ignored.")
+
+    @patch('entrypoint.MAX_PR_FILES', 1)
+    @patch('requests.Session.post')
+    @patch('requests.Session.get')
+    def test_truncated_file_list_requires_root_approver(self, mock_get, mock_post):
+        print("\n--- Testing truncated file list requires root approval ---")
+
+        mock_get.side_effect = self.files_response(["sub/file.py"])
+        createGitHubEvent("sub-approver", "/approve")
+        entrypoint.main()
+
+        mock_post.assert_not_called()
+        print("✅ Success: Truncated listing treated as touching root.")
+
+    @patch('requests.Session.post')
+    @patch('requests.Session.get')
+    def test_assign_from_closest_owners(self, mock_get, mock_post):
+        print("\n--- Testing reviewers assigned from closest OWNERS ---")
+
+        mock_get.side_effect = self.files_response(["sub/deep/file.py"])
+        createPROpenedEvent("pr-author")
+        entrypoint.main()
+
+        mock_post.assert_called_with(
+            "https://api.github.com/repos/test/repo/pulls/42/requested_reviewers",
+            json={"reviewers": ["sub-reviewer", "sub-approver"]},
+            timeout=10.0
+        )
+        print("✅ Success: Closest owners assigned.")
+
+class TestAuthIndex(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        os.environ["OWNERS_CACHE_DIR"] = self.cache_dir.name
+        entrypoint._auth_indexes.clear()
+        entrypoint._checkout_indexes.clear()
+        self.index = entrypoint.AuthIndex.build(
+            {"": entrypoint.Owners(approvers=["Root-Approver", "leads"], reviewers=["root-reviewer"]),
+             "sub": entrypoint.Owners(approvers=["Root-Approver", "leads", "sub-approver"],
+                                      reviewers=["root-reviewer", "sub-reviewer"])},
+            {"leads": ["alice", "@org/leads"]})
+
+    def tearDown(self):
+        del os.environ["OWNERS_CACHE_DIR"]
+        entrypoint._auth_indexes.clear()
+        entrypoint._checkout_indexes.clear()
+        self.cache_dir.cleanup()
+
+    def test_roles_per_scope(self):
+        print("\n--- Testing the index answers roles per scope ---")
+
+        root, sub = self.index.scope_ids[""], self.index.scope_ids["sub"]
+        self.assertEqual(self.index.logins["root-approver"], {root: 2, sub: 2})
+        self.assertEqual(self.index.logins["alice"], {root: 2, sub: 2})
+        self.assertEqual(self.index.logins["sub-approver"], {sub: 2})
+        self.assertTrue(self.index.allows("ROOT-APPROVER", "approvers", [root, sub]))
+        self.assertTrue(self.index.allows("sub-approver", "approvers", [sub]))
+        self.assertFalse(self.index.allows("sub-approver", "approvers", [root, sub]))
+        self.assertFalse(self.index.allows("sub-approver", "reviewers", [sub]))
+        self.assertTrue(self.index.allows("anybody", "anyone", [root]))
+        print("✅ Success: Roles resolved per scope, case-insensitively.")
+
+    def test_teams_only_expanded_on_miss(self):
+        print("\n--- Testing team members are only fetched for unknown logins ---")
+
+        resolver = MagicMock()
+        resolver.team_members.return_value = ["Lead"]
+        root = self.index.scope_ids[""]
+
+        self.assertTrue(self.index.allows("alice", "approvers", [root], resolver))
+        resolver.team_members.assert_not_called()
+        self.assertTrue(self.index.allows("lead", "approvers", [root], resolver))
+        self.assertFalse(self.index.allows("lead", "reviewers", [root], resolver))
+        resolver.team_members.assert_called_once_with("org", "leads")
+        print("✅ Success: Team looked up only for the miss.")
+
+    def test_index_serialized_next_to_owners_cache(self):
+        print("\n--- Testing the index is stored compactly and reused ---")
+
+        with tempfile.TemporaryDirectory() as workspace:
+            with open(os.path.join(workspace, "OWNERS"), "w") as f:
+                yaml.dump({"approvers": ["approver"], "reviewers": ["reviewer"]}, f)
+            index = entrypoint.get_auth_index(workspace, "OWNERS")
+            entrypoint._auth_indexes.clear()
+            entrypoint._checkout_indexes.clear()
+            with patch.object(entrypoint.AuthIndex, 'build') as build:
+                reloaded = entrypoint.get_auth_index(workspace, "OWNERS")
+
+        build.assert_not_called()
+        files = [name for name in os.listdir(os.path.join(self.cache_dir.name, "owners-cache")) if name.startswith("authz-")]
+        self.assertEqual(len(files), 1)
+        self.assertEqual(reloaded.logins, index.logins)
+        self.assertEqual(reloaded.to_dict()["logins"], {"approver": [0, 2], "reviewer": [0, 1]})
+        print("✅ Success: Index loaded from disk instead of rebuilt.")
+
+    def test_unchanged_checkout_reuses_index_without_hashing(self):
+        print("\n--- Testing an unchanged checkout reuses its index ---")
+
+        with tempfile.TemporaryDirectory() as workspace:
+            with open(os.path.join(workspace, "OWNERS"), "w") as f:
+                yaml.dump({"approvers": ["approver"]}, f)
+            index = entrypoint.get_auth_index(workspace, "OWNERS")
+            with patch.object(entrypoint.Owners, 'to_dict') as to_dict:
+                self.assertIs(entrypoint.get_auth_index(workspace, "OWNERS"), index)
+            to_dict.assert_not_called()
+
+            with open(os.path.join(workspace, "OWNERS"), "w") as f:
+                yaml.dump({"approvers": ["someone-else"]}, f)
+            changed = entrypoint.get_auth_index(workspace, "OWNERS")
+
+        self.assertIn("someone-else", changed.logins)
+        self.assertNotIn("someone-else", index.logins)
+        print("✅ Success: Index reused until OWNERS changed.")
+
+class TestChangedFiles(unittest.TestCase):
+    def setUp(self):
+        self.client = entrypoint.GitHubClient("dummy-token")
+        self.api_url = "https://api.github.com/repos/test/repo"
+        self.base = f"{self.api_url}/pulls/42/files?per_page=100"
+
+    def tearDown(self):
+        self.client.session.close()
+
+    def paged_get(self, pages, with_last=True):
+        """Serve `pages` (a list of path lists) keyed by the page query parameter."""
+        def get(url, **kwargs):
+            page = int(dict(entrypoint.parse_qsl(entrypoint.urlsplit(url).query)).get("page", "1"))
+            response = MagicMock()
+            response.status_code = 200
+            response.json.return_value = [{"filename": p} for p in pages[page - 1]]
+            response.links = {}
+            if page < len(pages):
+                response.links["next"] = {"url": f"{self.base}&page={page + 1}"}
+                if with_last:
+                    response.links["last"] = {"url": f"{self.base}&page={len(pages)}"}
+            return response
+        return get
+
+    @patch('requests.Session.get')
+    def test_concurrent_pages_from_last_link(self, mock_get):
+        print("\n--- Testing changed files fetched concurrently after first page ---")
+
+        mock_get.side_effect = self.paged_get([["a.py"], ["b.py"], ["c.py"]])
+        files = entrypoint.ChangedFiles(self.client, self.api_url, 42, workers=3)
+
+        self.assertEqual(sorted(files), ["a.py", "b.py", "c.py"])
+        self.assertEqual(files.count, 3)
+        self.assertEqual(mock_get.call_count, 3)
+        self.assertFalse(files.truncated)
+        print("✅ Success: All pages streamed.")
+
+    @patch('requests.Session.get')
+    def test_follows_next_links(self, mock_get):
+        print("\n--- Testing changed files follow next links ---")
+
+        mock_get.side_effect = self.paged_get([["a.py"], ["b.py"]], with_last=False)
+        files = entrypoint.ChangedFiles(self.client, self.api_url, 42)
+
+        self.assertEqual(list(files), ["a.py", "b.py"])
+        print("✅ Success: Next links followed.")
+
+    @patch('entrypoint.MAX_PR_FILES', 2)
+    @patch('requests.Session.get')
+    def test_truncated_listing_flagged(self, mock_get):
+        print("\n--- Testing file listing at the API cap is flagged ---")
+
+        mock_get.side_effect = self.paged_get([["a.py", "b.py"]])
+        files = entrypoint.ChangedFiles(self.client, self.api_url, 42)
+        list(files)
+
+        self.assertTrue(files.truncated)
+        print("✅ Success: Truncation detected.")
+
+class TestWebhookServer(unittest.TestCase):
+    def setUp(self):
+        isolate_caches(self)
+        self.processed = []
+
+    def record(self, events, token, owners_path):
+        time.sleep(max(event.get("delay", 0) for event in events))
+        self.processed.append([event["id"] for event in events])
+        return True
+
+    def signed_request(self, event, secret="s3cret", name="issue_comment"):
+        body = json.dumps(event).encode()
+        signature = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return (f"POST / HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n"
+                f"X-GitHub-Event: {name}\r\nX-Hub-Signature-256: {signature}\r\n\r\n").encode() + body
+
+    async def deliver(self, port, raw, eof=False):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(raw)
+        if eof:
+            writer.write_eof()
+        await writer.drain()
+        status_line = await reader.readline()
+        writer.close()
+        return int(status_line.split()[1])
+
+    def run_server(self, deliveries, eof=False, read_timeout=entrypoint.WEBHOOK_READ_TIMEOUT):
+        async def scenario():
+            server = entrypoint.WebhookServer("s3cret", "dummy-token", "OWNERS", workers=4, dispatch=self.record,
+                                              read_timeout=read_timeout)
+            port = await server.start("127.0.0.1", 0)
+            statuses = [await self.deliver(port, raw, eof) for raw in deliveries]
+            await server.close()
+            return statuses
+        return asyncio.run(scenario())
+
+    def pr_event(self, event_id, number, delay=0):
+        return {"id": event_id, "delay": delay, "action": "created",
+                "comment": {"body": "/lgtm", "user": {"login": "reviewer"}},
+                "issue": {"number": number, "pull_request": {"url": f"https://api.github.com/repos/test/repo/pulls/{number}"}},
+                "repository": {"full_name": "test/repo"}}
+
+    def test_rejects_bad_signature(self):
+        print("\n--- Testing webhook server rejects bad signatures ---")
+
+        statuses = self.run_server([self.signed_request(self.pr_event(1, 42), secret="wrong")])
+
+        self.assertEqual(statuses, [401])
+        self.assertEqual(self.processed, [])
+        print("✅ Success: Forged delivery rejected.")
+
+    def test_rejects_malformed_bodies(self):
+        print("\n--- Testing webhook server rejects short or negative bodies ---")
+
+        raw = self.signed_request(self.pr_event(1, 42))
+        negative = raw.replace(b"Content-Length: ", b"Content-Length: -", 1)
+        statuses = self.run_server([raw[:-10], negative], eof=True)
+
+        self.assertEqual(statuses, [400, 400])
+        self.assertEqual(self.processed, [])
+        print("✅ Success: Truncated and negative-length bodies answered with 400.")
+
+    def test_stalled_client_times_out(self):
+        print("\n--- Testing webhook server times out stalled clients ---")
+
+        raw = self.signed_request(self.pr_event(1, 42))
+        statuses = self.run_server([raw[:20], raw[:-10]], read_timeout=0.1)
+
+        self.assertEqual(statuses, [408, 408])
+        self.assertEqual(self.processed, [])
+        print("✅ Success: Stalled headers and bodies answered with 408.")
+
+    def test_same_pr_events_stay_ordered(self):
+        print("\n--- Testing events for one PR are processed in order ---")
+
+        statuses = self.run_server([
+            self.signed_request(self.pr_event(1, 42, delay=0.2)),
+            self.signed_request(self.pr_event(2, 7)),
+            self.signed_request(self.pr_event(3, 42)),
+        ])
+
+        self.assertEqual(statuses, [202, 202, 202])
+        # PR 7 overtakes the slow event on PR 42, but PR 42's events stay in order
+        self.assertLess(self.processed.index([2]), self.processed.index([1]))
+        self.assertLess(self.processed.index([1]), self.processed.index([3]))
+        print("✅ Success: Per-PR ordering kept with cross-PR concurrency.")
+
+    def test_burst_for_one_pr_is_coalesced(self):
+        print("\n--- Testing a burst of events for one PR is coalesced ---")
+
+        statuses = self.run_server([
+            self.signed_request(self.pr_event(1, 42, delay=0.2)),
+            self.signed_request(self.pr_event(2, 42)),
+            self.signed_request(self.pr_event(3, 42)),
+        ])
+
+        self.assertEqual(statuses, [202, 202, 202])
+        self.assertEqual(self.processed, [[1], [2, 3]])
+        print("✅ Success: Queued events handled as one batch.")
+
+    def test_ignores_changed_comments_and_plain_issues(self):
+        print("\n--- Testing only new comments on PRs are handled ---")
+
+        edited, deleted, on_issue, review = (self.pr_event(n, 42) for n in range(2, 6))
+        edited["action"] = "edited"
+        deleted["action"] = "deleted"
+        del on_issue["issue"]["pull_request"]
+        statuses = self.run_server([
+            self.signed_request(self.pr_event(1, 42)),
+            self.signed_request(edited),
+            self.signed_request(deleted),
+            self.signed_request(on_issue),
+            self.signed_request(review, name="pull_request_review_comment"),
+        ])
+
+        self.assertEqual(statuses, [202] * 5)
+        self.assertEqual(self.processed, [[1]])
+        print("✅ Success: Edited, deleted and issue comments acknowledged but skipped.")
+
+class TestCoalescedDispatch(unittest.TestCase):
+    def setUp(self):
+        isolate_caches(self)
+        with open("OWNERS", "w") as f:
+            yaml.dump({"approvers": ["approver"], "reviewers": ["approver", "reviewer"]}, f)
+        os.environ["GITHUB_WORKSPACE"] = os.getcwd()
+
+        stub_network(self)
+
+    def tearDown(self):
+        if os.path.exists("OWNERS"): os.remove("OWNERS")
+
+    def comment(self, user, body):
+        return {"comment": {"body": body, "user": {"login": user}},
+                "issue": {"number": 42}, "repository": {"full_name": "test/repo"}}
+
+    @patch('requests.Session.put')
+    @patch('requests.Session.get')
+    @patch('requests.Session.delete')
+    @patch('requests.Session.post')
+    def test_burst_makes_one_label_update_and_one_merge(self, mock_post, mock_delete, mock_get, mock_put):
+        print("\n--- Testing coalesced events make one label update and one merge ---")
+
+        mock_post_response = MagicMock()
+        mock_post_response.status_code = 200
+        mock_post_response.json.return_value = [{"name": "lgtm"}, {"name": "approved"}]
+        mock_post.return_value = mock_post_response
+        mock_pr_response = MagicMock()
+        mock_pr_response.status_code = 200
+        mock_pr_response.json.return_value = {"labels": [{"name": "lgtm"}, {"name": "approved"}],
+                                              "mergeable": True, "mergeable_state": "clean"}
+        mock_get.return_value = mock_pr_response
+
+        events = [
+            self.comment("reviewer", "/lgtm"),
+            self.comment("approver", "/hold"),
+            {"action": "unlabeled", "pull_request": {"number": 42}, "label": {"name": "lgtm"},
+             "sender": {"login": "github-actions[bot]"}, "repository": {"full_name": "test/repo"}},
+            self.comment("approver", "/hold cancel\n/approve"),
+        ]
+        entrypoint.dispatch_events(events, "dummy-token", "OWNERS")
+
+        mock_post.assert_called_once_with(
+            "https://api.github.com/repos/test/repo/issues/42/labels",
+            json={"labels": ["lgtm", "approved"]},
+            timeout=10.0
+        )
+        mock_delete.assert_called_once_with(
+            "https://api.github.com/repos/test/repo/issues/42/labels/hold",
+            timeout=10.0
+        )
+        mock_get.assert_called_once()
+        mock_put.assert_called_once()
+        print("✅ Success: Burst coalesced.")
+
+    @patch('requests.Session.get')
+    @patch('requests.Session.delete')
+    @patch('requests.Session.post')
+    def test_contradictory_label_events_change_nothing(self, mock_post, mock_delete, mock_get):
+        print("\n--- Testing a burst of label events is reconciled against the snapshot ---")
+
+        entrypoint.record_expected_labels("test/repo", 42, ["lgtm"])
+        labels_response = MagicMock()
+        labels_response.status_code = 200
+        labels_response.json.return_value = [{"name": "lgtm"}]
+        mock_get.return_value = labels_response
+
+        def label_event(action):
+            return {"action": action, "pull_request": {"number": 42}, "label": {"name": "lgtm"},
+                    "sender": {"login": "random-user"}, "repository": {"full_name": "test/repo"}}
+        entrypoint.dispatch_events([label_event("unlabeled"), label_event("labeled")], "dummy-token", "OWNERS")
+
+        mock_get.assert_called_once()
+        self.assertTrue(mock_get.call_args.args[0].endswith("/issues/42/labels"))
+        mock_delete.assert_not_called()
+        mock_post.assert_not_called()
+        print("✅ Success: Label the bot set kept, one read for the batch.")
+
+class TestAsyncHandlers(unittest.TestCase):
+    def setUp(self):
+        isolate_caches(self)
+        with open("OWNERS", "w") as f:
+            yaml.dump({"approvers": ["approver"], "reviewers": ["approver", "reviewer"]}, f)
+        os.environ["GITHUB_WORKSPACE"] = os.getcwd()
+        entrypoint._merge_controller = None
+
+        stub_network(self)
+
+    def tearDown(self):
+        if os.path.exists("OWNERS"): os.remove("OWNERS")
+
+    def response(self, status, payload):
+        response = MagicMock()
+        response.status_code = status
+        response.json.return_value = payload
+        return response
+
+    @patch('requests.Session.post')
+    def test_plan_effects_run_concurrently(self, mock_post):
+        print("\n--- Testing a plan's label update, review request and assignment overlap ---")
+
+        # Each call waits for the other two, so running them one after
+        # another would break the barrier.
+        barrier = threading.Barrier(3, timeout=5)
+        def post(url, **kwargs):
+            barrier.wait()
+            return self.response(201 if not url.endswith("/labels") else 200, [{"name": "lgtm"}])
+        mock_post.side_effect = post
+
+        plan = entrypoint.CommandPlan()
+        plan.set_label("lgtm", True)
+        plan.reviewers = ["reviewer"]
+        plan.assignees = ["approver"]
+        state = entrypoint.apply_plan(entrypoint.get_client("dummy-token"), "test/repo", 42, plan)
+
+        self.assertEqual(mock_post.call_count, 3)
+        self.assertEqual(state.labels, ["lgtm"])
+        print("✅ Success: Independent effects overlapped.")
+
+    @patch('requests.Session.get')
+    @patch('requests.Session.post')
+    def test_state_read_overlaps_review_request(self, mock_post, mock_get):
+        print("\n--- Testing the PR is read while a /cc is in flight ---")
+
+        barrier = threading.Barrier(2, timeout=5)
+        def call(payload, status):
+            def side_effect(url, **kwargs):
+                barrier.wait()
+                return self.response(status, payload)
+            return side_effect
+        mock_post.side_effect = call({}, 201)
+        mock_get.side_effect = call({"labels": [{"name": "lgtm"}]}, 200)
+
+        event = {"comment": {"body": "/cc @approver", "user": {"login": "reviewer"}},
+                 "issue": {"number": 42}, "repository": {"full_name": "test/repo"}}
+        self.assertTrue(entrypoint.dispatch_event(event, "dummy-token", "OWNERS"))
+
+        # The merge check used the state read alongside the review request.
+        mock_get.assert_called_once()
+        print("✅ Success: State read overlapped the review request.")
+
+    @patch('requests.Session.post')
+    def test_parallelism_bounded_by_pool_size(self, mock_post):
+        print("\n--- Testing concurrent calls are bounded by HTTP_POOL_SIZE ---")
+
+        lock = threading.Lock()
+        in_flight = [0, 0]
+        def post(url, **kwargs):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            time.sleep(0.1)
+            with lock:
+                in_flight[0] -= 1
+            return self.response(201, [])
+        mock_post.side_effect = post
+
+        plan = entrypoint.CommandPlan()
+        plan.set_label("kind/bug", True)
+        plan.reviewers = ["reviewer"]
+        plan.assignees = ["approver"]
+        with patch.dict(os.environ, {"HTTP_POOL_SIZE": "2"}):
+            entrypoint.apply_plan(entrypoint.get_client("dummy-token"), "test/repo", 42, plan)
+
+        self.assertEqual(mock_post.call_count, 3)
+        self.assertEqual(in_flight[1], 2)
+        print("✅ Success: At most two calls in flight.")
+
+class TestSweep(unittest.TestCase):
+    def setUp(self):
+        isolate_caches(self)
+        entrypoint._merge_controller = None
+        stub_network(self)
+
+    def tearDown(self):
+        entrypoint._merge_controller = None
+
+    def pr(self, number, labels, draft=False):
+        return {"number": number, "draft": draft, "labels": [{"name": label} for label in labels],
+                "head": {"sha": f"sha{number}"}, "base": {"ref": "main"}}
+
+    @patch('requests.Session.put')
+    @patch('requests.Session.get')
+    @patch('requests.Session.post')
+    def test_sweep_merges_ready_and_fixes_drifted_prs(self, mock_post, mock_get, mock_put):
+        print("\n--- Testing sweep reconciles every open PR ---")
+
+        pulls_url = "https://api.github.com/repos/test/repo/pulls?state=open&per_page=100"
+        first_page = MagicMock()
+        first_page.status_code = 200
+        first_page.json.return_value = [self.pr(1, ["lgtm", "approved"]), self.pr(2, ["lgtm"])]
+        first_page.links = {"next": {"url": pulls_url + "&page=2"}}
+        second_page = MagicMock()
+        second_page.status_code = 200
+        second_page.json.return_value = [self.pr(3, ["lgtm", "approved"], draft=True), self.pr(4, ["approved"])]
+        second_page.links = {}
+        ready = MagicMock()
+        ready.status_code = 200
+        ready.json.return_value = {"labels": [{"name": "lgtm"}, {"name": "approved"}],
+                                   "mergeable": True, "mergeable_state": "clean"}
+        pages = {pulls_url: first_page, pulls_url + "&page=2": second_page}
+        mock_get.side_effect = lambda url, **kwargs: pages.get(url, ready)
+
+        # The bot had set lgtm on #4 before someone removed it by hand.
+        entrypoint.record_expected_labels("test/repo", 4, ["lgtm", "approved"])
+        post_response = MagicMock()
+        post_response.status_code = 200
+        post_response.json.return_value = [{"name": "lgtm"}, {"name": "approved"}]
+        mock_post.return_value = post_response
+        put_response = MagicMock()
+        put_response.status_code = 200
+        mock_put.return_value = put_response
+
+        outcomes = entrypoint.sweep("test/repo", "dummy-token", workers=2)
+
+        self.assertEqual(outcomes, {"merged": 2, "unchanged": 1, "skipped": 1})
+        # Two listing pages, then one mergeability read per PR ready to merge.
+        self.assertEqual(mock_get.call_count, 4)
+        mock_post.assert_called_once_with(
+            "https://api.github.com/repos/test/repo/issues/4/labels",
+            json={"labels": ["lgtm"]},
+            timeout=10.0
+        )
+        merged = sorted(call.args[0] for call in mock_put.call_args_list)
+        self.assertEqual(merged, ["https://api.github.com/repos/test/repo/pulls/1/merge",
+                                  "https://api.github.com/repos/test/repo/pulls/4/merge"])
+        print("✅ Success: Ready PR merged and drifted PR fixed and merged.")
+
+class TestOrgRunner(unittest.TestCase):
+    def setUp(self):
+        isolate_caches(self)
+        entrypoint._client = None
+        stub_network(self)
+
+    def tearDown(self):
+        entrypoint._client = None
+
+    def test_budget_is_split_fairly_between_repositories(self):
+        print("\n--- Testing the rate budget is shared fairly between repositories ---")
+
+        client = entrypoint.GitHubClient("dummy-token")
+        client.rate_limit = 10
+        client.rate_reset = time.time() + 3600
+        budget = entrypoint.RateBudget(client, reserve=0)
+        for _ in range(5):
+            budget.acquire("https://api.github.com/repos/org/a/pulls")
+        for _ in range(2):
+            budget.acquire("https://api.github.com/repos/org/b/pulls")
+
+        # org/a has used its half of the window and must wait...
+        blocked = threading.Thread(target=budget.acquire, args=("https://api.github.com/repos/org/a/pulls",))
+        blocked.start()
+        blocked.join(0.2)
+        self.assertTrue(blocked.is_alive())
+
+        # ...until org/b is done and leaves its unused share behind.
+        budget.finish("org/b")
+        blocked.join(2)
+        self.assertFalse(blocked.is_alive())
+        self.assertEqual(budget.spent, {"org/a": 6, "org/b": 2})
+        budget.acquire("https://api.github.com/graphql")
+        self.assertEqual(budget.spent, {"org/a": 6, "org/b": 2})
+        print("✅ Success: Budget split and released fairly.")
+
+    def test_finished_repository_releases_its_share(self):
+        print("\n--- Testing a finished repository releases its share ---")
+
+        client = entrypoint.GitHubClient("dummy-token")
+        client.clock = lambda: 1000.0
+        client.rate_limit = 10
+        client.rate_reset = 2000.0
+        budget = entrypoint.RateBudget(client, reserve=0)
+        for url in ["a/pulls", "b/pulls", "b/pulls"]:
+            budget.acquire("https://api.github.com/repos/org/" + url)
+        self.assertEqual(budget.share("org/a"), 5)
+
+        budget.finish("org/b")
+        self.assertEqual(budget.finished, {"org/b"})
+        self.assertEqual(budget.share("org/a"), 8)
+
+        # A finished repository that makes another request is active again.
+        budget.acquire("https://api.github.com/repos/org/b/pulls")
+        self.assertEqual(budget.finished, set())
+        self.assertEqual(budget.share("org/a"), 5)
+
+        # A new window starts every repository over.
+        client.rate_reset = 5000.0
+        budget.finish("org/a")
+        budget.acquire("https://api.github.com/repos/org/b/pulls")
+        self.assertEqual(budget.spent, {"org/b": 1})
+        self.assertEqual(budget.finished, set())
+        print("✅ Success: Finished share released deterministically.")
+
+    @patch('requests.Session.get')
+    def test_sweep_repositories_shares_one_client(self, mock_get):
+        print("\n--- Testing one process sweeps many repositories ---")
+
+        def get(url, **kwargs):
+            response = MagicMock()
+            response.status_code = 500 if "/org/broken/" in url else 200
+            response.json.return_value = []
+            response.links = {}
+            return response
+        mock_get.side_effect = get
+
+        with patch.dict(os.environ, {"HTTP_MAX_RETRIES": "0"}):
+            results = entrypoint.sweep_repositories(["org/a", "org/b", "org/broken"], "dummy-token", workers=2)
+
+        self.assertEqual(results, {"org/a": {}, "org/b": {}, "org/broken": None})
+        self.assertIsNotNone(entrypoint._client.budget)
+        print("✅ Success: Repositories swept with a shared client and budget.")
+
+class TestColdStart(unittest.TestCase):
+    # Wall time allowed for a whole run, interpreter start included.
+    BUDGET = float(os.environ.get("COLD_START_BUDGET", "0.5"))
+
+    def test_unsupported_event_exits_fast_without_heavy_imports(self):
+        print("\n--- Testing cold start for an event the bot ignores ---")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            event_path = os.path.join(tmp, "event.json")
+            with open(event_path, "w") as f:
+                json.dump({"action": "closed", "pull_request": {"number": 42}}, f)
+            script = (
+                "import sys, entrypoint\n"
+                "try:\n"
+                "    entrypoint.main()\n"
+                "except SystemExit:\n"
+                "    pass\n"
+                "print([name for name in ('urllib3', 'yaml.constructor', 'asyncio.base_events') if name in sys.modules])\n"
+            )
+            env = dict(os.environ, GITHUB_EVENT_PATH=event_path)
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)))
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("Event type not recognized", result.stdout)
+        self.assertEqual(result.stdout.strip().splitlines()[-1], "[]")
+        self.assertLess(elapsed, self.BUDGET)
+        print(f"✅ Success: Ignored event handled in {elapsed * 1000:.0f} ms without loading requests, yaml or asyncio.")
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        isolate_caches(self)
+        with open("OWNERS", "w") as f:
+            yaml.dump({"approvers": ["approver"], "reviewers": ["approver", "reviewer"]}, f)
+        self.trace_dir = tempfile.TemporaryDirectory()
+        os.environ["GITHUB_TOKEN"] = "dummy-token"
+        os.environ["OWNERS_FILE"] = "OWNERS"
+        os.environ["GITHUB_EVENT_PATH"] = "event.json"
+        os.environ["GITHUB_WORKSPACE"] = os.getcwd()
+        os.environ["TRACE_FILE"] = os.path.join(self.trace_dir.name, "trace.jsonl")
+        os.environ["TRACE_SUMMARY"] = "true"
+        os.environ["GITHUB_STEP_SUMMARY"] = os.path.join(self.trace_dir.name, "summary.md")
+        entrypoint._tracer = None
+
+        stub_network(self)
+
+    def tearDown(self):
+        for name in ["TRACE_FILE", "TRACE_SUMMARY", "GITHUB_STEP_SUMMARY"]:
+            del os.environ[name]
+        entrypoint._tracer = None
+        self.trace_dir.cleanup()
+        if os.path.exists("OWNERS"): os.remove("OWNERS")
+        if os.path.exists("event.json"): os.remove("event.json")
+
+    @patch('requests.Session.post')
+    def test_run_writes_spans_and_step_summary(self, mock_post):
+        print("\n--- Testing a run is traced to JSON lines and the step summary ---")
+
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.content = b'[{"name": "lgtm"}]'
+        mock_response.json.return_value = [{"name": "lgtm"}]
+        mock_post.return_value = mock_response
+
+        createGitHubEvent("reviewer", "/lgtm")
+        entrypoint.main()
+
+        with open(os.environ["TRACE_FILE"]) as f:
+            spans = [json.loads(line) for line in f]
+        names = {span["name"] for span in spans}
+        self.assertTrue({"event.load", "dispatch", "commands.plan", "owners.resolve", "api"} <= names)
+        api = next(span for span in spans if span["name"] == "api")
+        self.assertEqual(api["attributes"], {"method": "post", "route": "/repos/{repo}/issues/{n}/labels",
+                                             "status": 200, "retries": 0, "bytes": 18})
+        dispatch = next(span for span in spans if span["name"] == "dispatch")
+        self.assertEqual(api["trace_id"], dispatch["trace_id"])
+
+        with open(os.environ["GITHUB_STEP_SUMMARY"]) as f:
+            summary = f.read()
+        self.assertIn("### Owners bot timing", summary)
+        self.assertIn("| `POST /repos/{repo}/issues/{n}/labels` | 1 |", summary)
+        print("✅ Success: Spans and summary written.")
+
+    @patch('requests.post')
+    def test_spans_exported_to_otlp_collector(self, mock_post):
+        print("\n--- Testing spans are exported to an OTLP collector ---")
+
+        tracer = entrypoint.Tracer(otlp_endpoint="http://localhost:4318")
+        with tracer.span("dispatch"):
+            with tracer.span("api", method="get", status=200):
+                pass
+        tracer.flush()
+
+        url = mock_post.call_args.args[0]
+        spans = mock_post.call_args.kwargs["json"]["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        self.assertEqual(url, "http://localhost:4318/v1/traces")
+        self.assertEqual([span["name"] for span in spans], ["api", "dispatch"])
+        self.assertEqual(spans[0]["parentSpanId"], spans[1]["spanId"])
+        self.assertIn({"key": "status", "value": {"intValue": "200"}}, spans[0]["attributes"])
+        self.assertEqual(tracer.spans, [])
+        print("✅ Success: OTLP export request sent.")
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves the next scripted (status, headers[, body]) reply for every request."""
+
+    def _reply(self):
+        self.server.seen.append((self.command, self.path))
+        self.server.request_headers.append(dict(self.headers))
+        status, headers, *body = self.server.script.pop(0) if self.server.script else (200, {})
+        body = body[0] if body else b"" if status == 304 else b"{}"
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _reply
+
+    def log_message(self, *args):
+        pass
+
+class TestGitHubClient(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        self.server.script = []
+        self.server.seen = []
+        self.server.request_headers = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.client = entrypoint.GitHubClient("dummy-token", base_url=base_url, backoff=0)
+        self.now = 1000.0
+        self.sleeps = []
+        self.client.clock = lambda: self.now
+        self.client.sleep = self.fake_sleep
+        self.url = f"{base_url}/repos/test/repo/issues/42/labels"
+
+    def fake_sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.client.session.close()
+
+    def test_retry_after_secondary_limit(self):
+        print("\n--- Testing Retry-After on secondary rate limit ---")
+
+        self.server.script = [(403, {"Retry-After": "2"}), (200, {})]
+        response = self.client.post(self.url, json={"labels": ["lgtm"]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.server.seen), 2)
+        self.assertEqual(self.client.stats["retries"], 1)
+        self.assertEqual(self.client.stats["throttled_seconds"], 2.0)
+        print("✅ Success: Request retried after Retry-After.")
+
+    def test_secondary_limit_without_retry_after(self):
+        print("\n--- Testing secondary rate limit without Retry-After waits a minute ---")
+
+        message = b'{"message": "You have exceeded a secondary rate limit. Please wait a few minutes."}'
+        self.server.script = [(403, {"X-RateLimit-Remaining": "4000"}, message), (200, {})]
+        response = self.client.post(self.url, json={"labels": ["lgtm"]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.server.seen), 2)
+        self.assertEqual(self.sleeps, [entrypoint.SECONDARY_LIMIT_WAIT])
+        print("✅ Success: Secondary limit waited out before retrying.")
+
+    def test_long_retry_after_not_waited(self):
+        print("\n--- Testing waits beyond max_backoff give up ---")
+
+        self.server.script = [(429, {"Retry-After": "3600"}), (200, {})]
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(len(self.server.seen), 1)
+        self.assertEqual(self.sleeps, [])
+        print("✅ Success: Throttled response returned instead of stalling.")
+
+    def test_retry_server_errors_until_limit(self):
+        print("\n--- Testing 5xx retries give up after max_retries ---")
+
+        self.server.script = [(502, {})] * 10
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(len(self.server.seen), self.client.max_retries + 1)
+        print("✅ Success: Retries bounded.")
+
+    def test_plain_forbidden_not_retried(self):
+        print("\n--- Testing permission 403 is not retried ---")
+
+        self.server.script = [(403, {"X-RateLimit-Remaining": "4000"})]
+        response = self.client.delete(self.url + "/lgtm")
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(len(self.server.seen), 1)
+        print("✅ Success: Permission error returned immediately.")
+
+    def test_paces_when_budget_exhausted(self):
+        print("\n--- Testing requests wait for rate limit reset ---")
+
+        self.server.script = [(200, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "1030"}), (200, {})]
+        self.client.get(self.url)
+        self.client.get(self.url)
+
+        self.assertEqual(self.sleeps, [30.0])
+        self.assertEqual(self.client.stats["throttled_seconds"], 30.0)
+        print("✅ Success: Request paced until reset.")
+
+    def test_conditional_get_served_from_cache(self):
+        print("\n--- Testing 304 responses are served from the response cache ---")
+
+        cache_dir = tempfile.TemporaryDirectory()
+        self.client.cache = entrypoint.ResponseCache(cache_dir.name)
+        self.server.script = [(200, {"ETag": '"v1"'}), (304, {})]
+        self.client.get(self.url)
+        # A later event runs with a new job token.
+        response = entrypoint.GitHubClient("next-job-token", base_url=self.client.base_url,
+                                           cache=entrypoint.ResponseCache(cache_dir.name)).get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {})
+        self.assertEqual(response.headers["ETag"], '"v1"')
+        self.assertNotIn("If-None-Match", self.server.request_headers[0])
+        self.assertEqual(self.server.request_headers[1]["If-None-Match"], '"v1"')
+        cache_dir.cleanup()
+        print("✅ Success: Unchanged read answered from the disk cache.")
+
+    def test_response_cache_evicts_least_recently_used(self):
+        print("\n--- Testing the response cache stays within its size bound ---")
+
+        cache_dir = tempfile.TemporaryDirectory()
+        self.client.cache = entrypoint.ResponseCache(cache_dir.name, max_bytes=4)
+        self.server.script = [(200, {"ETag": '"a"'}), (200, {"ETag": '"b"'}), (200, {"ETag": '"c"'})]
+        for page in range(3):
+            self.client.get(self.url, params={"page": page})
+
+        self.assertEqual(len(os.listdir(cache_dir.name)), 2)
+        self.assertIsNone(self.client.cache.lookup(self.client._cache_key(self.url, {"page": 0})))
+        self.assertIsNotNone(self.client.cache.lookup(self.client._cache_key(self.url, {"page": 2})))
+        cache_dir.cleanup()
+        print("✅ Success: Oldest response evicted.")
+
+    def test_response_cache_skips_vanished_files(self):
+        print("\n--- Testing the response cache ignores files evicted while loading ---")
+
+        cache_dir = tempfile.TemporaryDirectory()
+        for key in ("kept", "gone"):
+            with open(os.path.join(cache_dir.name, f"{key}.json"), "w") as f:
+                f.write("{}")
+        real_stat = os.stat
+        def stat(path, *args, **kwargs):
+            if path.endswith("gone.json"):
+                raise FileNotFoundError(path)
+            return real_stat(path, *args, **kwargs)
+        with patch("os.stat", side_effect=stat):
+            cache = entrypoint.ResponseCache(cache_dir.name)
+
+        self.assertEqual(list(cache.sizes), ["kept"])
+        self.assertEqual(cache.total, 2)
+        cache_dir.cleanup()
+        print("✅ Success: Vanished cache file skipped.")
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        isolate_caches(self)
+        self.github = bench.FakeGitHub().start()
+
+    def tearDown(self):
+        self.github.stop()
+
+    def test_replay_counts_api_calls_per_event(self):
+        print("\n--- Testing events replay against the GitHub stand-in ---")
+
+        events = [
+            {"comment": {"body": "/lgtm", "user": {"login": "reviewer1"}},
+             "issue": {"number": 7}, "repository": {"full_name": "bench/repo"}},
+            {"comment": {"body": "/approve", "user": {"login": "approver1"}},
+             "issue": {"number": 7}, "repository": {"full_name": "bench/repo"}},
+            {"action": "closed", "pull_request": {"number": 7}, "repository": {"full_name": "bench/repo"}},
+        ]
+        samples = bench.replay(events, self.github)
+        report = bench.summarize(samples, 1.0)
+
+        # Each command costs its label POST; once the labels allow it,
+        # /approve also reads the PR's mergeability and sends the merge.
+        self.assertEqual([calls for _, _, calls in samples], [1, 3, 0])
+        self.assertEqual(self.github.pull("bench/repo", 7)["labels"], ["lgtm", "approved"])
+        self.assertTrue(self.github.pull("bench/repo", 7)["merged"])
+        self.assertEqual(report["kinds"]["comment"]["calls_per_event"], 2.0)
+        self.assertEqual(report["kinds"]["ignored"]["events"], 1)
+        self.assertIsNone(entrypoint._client)
+        print("✅ Success: Calls per event counted and PR merged.")
+
+    def test_stand_in_paginates_and_revalidates(self):
+        print("\n--- Testing the stand-in paginates and answers conditional GETs ---")
+
+        for number in range(1, 151):
+            self.github.add_pull("bench/repo", number)
+        client = entrypoint.GitHubClient("bench-token", base_url=self.github.url,
+                                         cache=entrypoint.ResponseCache())
+        pulls = list(entrypoint.open_pull_requests(client, "bench/repo"))
+        list(entrypoint.open_pull_requests(client, "bench/repo"))
+        client.session.close()
+
+        self.assertEqual(len(pulls), 150)
+        self.assertEqual(self.github.calls["GET /repos/{repo}/pulls"], 4)
+        self.assertEqual(self.github.not_modified, 2)
+        self.assertEqual(client.rate_remaining, self.github.rate_limit - 2)
+        print("✅ Success: Pages followed and unchanged pages revalidated.")
+
+    def test_compare_flags_regressions(self):
+        print("\n--- Testing regressions against the baseline are reported ---")
+
+        baseline = {"throughput": 100.0, "kinds": {"comment": {"calls_per_event": 1.5, "p99_ms": 10.0}}}
+        report = {"throughput": 90.0, "kinds": {"comment": {"calls_per_event": 2.0, "p99_ms": 25.0}}}
+
+        regressions = bench.compare(report, baseline, latency_tolerance=1.0)
+
+        self.assertEqual(regressions, ["comment: 2.0 API calls/event, baseline 1.5",
+                                       "comment: p99 25.0 ms, baseline 10.0 ms"])
+        self.assertEqual(bench.compare(report, baseline), ["comment: 2.0 API calls/event, baseline 1.5"])
+        self.assertEqual(bench.compare(baseline, baseline), [])
+        print("✅ Success: Extra API calls and slower p99 flagged.")
+
 if __name__ == '__main__':
     unittest.main()